@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Aho-Corasick - 複数のキーワードを本文の1回の走査で数える文字単位のオートマトン
+キーワードの数に関係なく、走査の手間は本文の長さに比例する
+"""
+
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Tuple
+
+
+class KeywordAutomaton:
+    """キーワードの出現回数（重なりも数える）を1回の走査で求める"""
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: List[str] = []
+        # 状態ごとの遷移・失敗時の戻り先・そこで終わるキーワード番号
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]
+
+        seen = set()
+        for keyword in keywords:
+            if keyword and keyword not in seen:
+                seen.add(keyword)
+                self._insert(keyword)
+        self._alphabet = frozenset(char for keyword in self.keywords for char in keyword)
+        self._link()
+
+    def _insert(self, keyword: str):
+        state = 0
+        for char in keyword:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = following
+        self._output[state] += (len(self.keywords),)
+        self.keywords.append(keyword)
+
+    def _link(self):
+        """幅優先で失敗時の戻り先を決め、戻り先で終わるキーワードも出力に含める"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[following] = target if target != following else 0
+                self._output[following] += self._output[self._fail[following]]
+
+    def count(self, text: str) -> Counter:
+        """本文に含まれるキーワードとその出現回数"""
+        goto, fail, output, alphabet = self._goto, self._fail, self._output, self._alphabet
+        hits = [0] * len(self.keywords)
+        state = 0
+        for char in text:
+            # キーワードに使われない文字ではどの途中状態も続かない
+            if char not in alphabet:
+                state = 0
+                continue
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                hits[index] += 1
+        return Counter({self.keywords[index]: count for index, count in enumerate(hits) if count})
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析デーモン - 分析エンジンを常駐させ、プレビュー・保存ごとの起動コストを省く
+Unixソケット上で1行1リクエストのJSONプロトコルを使う
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import socket
+import logging
+import threading
+import subprocess
+import socketserver
+from typing import Callable, Dict, Optional, Tuple
+
+from app_settings import get_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# (mode, content, その他のオプション, 途中出力) -> (出力テキスト, 終了コード)
+RequestHandler = Callable[[str, str, Dict, Callable[[str], None]], Tuple[str, int]]
+
+
+def get_socket_path() -> str:
+    """ソケットのパスを取得"""
+    return os.getenv('MEMO_CLASSIFIER_SOCKET') or os.path.join(get_cache_dir(), 'analysis.sock')
+
+
+def _lock_path(socket_path: str) -> str:
+    """サーバーが稼働中ずっと排他ロックを持つファイル（起動中・稼働中のサーバーは1つだけ）"""
+    return f"{socket_path}.lock"
+
+
+def _try_lock(socket_path: str) -> Optional[int]:
+    """サーバーのロックを取る（他のサーバーが持っていればNone）"""
+    fd = os.open(_lock_path(socket_path), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class _AnalysisRequestHandler(socketserver.StreamRequestHandler):
+    """1接続につき1リクエストを処理（途中出力は {"line": ...} として先に送る）"""
+
+    def _emit(self, line: str):
+        self.wfile.write(json.dumps({'line': line}, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def handle(self):
+        self.server.touch()
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            mode = request.get('mode', '')
+
+            if mode == 'ping':
+                response = {'output': 'PONG', 'exit_code': 0}
+            elif mode == 'shutdown':
+                response = {'output': 'STOPPING', 'exit_code': 0}
+                self.server.request_stop()
+            else:
+                content = request.pop('content', '')
+                request.pop('mode', None)
+                output, exit_code = self.server.handler(mode, content, request, self._emit)
+                response = {'output': output, 'exit_code': exit_code}
+
+        except Exception as e:
+            logger.error(f"リクエスト処理エラー: {e}", exc_info=True)
+            response = {'output': f"ERROR: {e}", 'exit_code': 1}
+
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.server.touch()
+
+
+class AnalysisServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """分析リクエストを受け付ける常駐サーバー
+
+    生成した時点でソケットを待ち受け始める。handler を設定して serve するまでに届いた接続は
+    待たされるだけで、クライアントが別のサーバーを起動することはない
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, handler: Optional[RequestHandler] = None, idle_timeout: float = 0):
+        self.handler = handler
+        self.idle_timeout = idle_timeout
+        self._last_activity = time.monotonic()
+        self._stopping = False
+
+        self._lock_fd = _try_lock(socket_path)
+        if self._lock_fd is None:
+            raise RuntimeError(f"分析サーバーは既に起動しています: {socket_path}")
+        try:
+            # ロックを取れた以上、残っているソケットは異常終了したサーバーのもの
+            if os.path.lexists(socket_path):
+                os.unlink(socket_path)
+            super().__init__(socket_path, _AnalysisRequestHandler)
+            # 他ユーザーからメモ内容を送られないように所有者のみに限定
+            os.chmod(socket_path, 0o600)
+        except BaseException:
+            os.close(self._lock_fd)
+            raise
+
+    def touch(self):
+        self._last_activity = time.monotonic()
+
+    def request_stop(self):
+        """serve_forever を別スレッドから停止"""
+        if not self._stopping:
+            self._stopping = True
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def service_actions(self):
+        if self.idle_timeout and time.monotonic() - self._last_activity > self.idle_timeout:
+            logger.info("アイドルタイムアウトによりサーバーを停止します")
+            self.request_stop()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+        # ソケットを消してからロックを離す（次のサーバーが待ち受け中のソケットを消さないように）
+        os.close(self._lock_fd)
+
+
+def create_server(socket_path: Optional[str] = None, idle_timeout: float = 0) -> AnalysisServer:
+    """ソケットを待ち受け始める（起動中・稼働中のサーバーがあれば RuntimeError）"""
+    return AnalysisServer(socket_path or get_socket_path(), idle_timeout=idle_timeout)
+
+
+def serve(server: AnalysisServer, handler: RequestHandler):
+    """handler でリクエストを処理し続ける"""
+    server.handler = handler
+    server.touch()
+    logger.info(f"分析サーバー起動: {server.server_address}")
+
+    try:
+        server.serve_forever(poll_interval=0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("分析サーバー停止")
+
+
+def send_request(request: Dict, socket_path: Optional[str] = None,
+                 connect_timeout: float = 1.0,
+                 on_line: Optional[Callable[[str], None]] = None) -> Optional[Dict]:
+    """サーバーにリクエストを送信（接続できなければNone）
+
+    途中出力は届いた順に on_line へ渡し、最終応答を返す。送信後に接続が切れた場合は
+    サーバーが処理を済ませている可能性があるため ConnectionError を送出する
+    """
+    socket_path = socket_path or get_socket_path()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(connect_timeout)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return None
+
+        # 分析自体はAPI待ちで時間がかかるため応答待ちはタイムアウトなし
+        sock.settimeout(None)
+        try:
+            sock.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as reader:
+                for line in reader:
+                    response = json.loads(line.decode('utf-8'))
+                    if 'line' not in response:
+                        return response
+                    if on_line:
+                        on_line(response['line'])
+        except (OSError, ValueError) as e:
+            raise ConnectionError(f"分析サーバーとの接続が切れました: {e}") from e
+        raise ConnectionError("分析サーバーとの接続が応答の途中で切れました")
+    finally:
+        sock.close()
+
+
+def ping(socket_path: Optional[str] = None) -> bool:
+    """サーバーが応答するか確認"""
+    try:
+        response = send_request({'mode': 'ping'}, socket_path=socket_path, connect_timeout=0.5)
+    except ConnectionError:
+        return False
+    return bool(response and response.get('output') == 'PONG')
+
+
+def spawn_server(script_path: str, idle_timeout: float = 3600, socket_path: Optional[str] = None) -> None:
+    """サーバーをバックグラウンドで起動（呼び出し元の出力を塞がないよう完全に切り離す）
+
+    起動中・稼働中のサーバーがロックを持っていれば起動しない
+    """
+    socket_path = socket_path or get_socket_path()
+    try:
+        fd = _try_lock(socket_path)
+    except OSError as e:
+        logger.warning(f"分析サーバーのロックを確認できません: {e}")
+        return
+    if fd is None:
+        logger.info("分析サーバーは起動中のため、新たに起動しません")
+        return
+    # 確認のためだけのロックなので、子プロセスが取れるようにすぐ離す
+    os.close(fd)
+
+    command = [sys.executable, script_path, 'serve', '--idle-timeout', str(idle_timeout)]
+    if socket_path != get_socket_path():
+        command += ['--socket', socket_path]
+    try:
+        subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            close_fds=True,
+        )
+    except OSError as e:
+        logger.warning(f"分析サーバーの起動に失敗: {e}")
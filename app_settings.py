@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+実行時設定 - キャッシュ・ソケット・Vaultなどローカル状態の置き場所
+"""
+
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(SCRIPT_DIR, 'config.yaml')
+
+DEFAULT_VAULT_PATH = "/Users/yoshiikatsuhiko/Library/Mobile Documents/iCloud~md~obsidian/Documents"
+
+
+def get_cache_dir() -> str:
+    """キャッシュディレクトリを取得（iCloud同期対象外の場所を使う）"""
+    cache_dir = os.getenv('MEMO_CLASSIFIER_CACHE_DIR')
+    if not cache_dir:
+        if sys.platform == 'darwin':
+            cache_dir = os.path.expanduser('~/Library/Caches/memo-classifier')
+        else:
+            cache_dir = os.path.expanduser('~/.cache/memo-classifier')
+
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    return cache_dir
+
+
+_config_cache = {}
+
+
+def load_config(config_path: str = CONFIG_PATH) -> dict:
+    """config.yaml を読み込む（プロセス内でキャッシュ、読めなければ空の設定）"""
+    if config_path not in _config_cache:
+        try:
+            import yaml
+            # libyaml があればC実装のローダーで起動時間を短縮
+            loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+            with open(config_path, 'r', encoding='utf-8') as f:
+                _config_cache[config_path] = yaml.load(f, Loader=loader) or {}
+        except Exception:
+            _config_cache[config_path] = {}
+    return _config_cache[config_path]
+
+
+def get_vault_path() -> str:
+    """ObsidianのVaultのパス（環境変数 > config.yaml の obsidian_vault_path > 既定値）"""
+    return (os.getenv('MEMO_CLASSIFIER_VAULT')
+            or load_config().get('obsidian_vault_path')
+            or DEFAULT_VAULT_PATH)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+バッチ処理 - 大量のメモを並行して分析・保存
+ディレクトリ内のテキストファイルまたはJSONLを入力とし、1メモ1行のJSONLで結果を出力する
+"""
+
+import os
+import sys
+import json
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterator, List, Optional, Set, TextIO, Tuple, Union
+
+from gemini_client import iter_packs
+
+MEMO_EXTENSIONS = ('.txt', '.md')
+
+# (content, analysis_result) -> 保存したファイルパス（失敗時は空文字）
+# 書き出しを別スレッドに任せる場合はパスを返す Future（VaultWriter.submit）
+NoteWriter = Callable[[str, Dict], Union[str, Future]]
+
+
+def iter_memos(source: str) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """入力から (id, メモ内容, 読み取りエラー) を順に取り出す（全件をメモリに載せない）
+
+    読めないファイル・不正なJSONL行は内容をNoneにしてエラーを返し、残りのメモの処理は続ける
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.startswith('.') or not name.endswith(MEMO_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                memo_id = os.path.relpath(path, source)
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                except (OSError, UnicodeDecodeError) as e:
+                    yield memo_id, None, f"メモを読めません: {e}"
+                    continue
+                yield memo_id, content, None
+        return
+
+    with open(source, 'r', encoding='utf-8', errors='replace') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield f"line-{line_no}", None, f"JSONとして読めません: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield f"line-{line_no}", None, "JSONオブジェクトではありません"
+                continue
+            memo_id = str(record.get('id', f"line-{line_no}"))
+            content = record.get('content') or record.get('text') or ''
+            if not isinstance(content, str):
+                yield memo_id, None, "content が文字列ではありません"
+                continue
+            yield memo_id, content, None
+
+
+def load_completed_ids(output_path: str, include_analyzed: bool = False) -> Set[str]:
+    """既存の結果ファイルから成功済みのIDを取得（中断からの再開用）
+
+    ノートを保存済み（status が ok で file がある）のメモだけを成功とみなす。
+    include_analyzed なら分析のみ（--dry-run）の結果も成功とみなす
+    """
+    completed = set()
+    if not output_path or not os.path.exists(output_path):
+        return completed
+
+    # 中断で書きかけになった行に途中で切れた文字があっても読み進める
+    with open(output_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 中断時に書きかけだった行
+            if not isinstance(record, dict):
+                continue
+            if ((record.get('status') == 'ok' and record.get('file'))
+                    or (include_analyzed and record.get('status') == 'analyzed')):
+                completed.add(record.get('id'))
+    return completed
+
+
+class BatchRunner:
+    """同時実行数を制限しながらメモを分析・保存"""
+
+    def __init__(self, analyzer, categories: List[str], write_note: Optional[NoteWriter] = None,
+                 concurrency: int = 4, packed: bool = False, category: Optional[str] = None,
+                 source: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.analyzer = analyzer
+        self.categories = categories
+        self.write_note = write_note
+        self.concurrency = max(1, concurrency)
+        self.packed = packed
+        # 指定時は分析結果のカテゴリに関わらずこのカテゴリで保存する（Kindle・Readwiseの取り込みなど）
+        self.category = category
+        # 指定時はノートのフロントマターに source として記録する（取り込んだノートを学習から除くため）
+        self.source = source
+
+    def _iter_groups(self, memos: Iterator[Tuple[str, str]]) -> Iterator[List[Tuple[str, str]]]:
+        """1リクエストで処理するまとまりに分ける（一括モードではトークン予算で詰める）"""
+        if not self.packed:
+            for memo in memos:
+                yield [memo]
+            return
+
+        gemini = self.analyzer.gemini
+        yield from iter_packs(memos, gemini.pack_token_budget, gemini.max_pack_items)
+
+    def _process_group(self, group: List[Tuple[str, str]]) -> List[Dict]:
+        """1まとまりを分析して保存"""
+        try:
+            if self.packed:
+                analysis_results = self.analyzer.analyze_many(group, self.categories)
+            else:
+                memo_id, content = group[0]
+                analysis_results = {memo_id: self.analyzer.analyze(content, self.categories)}
+        except Exception as e:
+            self.logger.error(f"バッチ分析エラー: {e}")
+            analysis_results = {}
+
+        return [self._save(memo_id, content, analysis_results.get(memo_id)) for memo_id, content in group]
+
+    def _save(self, memo_id: str, content: str, analysis_result: Optional[Dict]) -> Dict:
+        """分析結果を保存して結果レコードを作成"""
+        record = {'id': memo_id}
+        try:
+            if not analysis_result or not analysis_result.get('success'):
+                raise RuntimeError("分析に失敗しました")
+
+            result = analysis_result.get('result', {})
+            if self.category:
+                result['category'] = self.category
+            if self.source:
+                result['source'] = self.source
+            record.update({
+                'title': result.get('title'),
+                'category': result.get('category'),
+                'tags': result.get('tags', []),
+                'model': analysis_result.get('model'),
+            })
+
+            if self.write_note:
+                file_path = self.write_note(content, analysis_result)
+                if isinstance(file_path, Future):
+                    # 保存の完了は結果を書き出すときに待つ（分析のスレッドは次のメモに進める）
+                    record['pending_file'] = file_path
+                elif not file_path:
+                    raise RuntimeError("ファイル保存に失敗しました")
+                else:
+                    record['file'] = file_path
+
+            # 保存しない（--dry-run）場合は、再開時に保存済みと区別できるよう別の状態にする
+            record['status'] = 'ok' if self.write_note else 'analyzed'
+        except Exception as e:
+            self.logger.error(f"バッチ処理エラー ({memo_id}): {e}")
+            record.update({'status': 'error', 'error': str(e)})
+
+        return record
+
+    def _resolve(self, record: Dict):
+        """書き出しを別スレッドに任せたノートの保存を待ち、結果レコードに反映"""
+        pending = record.pop('pending_file', None)
+        if pending is None:
+            return
+        try:
+            file_path = pending.result()
+            if not file_path:
+                raise RuntimeError("ファイル保存に失敗しました")
+            record['file'] = file_path
+        except Exception as e:
+            self.logger.error(f"バッチ処理エラー ({record['id']}): {e}")
+            record.update({'status': 'error', 'error': str(e)})
+
+    def run(self, memos: Iterator[Tuple[str, Optional[str], Optional[str]]], out: TextIO,
+            skip_ids: Optional[Set[str]] = None,
+            on_record: Optional[Callable[[Dict], None]] = None) -> Dict[str, int]:
+        """全件を処理し、完了順に結果をJSONLで書き出す
+
+        memos は iter_memos と同じ (id, メモ内容, 読み取りエラー)。
+        on_record を渡すと結果レコードごとに呼び出す（呼び出し元のスレッドで実行）
+        """
+        skip_ids = skip_ids or set()
+        summary = {'ok': 0, 'error': 0, 'skipped': 0}
+        if not self.write_note:
+            summary['analyzed'] = 0
+
+        def emit(record: Dict):
+            self._resolve(record)
+            summary[record['status']] += 1
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+            if on_record:
+                on_record(record)
+
+        def pending_memos() -> Iterator[Tuple[str, str]]:
+            for memo_id, content, error in memos:
+                if memo_id in skip_ids:
+                    summary['skipped'] += 1
+                elif error:
+                    emit({'id': memo_id, 'status': 'error', 'error': error})
+                elif not content.strip():
+                    emit({'id': memo_id, 'status': 'error', 'error': "メモ内容が空です"})
+                else:
+                    yield memo_id, content
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            in_flight = set()
+
+            def drain(return_when):
+                nonlocal in_flight
+                done, in_flight = wait(in_flight, return_when=return_when)
+                for future in done:
+                    for record in future.result():
+                        emit(record)
+
+            for group in self._iter_groups(pending_memos()):
+                # 実行中のリクエストが上限に達したら1件終わるまで待つ
+                if len(in_flight) >= self.concurrency:
+                    drain(FIRST_COMPLETED)
+                in_flight.add(executor.submit(self._process_group, group))
+
+            if in_flight:
+                drain(ALL_COMPLETED)
+
+        self.logger.info(f"バッチ処理完了: {summary}")
+        return summary
+
+
+def run_batch(source: str, analyzer, categories: List[str], write_note: Optional[NoteWriter],
+              output_path: Optional[str] = None, concurrency: int = 4,
+              packed: bool = False) -> Dict[str, int]:
+    """入力を読み込んでバッチ処理（output_path 指定時は追記して再開可能）"""
+    runner = BatchRunner(analyzer, categories, write_note=write_note, concurrency=concurrency,
+                         packed=packed)
+
+    if not output_path:
+        return runner.run(iter_memos(source), sys.stdout)
+
+    skip_ids = load_completed_ids(output_path, include_analyzed=write_note is None)
+    if skip_ids:
+        logging.getLogger(__name__).info(f"処理済み {len(skip_ids)} 件をスキップして再開")
+
+    # 中断で書きかけになった最終行に次の結果が連結されないようにする
+    # （最終行は文字の途中で切れていることがあるため、末尾の1バイトをバイナリで確かめる）
+    needs_newline = False
+    if os.path.exists(output_path):
+        with open(output_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+
+    with open(output_path, 'a', encoding='utf-8') as out:
+        if needs_newline:
+            out.write('\n')
+        return runner.run(iter_memos(source), out, skip_ids=skip_ids)
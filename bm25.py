@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BM25 - 日本語向けの索引語の切り出しと関連度スコア
+日本語は分かち書きしないため、漢字・カタカナの連続部分を文字2-gramに分け、
+英数字は単語単位、タグ候補（固有名詞・複合語）は1語として扱う
+"""
+
+import re
+import math
+from collections import Counter
+from typing import Iterable
+
+# BM25のパラメータ
+K1 = 1.2
+B = 0.75
+
+# 漢字・カタカナの連続部分（ひらがなは助詞・活用語尾が大半のため索引しない）
+_CJK_RUN = re.compile(r'[ァ-ヺー㐀-䶿一-鿿豈-﫿々〆]+')
+_WORD = re.compile(r'[A-Za-z0-9][A-Za-z0-9\-_.]*[A-Za-z0-9]|[A-Za-z]')
+
+# タグ候補・タグは n-gram と区別するため接頭辞を付ける
+PHRASE_PREFIX = '#'
+
+
+def ngram_terms(text: str, n: int = 2) -> Counter:
+    """漢字・カタカナは文字n-gram、英数字は小文字化した単語として数える"""
+    terms = Counter()
+    for run in _CJK_RUN.findall(text):
+        if len(run) < n:
+            terms[run] += 1
+        else:
+            terms.update(run[i:i + n] for i in range(len(run) - n + 1))
+    terms.update(word.lower() for word in _WORD.findall(text))
+    return terms
+
+
+def phrase_terms(phrases: Iterable[str]) -> Counter:
+    """タグ候補・タグ・キーワードを1語の索引語にする"""
+    return Counter(PHRASE_PREFIX + phrase.strip().lower() for phrase in phrases if phrase.strip())
+
+
+def idf(df: int, n_docs: int) -> float:
+    """逆文書頻度（常に正になる BM25+ 系の式）"""
+    return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+
+def term_score(tf: float, doc_length: float, avg_length: float, term_idf: float) -> float:
+    """1語分のBM25スコア"""
+    norm = K1 * (1 - B + B * doc_length / avg_length) if avg_length else K1
+    return term_idf * tf * (K1 + 1) / (tf + norm)
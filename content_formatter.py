@@ -2,36 +2,158 @@
 # -*- coding: utf-8 -*-
 """
 コンテンツフォーマッター - メモ内容に適切な見出しを付けて整形
+行を1行ずつ読んで整形した行を順に書き出すため、巨大なノートでも使うメモリは1行分で済む
+（見出しが1つも無いメモだけは、自動見出しを付けるために整形済みの行を一時ファイルに溜めて読み直す）
 """
 
 import re
-from typing import List, Tuple
+import tempfile
+from typing import IO, Iterable, Iterator, List, Optional, Tuple, Union
+
+# 整形に使う正規表現（行ごとにコンパイルし直さない）
+_BRACKET_HEADING = re.compile(r'【([^】]+)】(.*)$')
+_NUMBERED = re.compile(r'^(\d+)[\.、]')
+_EMOJI = re.compile(r'^[\U0001F300-\U0001F9FF]')
+_HEADING = re.compile(r'#+\s')
+_STEP = re.compile(r'^(phase|フェーズ|ステップ|step)\s*\d+')
+
+# 自動見出しの種類と、その見出しを付ける行のキーワード（先に一致したものを使う）
+SECTION_KEYWORDS = [
+    ('概要', ('目的', '概要', 'overview')),
+    ('方法', ('手法', '方法', 'method')),
+    ('結果', ('結果', 'result')),
+]
+_SECTION_PATTERNS = [(section_type, re.compile('|'.join(map(re.escape, keywords))))
+                     for section_type, keywords in SECTION_KEYWORDS]
+# 大半の行はどのキーワードも含まないため、まず1回の検索でふるい落とす
+_ANY_SECTION = re.compile('|'.join(re.escape(keyword) for _, keywords in SECTION_KEYWORDS for keyword in keywords))
+
+# 見出しの無いメモの整形済みの行を、これを超えたらメモリではなく一時ファイルに溜める
+SPOOL_MAX_BYTES = 1024 * 1024
+
+
+def iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """文字列は改行（\\n）ごとに分けて、ファイルなどの行の反復はそのまま1行ずつ返す
+
+    文字列は分割したリストを作らずに先頭から切り出す。ファイルは newline='\\n' で開くと
+    format_content(ファイルの内容) と同じ結果になる
+    """
+    if isinstance(source, str):
+        start = 0
+        while True:
+            end = source.find('\n', start)
+            if end < 0:
+                yield source[start:]
+                return
+            yield source[start:end]
+            start = end + 1
+    for line in source:
+        yield line.rstrip('\n')
+
 
 class ContentFormatter:
     """メモ内容を整形し、見出しを適切に配置"""
     
     def format_content(self, content: str) -> str:
         """メモ内容を整形"""
+        return '\n'.join(self.iter_format(iter_lines(content)))
+    
+    def write(self, source: Union[str, Iterable[str]], output: IO[str]):
+        """メモ内容（文字列・ファイル・行の反復）を整形しながら output に書き出す（末尾の改行は付けない）"""
+        first = True
+        for line in self.iter_format(iter_lines(source)):
+            if not first:
+                output.write('\n')
+            output.write(line)
+            first = False
+    
+    def iter_format(self, lines: Iterable[str]) -> Iterator[str]:
+        """行を整形して1行ずつ返す
         
-        # 行ごとに分割
-        lines = content.strip().split('\n')
-        formatted_lines = []
-        
-        for line in lines:
-            formatted_line = self._format_line(line)
-            formatted_lines.append(formatted_line)
-        
-        # 空行の調整
-        result = '\n'.join(formatted_lines)
+        前後の空行を除き、連続する空行を1つにまとめる。見出しが全くない場合は自動的に見出しを追加する
+        """
         
-        # 連続する空行を1つに
-        result = re.sub(r'\n\n\n+', '\n\n', result)
+        collapsed = self._collapsed_lines(lines)
+        spool = None
+        has_section = False
+        # 「#」だけの行は、後に空行以外の行が続いたときだけ見出しとみなす
+        pending_heading = False
         
-        # 見出しが全くない場合は自動的に見出しを追加
-        if not self._has_heading(result):
-            result = self._add_auto_headings(result)
+        for line in collapsed:
+            if pending_heading and line:
+                break
+            if _HEADING.match(line):
+                break
+            pending_heading = pending_heading or (bool(line) and not line.strip('#'))
+            section_type = self._section_type(line)
+            has_section = has_section or section_type is not None
+            
+            # 見出しが見つかるまでは、自動見出しが要るか分からないため書き出さずに溜める
+            # （読み直すときに判定し直さないよう、行の前に自動見出しの種類を付けておく）
+            if spool is None:
+                spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode='w+',
+                                                      encoding='utf-8', newline='\n')
+            spool.write(f"{section_type or ''}\t{line}\n")
+        else:
+            # 見出しが全くない場合は自動的に見出しを追加
+            yield from self._strip_end(self._auto_headings(self._replay(spool), has_section))
+            return
         
-        return result.strip()
+        # 見出しがあれば溜めた行と残りの行をそのまま返す
+        try:
+            replayed = (spooled for _, spooled in self._replay(spool))
+            yield from self._strip_end(self._chain(replayed, line, collapsed))
+        finally:
+            collapsed.close()
+    
+    def _collapsed_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        """整形した行（【】の見出しと内容は2行）から前後の空行を除き、連続する空行を1つにまとめる"""
+        started = False
+        blank = False
+        for line in lines:
+            formatted = self._format_line(line)
+            if not formatted:
+                blank = started
+                continue
+            if blank:
+                yield ''
+                blank = False
+            started = True
+            yield from formatted.split('\n')
+    
+    @staticmethod
+    def _replay(spool) -> Iterator[Tuple[str, str]]:
+        """溜めた (自動見出しの種類, 行) を読み直す（読み終えたら一時ファイルを閉じる）"""
+        if spool is None:
+            return
+        with spool:
+            spool.seek(0)
+            for line in spool:
+                section_type, _, text = line[:-1].partition('\t')
+                yield section_type, text
+    
+    @staticmethod
+    def _chain(replayed: Iterator[str], line: str, rest: Iterator[str]) -> Iterator[str]:
+        yield from replayed
+        yield line
+        yield from rest
+    
+    @staticmethod
+    def _strip_end(lines: Iterable[str]) -> Iterator[str]:
+        """末尾の空行と最後の行の末尾の空白を除く"""
+        held = None
+        blanks = 0
+        for line in lines:
+            if not line:
+                blanks += 1
+                continue
+            if held is not None:
+                yield held
+                for _ in range(blanks):
+                    yield ''
+            held, blanks = line, 0
+        if held is not None:
+            yield held.rstrip()
     
     def _format_line(self, line: str) -> str:
         """1行を整形"""
@@ -58,7 +180,7 @@ class ContentFormatter:
         
         # 【】で囲まれた部分を見出しに変換
         if line.startswith('【') and '】' in line:
-            match = re.match(r'【([^】]+)】(.*)$', line)
+            match = _BRACKET_HEADING.match(line)
             if match:
                 heading_text = match.group(1)
                 rest_text = match.group(2).strip()
@@ -75,87 +197,75 @@ class ContentFormatter:
             return '- ' + line[1:].strip()
         
         # 番号付きリストの整形
-        if re.match(r'^\d+[\.、]', line):
-            return re.sub(r'^(\d+)[\.、]', r'\1.', line)
+        if _NUMBERED.match(line):
+            return _NUMBERED.sub(r'\1.', line)
         
         # 絵文字で始まる行は見出し候補
-        emoji_pattern = r'^[\U0001F300-\U0001F9FF]'
-        if re.match(emoji_pattern, line):
+        if _EMOJI.match(line):
             # 短い行（20文字以下）なら見出しとして扱う
             if len(line) <= 20:
                 return '## ' + line
         
         return line
     
-    def _has_heading(self, content: str) -> bool:
-        """見出しが含まれているかチェック"""
-        return bool(re.search(r'^#+\s', content, re.MULTILINE))
+    def split_sections(self, content: str) -> List[str]:
+        """見出しとして整形される行（#・■・【】・短い絵文字行）の位置で内容を分割"""
+
+        sections = []
+        current = []
+
+        for line in content.strip().split('\n'):
+            if current and self._format_line(line).startswith('#'):
+                sections.append('\n'.join(current).strip())
+                current = []
+            current.append(line)
+
+        if current:
+            sections.append('\n'.join(current).strip())
+
+        return [section for section in sections if section]
     
-    def _add_auto_headings(self, content: str) -> str:
-        """自動的に見出しを追加"""
-        
-        lines = content.split('\n')
-        sections = self._identify_sections(lines)
+    def _section_type(self, line: str) -> Optional[str]:
+        """自動見出しを付ける行ならその見出し（概要・方法・結果・フェーズ）"""
         
-        # セクションごとに見出しを追加
-        result_lines = []
-        for section_type, section_lines in sections:
-            if section_type and section_lines:
-                result_lines.append(f"## {section_type}")
-            result_lines.extend(section_lines)
-            if section_lines:  # 空でないセクションの後には空行
-                result_lines.append('')
-        
-        return '\n'.join(result_lines).strip()
+        line_lower = line.lower()
+        if _ANY_SECTION.search(line_lower):
+            for section_type, pattern in _SECTION_PATTERNS:
+                if pattern.search(line_lower):
+                    return section_type
+        if _STEP.match(line_lower):
+            return 'フェーズ'
+        return None
     
-    def _identify_sections(self, lines: List[str]) -> List[Tuple[str, List[str]]]:
-        """内容からセクションを識別"""
+    def _auto_headings(self, lines: Iterable[Tuple[str, str]], has_section: bool) -> Iterator[str]:
+        """自動的に見出しを追加
         
-        sections = []
-        current_section = []
+        キーワードのある行の前に見出しを付けて1行のセクションにし、前後に空行を入れる。
+        キーワードのある行が1つも無ければ全体を「内容」のセクションにする
+        """
         
-        for line in lines:
-            line_lower = line.lower()
-            
-            # セクションを識別するキーワード
-            if any(keyword in line_lower for keyword in ['目的', '概要', 'overview']):
-                if current_section:
-                    sections.append(('', current_section))
-                    current_section = []
-                sections.append(('概要', [line]))
-            elif any(keyword in line_lower for keyword in ['手法', '方法', 'method']):
-                if current_section:
-                    sections.append(('', current_section))
-                    current_section = []
-                sections.append(('方法', [line]))
-            elif any(keyword in line_lower for keyword in ['結果', 'result']):
-                if current_section:
-                    sections.append(('', current_section))
-                    current_section = []
-                sections.append(('結果', [line]))
-            elif re.match(r'^(phase|フェーズ|ステップ|step)\s*\d+', line_lower):
-                if current_section:
-                    sections.append(('', current_section))
-                    current_section = []
-                sections.append(('フェーズ', [line]))
-            else:
-                current_section.append(line)
-        
-        # 残りの行を追加
-        if current_section:
-            # 最初のセクションで見出しがなければ「内容」とする
-            if not sections:
-                sections.append(('内容', current_section))
-            else:
-                sections.append(('', current_section))
-        
-        return sections
+        if not has_section:
+            yield '## 内容'
+        in_section = False
+        for section_type, line in lines:
+            if not section_type:
+                yield line
+                in_section = True
+                continue
+            if in_section:  # 空でないセクションの後には空行
+                yield ''
+            yield f"## {section_type}"
+            yield line
+            yield ''
+            in_section = False
+        if in_section:
+            yield ''
 
 
 # テスト
 if __name__ == "__main__":
     formatter = ContentFormatter()
-    
+
     test_content = """■PoC計画：思考力教材の地域モデル検証＠クレオスタディ三田校
 🧭 概要
 目的：現在20名の受講者を倍増（40名）し、再現可能な運営モデルを確立
@@ -169,6 +279,6 @@ if __name__ == "__main__":
 ■PoC設計フェーズ
 【Phase 1｜現状分析と課題仮説】
 対象：現受講生／指導者／保護者"""
-    
+
     formatted = formatter.format_content(test_content)
-    print(formatted)
\ No newline at end of file
+    print(formatted)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+埋め込み - ノート・メモをベクトルに変換（差し替え可能）
+既定は外部モデルを使わずオフラインで動く文字n-gramのハッシュ埋め込み
+"""
+
+import re
+import math
+import zlib
+import logging
+import unicodedata
+from collections import Counter
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+# 埋め込みに使う先頭の文字数（長いノートでも計算量を抑える）
+MAX_EMBED_CHARS = 20000
+
+
+class HashedNgramEmbedder:
+    """文字n-gramの出現回数を符号付きハッシュで固定次元に畳み込む埋め込み"""
+
+    def __init__(self, dimensions: int = 256, ngram_range: Tuple[int, int] = (2, 3)):
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+        self.name = f"hashed-ngram-{dimensions}-{ngram_range[0]}{ngram_range[1]}"
+
+    def _normalize(self, text: str) -> str:
+        text = unicodedata.normalize('NFKC', text[:MAX_EMBED_CHARS]).lower()
+        return re.sub(r'\s+', ' ', text)
+
+    def embed(self, text: str) -> np.ndarray:
+        text = self._normalize(text)
+        counts = Counter(
+            text[i:i + n]
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1)
+            for i in range(len(text) - n + 1)
+        )
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for gram, count in counts.items():
+            if gram.isspace():
+                continue
+            hashed = zlib.crc32(gram.encode('utf-8'))
+            sign = 1.0 if hashed & 0x80000000 else -1.0
+            vector[hashed % self.dimensions] += sign * (1.0 + math.log(count))
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.vstack([self.embed(text) for text in texts])
+
+
+class SentenceTransformerEmbedder:
+    """sentence-transformers のモデルによる埋め込み（初回使用時にモデルを読み込む）"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.name = f"st-{model_name}"
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            logging.getLogger(__name__).info(f"埋め込みモデルを読み込み: {self.model_name}")
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def dimensions(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        texts = [text[:MAX_EMBED_CHARS] for text in texts]
+        return np.asarray(self.model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+
+def get_embedder(config: Dict):
+    """config.yaml の semantic_search.embedder から埋め込みを選ぶ"""
+    advanced = config.get('advanced_relation_analysis', {}) or {}
+    settings = advanced.get('semantic_search', {}) or {}
+    embedder = settings.get('embedder', 'hashed-ngram')
+
+    if embedder == 'sentence-transformers':
+        model_name = (config.get('context_analysis', {}) or {}).get(
+            'embedding_model', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+        return SentenceTransformerEmbedder(model_name)
+    if embedder != 'hashed-ngram':
+        raise ValueError(f"未知の埋め込み方式です: {embedder}")
+    return HashedNgramEmbedder(dimensions=settings.get('dimensions', 256))
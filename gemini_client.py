@@ -1,161 +1,433 @@
-import google.generativeai as genai
 import os
-import yaml
 import json
+import time
 import logging
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app_settings import get_cache_dir, load_config
+from prompts import MERGE_PROMPT_VERSION, build_merge_prompt, estimate_tokens, get_prompt_template
+from response_cache import ResponseCache
+from resilience import CircuitBreaker, CircuitOpenError, call_with_retries, is_transient_error
+from stream_json import IncrementalJSONObjectParser
+from token_meter import TokenMeter, usage_from_response
 
 logger = logging.getLogger()
 
+# 一括プロンプト1回あたりのメモ部分のトークン予算と最大件数
+PACK_TOKEN_BUDGET = 6000
+MAX_PACK_ITEMS = 20
+
+# 解決済みモデル名を再利用する期間（秒）
+MODEL_RESOLUTION_TTL = 24 * 3600
+
+# モデルを一度も解決していないときに応答キャッシュのキーに使うモデル名（モデル選択の最優先）
+DEFAULT_MODEL_NAME = 'gemini-2.5-flash'
+
+
+def iter_packs(memos: Iterable[Tuple[str, str]], token_budget: int = PACK_TOKEN_BUDGET,
+               max_items: int = MAX_PACK_ITEMS) -> Iterator[List[Tuple[str, str]]]:
+    """(id, メモ内容) をトークン予算内に収まるまとまりに分ける（予算を超えるメモは単独）"""
+    pack, pack_tokens = [], 0
+    for memo_id, content in memos:
+        tokens = estimate_tokens(content)
+        if pack and (pack_tokens + tokens > token_budget or len(pack) >= max_items):
+            yield pack
+            pack, pack_tokens = [], 0
+        pack.append((memo_id, content))
+        pack_tokens += tokens
+    if pack:
+        yield pack
+
 class GeminiClient:
     """
     Gemini APIと連携してメモ分析を行うクライアント
     """
-    def __init__(self, config_path='config.yaml'):
+    def __init__(self, config_path='config.yaml', prompt_version: Optional[str] = None):
         """
-        APIキーを読み込み、Geminiモデルを初期化
+        APIキーと設定を読み込む（google.generativeai の読み込みとモデル選択は初回のAPI呼び出しまで遅延）
+        prompt_version を指定すると config.yaml の prompt.version より優先する
         """
         try:
             logging.info("GeminiClient: Initializing...")
             
+            config = load_config(config_path)
+            
             # APIキーを環境変数から取得
             api_key = os.getenv('GEMINI_API_KEY')
             if not api_key:
                 # 設定ファイルからのフォールバック（非推奨）
-                try:
-                    with open(config_path, 'r') as f:
-                        config = yaml.safe_load(f)
-                    api_key = config.get('gemini', {}).get('api_key')
-                except:
-                    pass
+                api_key = (config.get('gemini') or {}).get('api_key')
                 
                 if not api_key or api_key == "YOUR_GEMINI_API_KEY":
                     logging.error("GeminiClient: API key not found in environment variable GEMINI_API_KEY")
                     raise ValueError("環境変数GEMINI_API_KEYが設定されていません。export GEMINI_API_KEY='your_key' で設定してください。")
             
-            logging.info("GeminiClient: API Key found. Configuring genai...")
-            genai.configure(api_key=api_key)
-            logging.info("GeminiClient: genai configured successfully.")
+            self._api_key = api_key
+            self._model = None
+            self._model_cache_path = os.path.join(get_cache_dir(), 'model_resolution.json')
             
-            # Gemini 2.5 Flashを最優先に設定
-            models_to_try = [
-                ('gemini-2.5-flash', 'Gemini 2.5 Flash'),
-                ('gemini-2.5-flash-latest', 'Gemini 2.5 Flash (最新版)'),
-                ('gemini-2.0-flash-thinking-exp-1219', 'Gemini 2.0 Flash Thinking (実験版)'),
-                ('gemini-2.0-flash-exp', 'Gemini 2.0 Flash (実験版)'),
-                ('gemini-1.5-flash-latest', 'Gemini 1.5 Flash (安定版)')
-            ]
+            # 前回解決したモデル名（有効期限内ならモデル選択を省略。期限切れでも応答キャッシュのキーには使う）
+            self.model_name, self._model_resolved_at = self._load_cached_model_name()
             
-            for model_name, description in models_to_try:
-                try:
-                    self.model = genai.GenerativeModel(model_name)
-                    logging.info(f"GeminiClient: {description} モデルを使用")
-                    break
-                except Exception as model_error:
-                    logging.warning(f"{description} 使用不可: {model_error}")
-                    continue
-            else:
-                raise Exception("利用可能なGeminiモデルが見つかりません")
+            # 同じメモの再分析はAPIを呼ばずに応答キャッシュから返す
+            self.cache = ResponseCache.from_config(config)
             
-            logging.info(f"GeminiClient: Model '{self.model._model_name}' initialized.")
+            # プロンプトの版（応答キャッシュのキーとトークン集計に使う）
+            prompt_settings = config.get('prompt', {}) or {}
+            self.prompt = get_prompt_template(prompt_version or prompt_settings.get('version'))
+            self.token_meter = TokenMeter() if prompt_settings.get('token_metrics', True) else None
+            self.last_usage = None
+            
+            packed_settings = config.get('packed_analysis', {}) or {}
+            self.pack_token_budget = packed_settings.get('token_budget', PACK_TOKEN_BUDGET)
+            self.max_pack_items = packed_settings.get('max_items', MAX_PACK_ITEMS)
+            
+            # 一時的なエラーの再試行と、連続失敗時のサーキットブレーカー
+            resilience_settings = config.get('resilience', {}) or {}
+            self.max_attempts = resilience_settings.get('max_attempts', 3)
+            self.breaker = CircuitBreaker(
+                failure_threshold=resilience_settings.get('failure_threshold', 3),
+                reset_timeout=resilience_settings.get('reset_timeout_seconds', 120),
+            )
 
         except Exception as e:
             logging.error(f"GeminiClient: Initialization failed. Error: {e}", exc_info=True)
             raise
 
-    def analyze_memo(self, content: str, categories: list) -> dict:
+    @property
+    def model(self):
         """
-        メモの内容を分析し、タイトル、カテゴリ、タグを生成
+        Geminiモデル（初回アクセス時に google.generativeai を読み込んで初期化）
         """
-        
-        category_list = ", ".join(categories)
-
-        prompt = f"""
-        あなたは文章解析の専門家です。以下のメモ内容の主題を正確に特定し、適切なタイトル、カテゴリ、タグ、関連ファイル検索用のキーワードをJSON形式で提案してください。
-
-        # 根本的分析手順
-        1. **文章全体を3回読み返す**: 全体像を把握してから詳細を分析
-        2. **中心的主題の特定**: 文章が何について説明しているかを1文で要約
-        3. **具体的内容の抽出**: 抽象的概念ではなく文章で実際に扱われている具体的事項
-        4. **誤解しやすいパターンの回避**: 「AI」「教育」などの単語だけで判断せず、文脈を重視
+        if self._model is None:
+            self._init_model()
+        return self._model
 
-        # タイトル生成の厳格なルール
-        - 文章の中心的主題を正確に反映すること（例: セキュリティ対策なら「AIセキュリティ対策」）
-        - 抽象的で曖昧なタイトルは絶対に避けること（例: 「AI活用法」「教育プログラム」等）
-        - 体言止め（名詞で終わる）にすること
-        - 10-20文字程度で簡潔にすること
-
-        # カテゴリ分類の厳格なルール（優先順位順）
-        - 個人名や打ち合わせ・会議・ビジネス戦略・コンサルティング → consulting（最優先）
-        - プログラミング、システム、技術解説 → tech  
-        - 教育手法、学習方法、指導法 → education
-        - 書籍内容、読書記録 → kindle
-        - 音楽理論、演奏技術 → music
-        - SNS・YouTube・note等外部発信、コンテンツ制作、メディア → media
-        - 上記以外 → others
+    def cache_model_name(self) -> str:
+        """
+        応答キャッシュのキーに使うモデル名（モデルの解決はせず、SDKも読み込まない）
+        """
+        return self.model_name or DEFAULT_MODEL_NAME
 
-        # 利用可能なカテゴリ
-        {category_list}
+    def _model_resolution_expired(self) -> bool:
+        return time.time() - self._model_resolved_at > MODEL_RESOLUTION_TTL
 
-        # タイトル生成の原則
+    def _init_model(self):
+        """
+        google.generativeai を設定し、利用可能なモデルを選択
+        """
+        import google.generativeai as genai
         
-        **絶対ルール**: 
-        1. 与えられたメモ内容の中から具体的なキーワードを抽出してタイトルを構成する
-        2. メモに含まれていない単語や概念をタイトルに使わない
-        3. 料金・プランに関する内容の場合、具体的なプラン名やサービス名を含める
-        4. 汎用的なタイトル（「活用法」「解説」等）を避け、内容の特徴を捉える
+        logging.info("GeminiClient: API Key found. Configuring genai...")
+        genai.configure(api_key=self._api_key)
+        logging.info("GeminiClient: genai configured successfully.")
         
-        # タイトル生成の思考プロセス（参考）
+        # Gemini 2.5 Flashを最優先に設定（前回解決したモデルがあれば先に試す）
+        models_to_try = [
+            (DEFAULT_MODEL_NAME, 'Gemini 2.5 Flash'),
+            ('gemini-2.5-flash-latest', 'Gemini 2.5 Flash (最新版)'),
+            ('gemini-2.0-flash-thinking-exp-1219', 'Gemini 2.0 Flash Thinking (実験版)'),
+            ('gemini-2.0-flash-exp', 'Gemini 2.0 Flash (実験版)'),
+            ('gemini-1.5-flash-latest', 'Gemini 1.5 Flash (安定版)')
+        ]
+        if self.model_name and not self._model_resolution_expired():
+            models_to_try.insert(0, (self.model_name, self.model_name))
         
-        ステップ1: メモから重要な固有名詞を抽出
-        - 例: Opus, Sonnet, Claude, Obsidian, Proプランなど
+        for model_name, description in models_to_try:
+            try:
+                model = genai.GenerativeModel(model_name)
+                logging.info(f"GeminiClient: {description} モデルを使用")
+                break
+            except Exception as model_error:
+                logging.warning(f"{description} 使用不可: {model_error}")
+                continue
+        else:
+            raise Exception("利用可能なGeminiモデルが見つかりません")
         
-        ステップ2: メモの主題を表す動作や状態を特定
-        - 例: 料金体系、使用制限、比較、構築、管理など
+        self._model = model
+        if model_name != self.model_name or self._model_resolution_expired():
+            self.model_name = model_name
+            self._save_cached_model_name(model_name)
         
-        ステップ3: 固有名詞と主題を組み合わせてタイトル化
-        - 例: 「Opus/Sonnet料金体系」「Proプラン使用制限」
+        logging.info(f"GeminiClient: Model '{self._model._model_name}' initialized.")
+
+    def _load_cached_model_name(self) -> Tuple[Optional[str], float]:
+        """
+        永続化したモデル名と解決した時刻を読み込む（無ければ (None, 0)）
+        """
+        try:
+            with open(self._model_cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            return cached.get('model_name'), float(cached.get('resolved_at', 0))
+        except (OSError, ValueError, TypeError, AttributeError):
+            return None, 0.0
+
+    def _save_cached_model_name(self, model_name: str):
+        """
+        解決したモデル名を永続化
+        """
+        resolved_at = time.time()
+        try:
+            with open(self._model_cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'model_name': model_name, 'resolved_at': resolved_at}, f)
+            self._model_resolved_at = resolved_at
+        except OSError as e:
+            logging.warning(f"GeminiClient: モデル名の保存に失敗: {e}")
+
+    def _generate(self, prompt: str, deadline: Optional[float] = None, **kwargs):
+        """
+        generate_content を期限内で再試行しながら呼び出す
+        deadline は time.monotonic() 基準の期限（Noneなら無期限）
+        stream=True の場合、成功の記録は呼び出し元がストリームを読み終えてから行う（_record_success）
+        """
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("APIが連続して失敗しているため呼び出しを一時停止中です")
+        
+        def attempt(timeout: Optional[float]):
+            request_options = {'timeout': timeout} if timeout is not None else None
+            return self.model.generate_content(prompt, request_options=request_options, **kwargs)
+        
+        try:
+            response = call_with_retries(attempt, deadline=deadline, max_attempts=self.max_attempts)
+        except Exception as e:
+            self._record_failure(e)
+            raise
         
-        **注意**: 上記はあくまで思考プロセスの例であり、実際のタイトルはメモ内容に即して生成すること。
+        if not kwargs.get('stream'):
+            self._record_success()
+        return response
 
-        # カテゴリ分類の優先ルール（厳格な優先順位）
-        **重要**: ビジネス要素がある場合は必ずconsultingを優先
-        - 個人の名前（嶋村氏など）や打ち合わせ・会議・ビジネス戦略・経営・マーケティング → consulting（最優先）
-        - プログラミング、AI、技術的内容 → tech
-        - 教育・学習・指導内容（ビジネス要素なし） → education
-        - 読書・Kindle・本の内容 → kindle
-        - 音楽・演奏・楽器関連 → music
-        - SNS・YouTube・note等外部発信、コンテンツ制作（ビジネス要素なし） → media
-        - その他 → others
+    def _record_success(self):
+        self.breaker.record_success()
+        # 使えたモデル名は解決し直さずに済むよう、期限の半分を過ぎたら解決時刻を更新する
+        if time.time() - self._model_resolved_at > MODEL_RESOLUTION_TTL / 2:
+            self._save_cached_model_name(self.model_name)
 
-        # メモ内容
-        ---
-        {content}
-        ---
+    def _record_failure(self, error: Exception):
+        """一時的なエラーだけを連続失敗に数える（それ以外は試行の権利を返すだけ）"""
+        if is_transient_error(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_probe()
 
-        # 出力形式 (JSON)
-        {{
-          "title": "（体言止めのタイトル）",
-          "category": "（カテゴリリストから選択）",
-          "tags": ["（タグ1）", "（タグ2）", "..."],
-          "related_files_keywords": ["（キーワード1）", "（キーワード2）", "..."]
-        }}
+    def _record_usage(self, response, prompt_version: str, prompt: str, memo_tokens: int,
+                      output_text: str):
+        """
+        1回の呼び出しのトークン数を記録（SDKが使用量を返さなければ概算）
         """
-        logging.info("--- Geminiへのプロンプト ---\n%s\n--------------------------", prompt)
+        usage = usage_from_response(response)
+        estimated = usage is None
+        if estimated:
+            usage = {'prompt_tokens': estimate_tokens(prompt), 'output_tokens': estimate_tokens(output_text)}
+        
+        usage.update({'memo_tokens': memo_tokens, 'estimated': estimated})
+        self.last_usage = usage
+        logging.debug(f"GeminiClient: トークン使用量 {prompt_version}: {usage}")
+        if self.token_meter:
+            self.token_meter.record(prompt_version, usage['prompt_tokens'], memo_tokens,
+                                    usage['output_tokens'], estimated=estimated)
+
+    def analyze_memo(self, content: str, categories: list, deadline: Optional[float] = None) -> dict:
+        """
+        メモの内容を分析し、タイトル、カテゴリ、タグを生成
+        deadline（time.monotonic() 基準）を過ぎる再試行は行わない
+        """
+        
+        cache_key = None
+        if self.cache:
+            cache_key = ResponseCache.make_key(content, categories, self.cache_model_name(), self.prompt.version)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logging.info("GeminiClient: 応答キャッシュにヒット")
+                return cached
+        
+        prompt = self.prompt.build(content, categories)
+        logging.debug("--- Geminiへのプロンプト ---\n%s\n--------------------------", prompt)
 
         try:
             logging.info("GeminiClient: Calling model.generate_content...")
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt, deadline=deadline)
             logging.info("GeminiClient: model.generate_content call finished.")
             
             raw_text = response.text
-            logging.info(f"--- Geminiからの生の応答 ---\n{raw_text}\n--------------------------")
+            logging.debug("--- Geminiからの生の応答 ---\n%s\n--------------------------", raw_text)
+            self._record_usage(response, self.prompt.version, prompt, estimate_tokens(content), raw_text)
             
-            json_text = raw_text.strip().lstrip('```json').lstrip('```').rstrip('```')
-            result = json.loads(json_text)
+            result = self._parse_json(raw_text)
             logging.info(f"パースされたJSON結果: {result}")
+            
+            if cache_key:
+                self.cache.put(cache_key, result)
             return result
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logging.error(f"Gemini APIの呼び出しまたはJSONパース中にエラーが発生: {e}", exc_info=True)
             raise Exception(f"Gemini API処理に失敗しました: {e}")
-    
- 
\ No newline at end of file
+
+    def analyze_memo_stream(self, content: str, categories: list,
+                            on_field: Optional[Callable[[str, object], None]] = None,
+                            deadline: Optional[float] = None) -> dict:
+        """
+        ストリーミングで分析し、フィールドが確定するたびに on_field(キー, 値) を呼ぶ
+        応答が途中で切れた場合は、確定済みのフィールドだけを返す
+        """
+        
+        cache_key = None
+        if self.cache:
+            cache_key = ResponseCache.make_key(content, categories, self.cache_model_name(), self.prompt.version)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logging.info("GeminiClient: 応答キャッシュにヒット")
+                if on_field:
+                    for key, value in cached.items():
+                        on_field(key, value)
+                return cached
+        
+        parser = IncrementalJSONObjectParser()
+        prompt = self.prompt.build(content, categories)
+        received = []
+        
+        try:
+            logging.info("GeminiClient: Calling model.generate_content (stream)...")
+            response = self._generate(prompt, deadline=deadline, stream=True)
+            
+            # ストリームの途中で失敗した場合もサーキットブレーカーに数える
+            try:
+                for chunk in response:
+                    received.append(chunk.text)
+                    for key, value in parser.feed(chunk.text):
+                        if on_field:
+                            on_field(key, value)
+                    if parser.done:
+                        break
+            except Exception as e:
+                self._record_failure(e)
+                raise
+            self._record_success()
+            
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            result = parser.partial()
+            if not (result.get('title') or result.get('category')):
+                logging.error(f"Gemini APIのストリーミング中にエラーが発生: {e}", exc_info=True)
+                raise Exception(f"Gemini API処理に失敗しました: {e}")
+            
+            logging.warning(f"GeminiClient: ストリームが途中で切れたため確定済みのフィールドを使用: {e}")
+            return result
+        
+        self._record_usage(response, self.prompt.version, prompt, estimate_tokens(content), ''.join(received))
+        
+        result = parser.partial()
+        if not parser.done:
+            logging.warning("GeminiClient: 応答のJSONが閉じていないため確定済みのフィールドを使用")
+            if not result:
+                raise Exception("Gemini API処理に失敗しました: JSONを取得できませんでした")
+        elif cache_key:
+            self.cache.put(cache_key, result)
+        
+        logging.info(f"パースされたJSON結果: {result}")
+        return result
+
+    def merge_analyses(self, parts: List[Dict], categories: list, deadline: Optional[float] = None) -> dict:
+        """
+        長いメモの部分ごとの分析結果（title, category, tags, tokens）を1つの結果にまとめる
+        """
+        prompt = build_merge_prompt(parts, categories)
+        
+        logging.info(f"GeminiClient: {len(parts)}部分の分析結果を統合")
+        response = self._generate(prompt, deadline=deadline)
+        self._record_usage(response, MERGE_PROMPT_VERSION, prompt, 0, response.text)
+        return self._parse_json(response.text)
+
+    def _parse_json(self, raw_text: str):
+        """
+        応答からコードフェンスを除いてJSONを取り出す
+        """
+        json_text = raw_text.strip().lstrip('```json').lstrip('```').rstrip('```')
+        return json.loads(json_text)
+
+    def analyze_memos_packed(self, memos: List[Tuple[str, str]], categories: list) -> Dict[str, dict]:
+        """
+        短いメモをまとめて1リクエストで分析し、{id: 分析結果} を返す
+        分析できなかったメモは結果に含めない
+        """
+        results = {}
+        pending = []
+        
+        for memo_id, content in memos:
+            if self.cache:
+                cached = self.cache.get(ResponseCache.make_key(
+                    content, categories, self.cache_model_name(), self.prompt.packed_version))
+                if cached is not None:
+                    results[memo_id] = cached
+                    continue
+            pending.append((memo_id, content))
+        
+        for pack in iter_packs(pending, self.pack_token_budget, self.max_pack_items):
+            try:
+                self._analyze_pack(pack, categories, results)
+            except Exception as e:
+                # 一時的なエラー（再試行済み）・ブレーカー作動中は残りを送らず、呼び出し元のフォールバックに任せる
+                logging.warning(f"GeminiClient: 一括分析を中断（残り {len(pending) - len(results)} 件）: {e}")
+                break
+        
+        return results
+
+    def _analyze_pack(self, pack: List[Tuple[str, str]], categories: list, results: Dict[str, dict]):
+        """
+        1まとまりを分析して results に加え、応答を解析できなかった・欠けたメモは半分に分けて再試行
+        一時的なエラー・ブレーカー作動中は分割しても失敗するため、分けずにそのまま送出する
+        """
+        if len(pack) == 1:
+            memo_id, content = pack[0]
+            try:
+                results[memo_id] = self.analyze_memo(content, categories)
+            except Exception as e:
+                if isinstance(e, CircuitOpenError) or is_transient_error(e):
+                    raise
+                logging.warning(f"GeminiClient: メモ {memo_id} の分析に失敗: {e}")
+            return
+        
+        try:
+            items = self._call_packed(pack, categories)
+        except ValueError as e:
+            # JSONとして読めない・配列でない・応答が空（ブロックされた）など、応答の中身の問題
+            logging.warning(f"GeminiClient: 一括分析（{len(pack)}件）の応答を解析できません: {e}")
+            items = {}
+        
+        missing = []
+        for index, (memo_id, content) in enumerate(pack, 1):
+            item = items.get(str(index))
+            if item and item.get('title') and item.get('category'):
+                item.pop('id', None)
+                results[memo_id] = item
+                if self.cache:
+                    self.cache.put(ResponseCache.make_key(
+                        content, categories, self.cache_model_name(), self.prompt.packed_version), item)
+            else:
+                missing.append((memo_id, content))
+        
+        if missing:
+            logging.info(f"GeminiClient: 一括分析で欠けた {len(missing)} 件を分割して再試行")
+            middle = len(missing) // 2
+            for half in (missing[:middle], missing[middle:]):
+                if half:
+                    self._analyze_pack(half, categories, results)
+
+    def _call_packed(self, pack: List[Tuple[str, str]], categories: list) -> Dict[str, dict]:
+        """
+        一括プロンプトを送信し、{入力番号: 結果} を返す
+        """
+        prompt = self.prompt.build_packed(pack, categories)
+        
+        logging.info(f"GeminiClient: 一括分析 {len(pack)}件を送信")
+        response = self._generate(prompt)
+        memo_tokens = sum(estimate_tokens(content) for _, content in pack)
+        self._record_usage(response, self.prompt.packed_version, prompt, memo_tokens, response.text)
+        parsed = self._parse_json(response.text)
+        if not isinstance(parsed, list):
+            raise ValueError("一括分析の応答がJSON配列ではありません")
+        
+        return {str(item.get('id')): item for item in parsed if isinstance(item, dict)}
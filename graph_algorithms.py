@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+グラフアルゴリズム - CSR形式（indptr, indices, weights）の無向グラフの中心性とコミュニティ
+隣接行列はNumPy配列だけで持ち、幅優先探索は階層ごとにまとめてベクトル演算で進める
+"""
+
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+# 媒介・近接中心性で1連結成分あたりに使う始点の最大数（超える場合は無作為抽出で近似）
+CENTRALITY_SAMPLES = 256
+
+# 固有ベクトル中心性のべき乗法の反復上限と収束判定
+EIGENVECTOR_ITERATIONS = 100
+EIGENVECTOR_TOLERANCE = 1e-6
+
+# Louvain法の1階層あたりのノード移動の反復上限
+LOUVAIN_PASSES = 10
+
+CENTRALITY_MEASURES = ('degree', 'betweenness', 'closeness', 'eigenvector')
+
+CSRGraph = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def build_csr(n_nodes: int, rows: np.ndarray, cols: np.ndarray, weights: np.ndarray,
+              keep_loops: bool = False) -> CSRGraph:
+    """(行, 列, 重み) の辺からCSR形式の隣接行列を作る（重複する辺の重みは合計）"""
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if not keep_loops:
+        mask = rows != cols
+        rows, cols, weights = rows[mask], cols[mask], weights[mask]
+
+    if n_nodes == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    keys, inverse = np.unique(rows * n_nodes + cols, return_inverse=True)
+    merged = np.bincount(inverse, weights=weights, minlength=keys.size)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // n_nodes, minlength=n_nodes), out=indptr[1:])
+    return indptr, keys % n_nodes, merged
+
+
+def symmetric_csr(n_nodes: int, sources: np.ndarray, targets: np.ndarray, weights: np.ndarray) -> CSRGraph:
+    """無向辺（片方向ずつ）から対称な隣接行列を作る"""
+    return build_csr(n_nodes,
+                     np.concatenate([sources, targets]),
+                     np.concatenate([targets, sources]),
+                     np.concatenate([weights, weights]))
+
+
+def _row_ids(indptr: np.ndarray) -> np.ndarray:
+    return np.repeat(np.arange(indptr.size - 1), np.diff(indptr))
+
+
+def _neighbors(indptr: np.ndarray, indices: np.ndarray, frontier: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """frontier の各ノードから出る辺を (始点, 終点) の配列で返す"""
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(frontier, counts), indices[np.repeat(starts, counts) + offsets]
+
+
+def connected_components(indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """連結成分の番号（隣接ノードの最小番号を伝播させる）"""
+    labels = np.arange(indptr.size - 1)
+    rows = _row_ids(indptr)
+    while True:
+        updated = labels.copy()
+        np.minimum.at(updated, rows, labels[indices])
+        # 番号の付け替えを辿って伝播を速める
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def _shortest_paths(indptr: np.ndarray, indices: np.ndarray, source: int) -> Tuple[np.ndarray, np.ndarray]:
+    """1始点からの距離と、Brandes法の依存度（最短経路上にある割合の和）"""
+    n_nodes = indptr.size - 1
+    distance = np.full(n_nodes, -1, dtype=np.int64)
+    sigma = np.zeros(n_nodes)
+    distance[source] = 0
+    sigma[source] = 1.0
+
+    levels = []
+    frontier = np.array([source], dtype=np.int64)
+    depth = 0
+    while frontier.size:
+        src, dst = _neighbors(indptr, indices, frontier)
+        discovered = dst[distance[dst] < 0]
+        distance[discovered] = depth + 1
+        on_path = distance[dst] == depth + 1
+        src, dst = src[on_path], dst[on_path]
+        np.add.at(sigma, dst, sigma[src])
+        levels.append((src, dst))
+        frontier = np.unique(discovered)
+        depth += 1
+
+    delta = np.zeros(n_nodes)
+    for src, dst in reversed(levels):
+        np.add.at(delta, src, sigma[src] / sigma[dst] * (1.0 + delta[dst]))
+    delta[source] = 0.0
+    return distance, delta
+
+
+def path_centralities(indptr: np.ndarray, indices: np.ndarray, samples: int = CENTRALITY_SAMPLES,
+                      seed: Optional[int] = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """媒介中心性と近接中心性（辺の重みは使わずホップ数で数える）
+
+    連結成分ごとに最大 samples 個の始点から幅優先探索し、成分の大きさ/始点数で拡大して近似する
+    （成分が samples 以下なら厳密値）
+    """
+    n_nodes = indptr.size - 1
+    betweenness = np.zeros(n_nodes)
+    distance_sum = np.zeros(n_nodes)
+    if n_nodes < 2:
+        return betweenness, distance_sum
+
+    components = connected_components(indptr, indices)
+    sizes = np.bincount(components, minlength=n_nodes)
+    order = np.argsort(components, kind='stable')
+    rng = np.random.default_rng(seed)
+
+    for members in np.split(order, np.cumsum(sizes[sizes > 0])[:-1]):
+        if members.size < 2:
+            continue
+        sources = members if members.size <= samples else rng.choice(members, samples, replace=False)
+        scale = members.size / sources.size
+        for source in sources:
+            distance, delta = _shortest_paths(indptr, indices, int(source))
+            betweenness += delta * scale
+            distance_sum += np.maximum(distance, 0) * scale
+
+    # 無向グラフでは各経路を両端から数えているため (n-1)(n-2) で割ると正規化値になる
+    if n_nodes > 2:
+        betweenness /= (n_nodes - 1) * (n_nodes - 2)
+    else:
+        betweenness[:] = 0.0
+
+    # 非連結グラフでも比べられるよう到達可能なノード数で補正（Wasserman-Faust）
+    reachable = sizes[components] - 1
+    closeness = np.zeros(n_nodes)
+    mask = distance_sum > 0
+    closeness[mask] = reachable[mask] / distance_sum[mask] * reachable[mask] / (n_nodes - 1)
+    return betweenness, closeness
+
+
+def eigenvector_centrality(indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """重み付き隣接行列の固有ベクトル中心性（(A + I) のべき乗法、L2正規化）"""
+    n_nodes = indptr.size - 1
+    if not indices.size:
+        return np.zeros(n_nodes)
+
+    rows = _row_ids(indptr)
+    x = np.full(n_nodes, 1.0 / n_nodes)
+    for _ in range(EIGENVECTOR_ITERATIONS):
+        updated = x + np.bincount(rows, weights=weights * x[indices], minlength=n_nodes)
+        updated /= np.linalg.norm(updated) or 1.0
+        if np.abs(updated - x).sum() < n_nodes * EIGENVECTOR_TOLERANCE:
+            return updated
+        x = updated
+    logging.getLogger(__name__).debug("固有ベクトル中心性が反復上限までに収束しませんでした")
+    return x
+
+
+def centralities(graph: CSRGraph, measures: Iterable[str] = CENTRALITY_MEASURES,
+                 samples: int = CENTRALITY_SAMPLES) -> Dict[str, np.ndarray]:
+    """指定した中心性をまとめて計算"""
+    indptr, indices, weights = graph
+    n_nodes = indptr.size - 1
+    measures = set(measures)
+    unknown = measures - set(CENTRALITY_MEASURES)
+    if unknown:
+        raise ValueError(f"未対応の中心性です: {', '.join(sorted(unknown))}")
+
+    result = {}
+    if 'degree' in measures:
+        result['degree'] = np.diff(indptr) / max(1, n_nodes - 1)
+    if measures & {'betweenness', 'closeness'}:
+        betweenness, closeness = path_centralities(indptr, indices, samples=samples)
+        if 'betweenness' in measures:
+            result['betweenness'] = betweenness
+        if 'closeness' in measures:
+            result['closeness'] = closeness
+    if 'eigenvector' in measures:
+        result['eigenvector'] = eigenvector_centrality(indptr, indices, weights)
+    return result
+
+
+def _louvain_level(graph: CSRGraph, rng: np.random.Generator, resolution: float) -> Tuple[np.ndarray, bool]:
+    """各ノードをモジュラリティが最も増える隣のコミュニティへ移す（1階層分）"""
+    indptr, indices, weights = graph
+    n_nodes = indptr.size - 1
+    strength = np.bincount(_row_ids(indptr), weights=weights, minlength=n_nodes)
+    total_weight = strength.sum()
+    community = np.arange(n_nodes)
+    if total_weight <= 0:
+        return community, False
+
+    ptr, neighbors, edge_weights = indptr.tolist(), indices.tolist(), weights.tolist()
+    node_strength = strength.tolist()
+    community_strength = strength.tolist()
+    assignment = community.tolist()
+
+    improved = False
+    for _ in range(LOUVAIN_PASSES):
+        moved = 0
+        for node in rng.permutation(n_nodes).tolist():
+            current = assignment[node]
+            links: Dict[int, float] = {}
+            for k in range(ptr[node], ptr[node + 1]):
+                neighbor = neighbors[k]
+                if neighbor != node:
+                    target = assignment[neighbor]
+                    links[target] = links.get(target, 0.0) + edge_weights[k]
+
+            degree = node_strength[node]
+            community_strength[current] -= degree
+            ratio = resolution * degree / total_weight
+            best, best_gain = current, links.get(current, 0.0) - community_strength[current] * ratio
+            for target, weight in links.items():
+                gain = weight - community_strength[target] * ratio
+                if gain > best_gain + 1e-12:
+                    best, best_gain = target, gain
+
+            community_strength[best] += degree
+            if best != current:
+                assignment[node] = best
+                moved += 1
+        if not moved:
+            break
+        improved = True
+
+    return np.asarray(assignment, dtype=np.int64), improved
+
+
+def louvain(graph: CSRGraph, resolution: float = 1.0, seed: Optional[int] = 0) -> np.ndarray:
+    """Louvain法によるコミュニティ番号（0始まりの連番）"""
+    indptr, indices, weights = graph
+    labels = np.arange(indptr.size - 1)
+    rng = np.random.default_rng(seed)
+
+    while True:
+        community, improved = _louvain_level(graph, rng, resolution)
+        if not improved:
+            return np.unique(labels, return_inverse=True)[1]
+        _, community = np.unique(community, return_inverse=True)
+        labels = community[labels]
+
+        # コミュニティを1ノードにまとめたグラフで次の階層を処理する（内部の辺は自己ループ）
+        indptr, indices, weights = graph
+        graph = build_csr(int(community.max()) + 1, community[_row_ids(indptr)], community[indices],
+                          weights, keep_loops=True)
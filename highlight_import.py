@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ハイライト取り込み - Kindleの My Clippings.txt と Readwise の書き出し（CSV/JSON）をメモとして一括保存
+書き出しは1件ずつ読みながら本ごと（またはハイライトごと）のメモにまとめ、BatchRunner で並行して分析・保存する
+取り込み済みのハイライトは内容のハッシュで台帳に記録し、同じ書き出しを何度取り込んでも重複させない
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from app_settings import get_cache_dir
+from batch_runner import BatchRunner, NoteWriter
+from response_cache import normalize_content
+
+# 1つのメモにまとめるハイライトの上限（メモの大きさとメモリを抑える）
+MAX_HIGHLIGHTS_PER_MEMO = 30
+MAX_MEMO_CHARS = 8000
+
+# 同時にまとめかけておく本の数（Kindleは時系列なので、複数の本を並行して読むと交互に現れる）
+MAX_OPEN_BOOKS = 16
+
+# JSONの書き出しを読み進める単位
+JSON_READ_SIZE = 64 * 1024
+
+# 配列の1要素の上限（文字数）。これを超えても読み切れない要素は壊れているとみなして中断する
+MAX_JSON_ELEMENT_CHARS = 16 * 1024 * 1024
+
+# 書き出し形式ごとの保存先カテゴリ（universal_analysis.FOLDER_MAP のキー）
+FORMAT_CATEGORIES = {
+    'kindle': 'kindle',
+    'readwise-csv': 'readwise',
+    'readwise-json': 'readwise',
+}
+
+# 取り込んだノートのフロントマターの source（ローカル分類器の学習から除く）
+NOTE_SOURCE = 'highlight-import'
+
+GROUPINGS = ('book', 'highlight')
+
+_CLIPPING_SEPARATOR = '=========='
+_TITLE_AUTHOR = re.compile(r'^(.*?)\s*\(([^()]*)\)\s*$')
+_LOCATION = re.compile(r'(?:Location|位置No\.)\s*([\d\-]+)', re.IGNORECASE)
+_PAGE = re.compile(r'(?:page\s*(\d+)|(\d+)\s*ページ)', re.IGNORECASE)
+_ADDED = re.compile(r'(?:Added on|作成日[:：])\s*(.+)$')
+
+
+class Highlight(NamedTuple):
+    book: str
+    author: str
+    text: str
+    location: str = ''
+    note: str = ''
+    added: str = ''
+
+
+def highlight_hash(highlight: Highlight) -> str:
+    """重複判定のキー（本文とメモのみ。書き出し元で書名の表記が違っても同じハイライトとみなす）"""
+    payload = normalize_content(highlight.text) + '\n' + normalize_content(highlight.note)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _parse_clipping(lines: List[str]) -> Optional[Highlight]:
+    """My Clippings.txt の1件（書名行・情報行・空行・本文）を読む（ブックマークは除く）"""
+    lines = [line.lstrip('\ufeff').rstrip('\r\n') for line in lines]
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    if len(lines) < 2:
+        return None
+
+    title_line, meta = lines[0].strip(), lines[1]
+    text = '\n'.join(lines[2:]).strip()
+    if not text or re.search(r'Bookmark|ブックマーク', meta, re.IGNORECASE):
+        return None
+
+    match = _TITLE_AUTHOR.match(title_line)
+    book, author = (match.group(1), match.group(2)) if match else (title_line, '')
+
+    location = _LOCATION.search(meta)
+    page = _PAGE.search(meta)
+    added = _ADDED.search(meta)
+    position = location.group(1) if location else (page.group(1) or page.group(2) if page else '')
+
+    # Kindle上で付けたメモは、ハイライトとは別の1件になる
+    if re.search(r'\bNote\b|メモ', meta):
+        return Highlight(book, author, '', position, text, added.group(1).strip() if added else '')
+    return Highlight(book, author, text, position, '', added.group(1).strip() if added else '')
+
+
+def iter_kindle_clippings(path: str) -> Iterator[Highlight]:
+    """My Clippings.txt を1件ずつ読む"""
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        entry: List[str] = []
+        for line in f:
+            if line.strip() == _CLIPPING_SEPARATOR:
+                highlight = _parse_clipping(entry)
+                if highlight:
+                    yield highlight
+                entry = []
+            else:
+                entry.append(line)
+        highlight = _parse_clipping(entry)
+        if highlight:
+            yield highlight
+
+
+def iter_readwise_csv(path: str) -> Iterator[Highlight]:
+    """Readwise のCSV書き出し（Highlight, Book Title, Book Author, Note, Location, Highlighted at）を1行ずつ読む"""
+    with open(path, 'r', encoding='utf-8-sig', errors='replace', newline='') as f:
+        for row in csv.DictReader(f):
+            text = (row.get('Highlight') or '').strip()
+            note = (row.get('Note') or '').strip()
+            if not text and not note:
+                continue
+            yield Highlight((row.get('Book Title') or '').strip(), (row.get('Book Author') or '').strip(),
+                            text, (row.get('Location') or '').strip(), note,
+                            (row.get('Highlighted at') or '').strip())
+
+
+def _iter_json_array(f) -> Iterator[object]:
+    """開き括弧「[」を読んだ後のJSON配列を要素ごとに読む（ファイル全体を読み込まない）"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        chunk = f.read(JSON_READ_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            # 要素の間の空白・カンマを読み飛ばす
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # 要素が読み込み単位をまたいでいる（上限を超えても読めなければ壊れた要素）
+                if len(buffer) - position > MAX_JSON_ELEMENT_CHARS:
+                    raise ValueError(f"JSONの要素を読めません（{MAX_JSON_ELEMENT_CHARS}文字を超えても要素が終わりません）")
+                break
+            if end == len(buffer) and chunk:
+                # 数値などは続きがあるかもしれないため次の読み込みを待つ
+                break
+            yield value
+            position = end
+        buffer = buffer[position:]
+        if not chunk:
+            if buffer.strip():
+                raise ValueError("JSONの配列が途中で終わっています")
+            return
+
+
+def _readwise_items(item: Dict) -> Iterator[Highlight]:
+    """本（highlights を持つ）またはハイライト1件の要素をハイライトにする"""
+    book = item.get('title') or item.get('book_title') or item.get('readable_title') or ''
+    author = item.get('author') or item.get('book_author') or ''
+    highlights = item.get('highlights') if isinstance(item.get('highlights'), list) else [item]
+    for highlight in highlights:
+        text = (highlight.get('text') or '').strip()
+        note = (highlight.get('note') or '').strip()
+        if not text and not note:
+            continue
+        yield Highlight(book, author, text, str(highlight.get('location') or ''), note,
+                        str(highlight.get('highlighted_at') or ''))
+
+
+def iter_readwise_json(path: str) -> Iterator[Highlight]:
+    """Readwise のJSON書き出し（本またはハイライトの配列）を要素ごとに読む
+
+    APIの応答形式（{"results": [...]}）は配列を取り出すために全体を読み込む
+    """
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        if first == '[':
+            items = _iter_json_array(f)
+        else:
+            logging.getLogger(__name__).info("配列でないJSONのため全体を読み込みます")
+            data = json.loads(first + f.read())
+            items = data.get('results', []) if isinstance(data, dict) else []
+        for item in items:
+            if isinstance(item, dict):
+                yield from _readwise_items(item)
+
+
+def detect_format(path: str) -> str:
+    """拡張子から書き出し形式を決める"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'readwise-csv'
+    if extension == '.json':
+        return 'readwise-json'
+    return 'kindle'
+
+
+def iter_highlights(path: str, source_format: str = 'auto') -> Iterator[Highlight]:
+    source_format = detect_format(path) if source_format == 'auto' else source_format
+    readers = {
+        'kindle': iter_kindle_clippings,
+        'readwise-csv': iter_readwise_csv,
+        'readwise-json': iter_readwise_json,
+    }
+    if source_format not in readers:
+        raise ValueError(f"未対応の書き出し形式です: {source_format}")
+    return readers[source_format](path)
+
+
+class ImportLedger:
+    """取り込み済みハイライトのハッシュをSQLiteに記録"""
+
+    def __init__(self, db_path: str = None):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path or os.path.join(get_cache_dir(), 'imported_highlights.sqlite3')
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS highlights (
+                    hash TEXT PRIMARY KEY,
+                    book TEXT NOT NULL,
+                    file TEXT,
+                    imported_at REAL NOT NULL
+                )
+            """)
+        return self._conn
+
+    def __contains__(self, highlight_hash: str) -> bool:
+        return self._connect().execute(
+            "SELECT 1 FROM highlights WHERE hash = ?", (highlight_hash,)
+        ).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM highlights").fetchone()[0]
+
+    def add(self, hashes: Iterable[str], book: str, file_path: Optional[str] = None):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO highlights (hash, book, file, imported_at) VALUES (?, ?, ?, ?)",
+                [(highlight_hash, book, file_path, now) for highlight_hash in hashes],
+            )
+
+
+def format_memo(highlights: List[Highlight]) -> str:
+    """同じ本のハイライトを1つのメモ本文にする"""
+    first = highlights[0]
+    heading = f"『{first.book}』" + (f" {first.author}" if first.author else '')
+    parts = [heading]
+    for highlight in highlights:
+        lines = []
+        if highlight.text:
+            lines.append(highlight.text)
+        if highlight.note:
+            lines.append(f"メモ: {highlight.note}")
+        if highlight.location:
+            lines.append(f"（位置 {highlight.location}）")
+        parts.append('\n'.join(lines))
+    return '\n\n'.join(parts)
+
+
+def iter_highlight_memos(highlights: Iterable[Highlight], ledger: ImportLedger, group: str = 'book',
+                         max_highlights: int = MAX_HIGHLIGHTS_PER_MEMO,
+                         stats: Optional[Dict[str, int]] = None) -> Iterator[Tuple[str, str, List[str]]]:
+    """取り込み済みを除いたハイライトを (メモID, メモ内容, ハイライトのハッシュ) にまとめる
+
+    group='book' では本ごとに1メモにまとめる（上限 max_highlights 件・MAX_MEMO_CHARS 文字）。
+    まとめかけの本は MAX_OPEN_BOOKS 冊までで、超えたら最も長く現れていない本から書き出す
+    """
+    if group not in GROUPINGS:
+        raise ValueError(f"未対応のまとめ方です: {group}")
+    stats = stats if stats is not None else {}
+    # 同じ書き出しの中の重複（Kindleで選択範囲を直したハイライトなど）も除く
+    seen: Set[str] = set()
+    # 本 → (ハイライト, ハッシュ, 文字数)。最後に現れた本が末尾
+    open_books: 'OrderedDict[str, Tuple[List[Highlight], List[str], List[int]]]' = OrderedDict()
+    count = 0
+
+    def flush(book: str) -> Tuple[str, str, List[str]]:
+        nonlocal count
+        batch, hashes, _ = open_books.pop(book)
+        count += 1
+        # ハイライトごとにまとめる場合の book はハッシュなので、IDには本の題名を使う
+        return f"{count}:{batch[0].book}", format_memo(batch), hashes
+
+    for highlight in highlights:
+        key = highlight_hash(highlight)
+        if key in seen or key in ledger:
+            stats['duplicates'] = stats.get('duplicates', 0) + 1
+            continue
+        seen.add(key)
+        stats['highlights'] = stats.get('highlights', 0) + 1
+
+        book = highlight.book if group == 'book' else key
+        if book not in open_books:
+            if len(open_books) >= MAX_OPEN_BOOKS:
+                yield flush(next(iter(open_books)))
+            open_books[book] = ([], [], [0])
+        open_books.move_to_end(book)
+        batch, hashes, chars = open_books[book]
+        batch.append(highlight)
+        hashes.append(key)
+        chars[0] += len(highlight.text) + len(highlight.note)
+        if group == 'highlight' or len(batch) >= max_highlights or chars[0] >= MAX_MEMO_CHARS:
+            yield flush(book)
+
+    while open_books:
+        yield flush(next(iter(open_books)))
+
+
+def import_highlights(source: str, analyzer, categories: List[str], write_note: Optional[NoteWriter],
+                      source_format: str = 'auto', group: str = 'book', concurrency: int = 4,
+                      out=None, ledger: Optional[ImportLedger] = None) -> Dict[str, int]:
+    """書き出しを読みながらメモにまとめ、分析して保存する（保存できたハイライトを台帳に記録）
+
+    write_note が None（分析のみ）の場合は台帳に記録しない
+    """
+    source_format = detect_format(source) if source_format == 'auto' else source_format
+    if source_format not in FORMAT_CATEGORIES:
+        raise ValueError(f"未対応の書き出し形式です: {source_format}")
+    ledger = ledger or ImportLedger()
+    runner = BatchRunner(analyzer, categories, write_note=write_note, concurrency=concurrency,
+                         category=FORMAT_CATEGORIES[source_format], source=NOTE_SOURCE)
+
+    stats: Dict[str, int] = {}
+    # 分析・保存中のメモのハイライト（同時実行数ぶんだけ保持する）
+    in_flight: Dict[str, Tuple[str, List[str]]] = {}
+
+    def memos() -> Iterator[Tuple[str, str, None]]:
+        for memo_id, content, hashes in iter_highlight_memos(iter_highlights(source, source_format), ledger,
+                                                            group=group, stats=stats):
+            in_flight[memo_id] = (memo_id.split(':', 1)[1], hashes)
+            yield memo_id, content, None
+
+    def on_record(record: Dict):
+        book, hashes = in_flight.pop(record['id'], ('', []))
+        if record['status'] == 'ok' and write_note:
+            ledger.add(hashes, book, record.get('file'))
+
+    summary = runner.run(memos(), out or sys.stdout, on_record=on_record)
+    summary.update({'highlights': stats.get('highlights', 0), 'duplicates': stats.get('duplicates', 0)})
+    logging.getLogger(__name__).info(f"ハイライト取り込み完了: {summary}")
+    return summary
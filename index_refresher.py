@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+索引の定期更新 - 常駐サーバーでVaultの索引を起動時と一定間隔ごとに裏で作成・更新する
+プレビューは作成済みの索引を引くだけにし、Vault全体の走査やベクトル化を待たせない
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, List, Optional, Tuple
+
+# 各索引の refresh() を呼ぶ間隔の上限（秒）。実際に走査し直すかは各索引の refresh_interval で決まる
+CHECK_INTERVAL = 60
+
+RefreshJob = Tuple[str, Callable[[], None]]
+
+
+class IndexRefresher:
+    """(名前, 更新処理) の一覧を専用のスレッドで順に実行し続ける"""
+
+    def __init__(self, jobs: List[RefreshJob], interval: float = CHECK_INTERVAL):
+        self.logger = logging.getLogger(__name__)
+        self.jobs = jobs
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self):
+        """全ての索引を更新（失敗した索引は次の回にもう一度試す）"""
+        for name, job in self.jobs:
+            if self._stop.is_set():
+                return
+            started = time.time()
+            try:
+                job()
+            except Exception as e:
+                self.logger.warning(f"{name}の更新に失敗: {e}")
+                continue
+            elapsed = time.time() - started
+            if elapsed >= 1.0:
+                self.logger.info(f"{name}を更新: {elapsed:.2f}秒")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """起動直後に1回、以降は interval 秒ごとに更新（プロセス終了を妨げないデーモンスレッド）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='index-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IVF索引 - ベクトルストアの近似最近傍検索
+k-meansの重心（粗い量子化）ごとに行番号の転置リストを持ち、
+検索ではクエリに近い nprobe 個のリストの行だけを読んで類似度を計算する
+"""
+
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from kmeans import assign, train_centroids
+from vector_store import VectorHit, VectorStore
+
+# これより少ないベクトル数では全件検索の方が速いため索引を作らない
+MIN_VECTORS = 2000
+
+# 重心の学習に使うベクトルの上限（超える場合は無作為に抽出）
+MAX_TRAIN_VECTORS = 50000
+
+# 学習時からベクトル数がこの倍率を超えて増えたら重心を学習し直す
+RETRAIN_GROWTH = 2.0
+
+
+class IVFIndex:
+    """VectorStore の行を重心ごとの転置リストに振り分けた近似最近傍索引"""
+
+    def __init__(self, store: VectorStore, n_clusters: int = 10, algorithm: str = 'kmeans',
+                 nprobe: int = 4, min_vectors: int = MIN_VECTORS):
+        self.logger = logging.getLogger(__name__)
+        self.store = store
+        self.n_clusters = n_clusters
+        self.algorithm = algorithm
+        self.nprobe = nprobe
+        self.min_vectors = min_vectors
+        self.centroids_path = os.path.join(store.directory, 'centroids.npy')
+        self._lock = threading.RLock()
+        # 学習は同時に1つだけ（検索用の _lock とは分ける）
+        self._train_lock = threading.Lock()
+        self._conn = None
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: Dict[int, array] = {}
+        self._loaded = False
+
+    @classmethod
+    def from_config(cls, store: VectorStore, config: Dict) -> 'IVFIndex':
+        """config.yaml の topic_clustering（n_clusters, algorithm）と semantic_search から生成"""
+        advanced = config.get('advanced_relation_analysis', {}) or {}
+        clustering = advanced.get('topic_clustering', {}) or {}
+        settings = advanced.get('semantic_search', {}) or {}
+        return cls(store,
+                   n_clusters=clustering.get('n_clusters', 10),
+                   algorithm=clustering.get('algorithm', 'kmeans'),
+                   nprobe=settings.get('ann_nprobe', 4),
+                   min_vectors=settings.get('ann_min_vectors', MIN_VECTORS))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(os.path.join(self.store.directory, 'ivf.sqlite3'), check_same_thread=False)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS assignments (
+                    row INTEGER PRIMARY KEY,
+                    list INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+        return self._conn
+
+    def _meta(self) -> Dict[str, str]:
+        return dict(self._connect().execute("SELECT name, value FROM meta").fetchall())
+
+    def _load(self):
+        """保存済みの重心と転置リストを読み込む（ストアと食い違う場合は読み込まない）"""
+        if self._loaded:
+            return
+        self._loaded = True
+        conn = self._connect()
+        meta = self._meta()
+        if meta.get('embedder') != self.store.embedder_name or not os.path.exists(self.centroids_path):
+            return
+
+        assigned = conn.execute("SELECT COUNT(*) FROM assignments").fetchone()[0]
+        if assigned != len(self.store):
+            self.logger.info("転置リストがベクトルストアと一致しないため学習し直します")
+            return
+
+        self._centroids = np.load(self.centroids_path)
+        self._lists = {}
+        for row, list_id in conn.execute("SELECT row, list FROM assignments ORDER BY row"):
+            self._lists.setdefault(list_id, array('q')).append(row)
+
+    @property
+    def trained(self) -> bool:
+        with self._lock:
+            self._load()
+            return self._centroids is not None
+
+    def n_lists(self, n_vectors: int) -> int:
+        """転置リストの数（topic_clustering.n_clusters を下限に、ベクトル数の平方根まで増やす）"""
+        return max(1, min(n_vectors, max(self.n_clusters, int(math.sqrt(n_vectors)))))
+
+    def train(self):
+        """登録済みのベクトルから重心を学習し、全行を転置リストに振り分け直す
+
+        重心の学習と振り分けはロックの外で行い、その間も前回の重心で検索できるようにする
+        （学習中に追加・削除された行は入れ替えの直前に反映する）
+        """
+        with self._train_lock:
+            self._train()
+
+    def _train(self):
+        started = time.time()
+        rows = self.store.registered_rows()
+        if rows.size == 0:
+            return
+        matrix = self.store.matrix()
+
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(rows, MAX_TRAIN_VECTORS, replace=False)) if rows.size > MAX_TRAIN_VECTORS else rows
+        centroids = train_centroids(matrix[sample].astype(np.float32), self.n_lists(rows.size), self.algorithm)
+        labels = assign(matrix[rows], centroids)
+
+        with self._lock:
+            current = self.store.registered_rows()
+            added = np.setdiff1d(current, rows, assume_unique=True)
+            if added.size:
+                rows = np.concatenate([rows, added])
+                labels = np.concatenate([labels, assign(self.store.matrix()[added], centroids)])
+            kept = np.isin(rows, current, assume_unique=True)
+            rows, labels = rows[kept], labels[kept]
+
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM assignments")
+                conn.executemany("INSERT INTO assignments (row, list) VALUES (?, ?)",
+                                 zip(rows.tolist(), labels.tolist()))
+                conn.execute("DELETE FROM meta")
+                conn.executemany("INSERT INTO meta (name, value) VALUES (?, ?)", [
+                    ('embedder', self.store.embedder_name),
+                    ('trained_rows', str(rows.size)),
+                ])
+            np.save(self.centroids_path, centroids)
+
+            self._centroids = centroids
+            self._lists = {}
+            for row, list_id in zip(rows.tolist(), labels.tolist()):
+                self._lists.setdefault(list_id, array('q')).append(row)
+            self._loaded = True
+        self.logger.info(f"IVF索引を学習: {rows.size}件, {centroids.shape[0]}リスト, {time.time() - started:.2f}秒")
+
+    def ensure(self):
+        """ベクトル数が学習の条件を満たせば（再）学習する"""
+        with self._lock:
+            self._load()
+            count = len(self.store)
+            if count < self.min_vectors:
+                return
+            trained_rows = int(self._meta().get('trained_rows', 0)) if self._centroids is not None else 0
+            if trained_rows and count <= trained_rows * RETRAIN_GROWTH:
+                return
+        self.train()
+
+    def _detach(self, conn: sqlite3.Connection, rows: Sequence[int]):
+        for row in rows:
+            previous = conn.execute("SELECT list FROM assignments WHERE row = ?", (row,)).fetchone()
+            if previous and row in self._lists.get(previous[0], ()):
+                self._lists[previous[0]].remove(row)
+
+    def add(self, rows: Sequence[int], vectors: np.ndarray):
+        """追加・更新した行を最も近い重心のリストに入れる（未学習なら何もしない）"""
+        with self._lock:
+            if not rows or not self.trained:
+                return
+            labels = assign(np.asarray(vectors, dtype=np.float32), self._centroids)
+            conn = self._connect()
+            with conn:
+                self._detach(conn, rows)
+                conn.executemany("INSERT OR REPLACE INTO assignments (row, list) VALUES (?, ?)",
+                                 zip(rows, labels.tolist()))
+            for row, list_id in zip(rows, labels.tolist()):
+                self._lists.setdefault(list_id, array('q')).append(row)
+
+    def remove(self, rows: Sequence[int]):
+        """削除した行をリストから外す"""
+        with self._lock:
+            if not rows or not self.trained:
+                return
+            conn = self._connect()
+            with conn:
+                self._detach(conn, rows)
+                conn.executemany("DELETE FROM assignments WHERE row = ?", [(row,) for row in rows])
+
+    def search(self, query: np.ndarray, top_k: int = 10, nprobe: Optional[int] = None) -> List[VectorHit]:
+        """クエリに近い nprobe 個のリストの中から上位を返す（未学習なら全件検索）"""
+        with self._lock:
+            if not self.trained:
+                return self.store.search(query, top_k=top_k)
+            query = np.asarray(query, dtype=np.float32)
+            nprobe = max(1, min(nprobe or self.nprobe, self._centroids.shape[0]))
+            closeness = self._centroids @ query
+            probes = np.argpartition(-closeness, nprobe - 1)[:nprobe]
+            candidates = [np.array(self._lists[int(probe)], dtype=np.int64)
+                          for probe in probes if int(probe) in self._lists]
+
+        if not candidates:
+            return []
+        # 行番号順に読むとメモリマップのページを順に辿れる
+        rows = np.sort(np.concatenate(candidates))
+        scores = self.store.matrix()[rows].astype(np.float32) @ query
+        keep = min(rows.size, top_k + 8)
+        best = np.argpartition(-scores, keep - 1)[:keep]
+        return self.store.top_hits(rows[best], scores[best], top_k)
+
+
+def benchmark(index: IVFIndex, queries: int = 100, top_k: int = 10,
+              nprobes: Sequence[int] = (1, 2, 4, 8, 16)) -> Dict:
+    """登録済みのベクトルから抽出したクエリで、nprobe ごとの再現率と応答時間を全件検索と比べる"""
+    index.ensure()
+    store = index.store
+    rows = store.registered_rows()
+    if rows.size == 0:
+        return {'vectors': 0}
+
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(rows, min(queries, rows.size), replace=False))
+    vectors = store.matrix()[sample].astype(np.float32)
+
+    started = time.perf_counter()
+    exact = [{hit.key for hit in store.search(vector, top_k=top_k)} for vector in vectors]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(vectors)
+
+    report = {
+        'vectors': int(rows.size),
+        'lists': int(index._centroids.shape[0]) if index.trained else 0,
+        'queries': len(vectors),
+        'top_k': top_k,
+        'exact_ms': round(exact_ms, 3),
+        'nprobe': [],
+    }
+    if not index.trained:
+        return report
+
+    for nprobe in nprobes:
+        started = time.perf_counter()
+        found = [{hit.key for hit in index.search(vector, top_k=top_k, nprobe=nprobe)} for vector in vectors]
+        latency_ms = (time.perf_counter() - started) * 1000 / len(vectors)
+        recall = sum(len(a & e) for a, e in zip(found, exact)) / max(1, sum(len(e) for e in exact))
+        report['nprobe'].append({
+            'nprobe': nprobe,
+            'recall': round(recall, 4),
+            'latency_ms': round(latency_ms, 3),
+            'speedup': round(exact_ms / latency_ms, 2) if latency_ms else None,
+        })
+    return report
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+キーワード分類 - API障害時や構造分析のフォールバックで使うカテゴリ・文書種別・対象領域・動作の推定
+全キーワードを1つのAho-Corasickオートマトンにまとめてメモを1回だけ走査し、
+ラベルごとにキーワードの出現を重み付きで合計して最もスコアの高いものを選ぶ
+"""
+
+import math
+import logging
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional
+
+from aho_corasick import KeywordAutomaton
+
+# config.yaml の keyword_classification が無いときのキーワード（ラベルの順は同点時の優先順）
+DEFAULT_CATEGORIES = {
+    'consulting': {'weight': 1.2, 'keywords': [
+        '戦略', '計画', '提案', 'コンサル', '営業', '売上', '収益', '事業', '経営',
+        'マーケティング', 'ブランディング', '集客', '顧客', 'クライアント',
+        '打ち合わせ', '会議', 'ミーティング', '検討', '分析', '企画']},
+    'tech': {'weight': 1.0, 'keywords': [
+        'プログラミング', 'コード', 'システム', 'アプリ', 'API', 'AI', 'DX',
+        'バイブコーディング', 'リファクタリング', '開発', '実装', 'ファイル']},
+    'education': {'weight': 1.0, 'keywords': ['教育', '学習', '授業', '指導', '生徒', '学校', '塾']},
+    'kindle': {'weight': 0.8, 'keywords': ['本', '書籍', '読書', 'Kindle']},
+    'music': {'weight': 1.0, 'keywords': ['音楽', '楽器', '演奏', 'ライブ']},
+    'media': {'weight': 0.8, 'keywords': [
+        'SNS', 'YouTube', 'note', 'ブログ', 'Instagram', 'Twitter', 'TikTok',
+        'コンテンツ制作', '外部発信', 'ニュース', '記事', 'メディア']},
+}
+
+DEFAULT_DOCUMENT_TYPES = {
+    '戦略': ['戦略', '計画'],
+    '手順': ['手順', 'ステップ', '方法'],
+    '分析': ['分析', '検証', '評価'],
+    '提案': ['提案', '案'],
+}
+
+DEFAULT_DOMAINS = {
+    '教育': ['教育', '学習', '授業', '生徒', '指導'],
+    'マーケティング': ['マーケティング', 'ブランディング', '集客', '営業'],
+    '技術': ['コード', 'プログラミング', 'システム', 'AI', 'DX'],
+    'ビジネス': ['経営', 'ビジネス', '事業', '戦略'],
+}
+
+DEFAULT_ACTIONS = {
+    '提案': ['提案', '案'],
+    '分析': ['分析', '検証'],
+    '計画': ['計画', '戦略'],
+    '説明': ['説明', '解説'],
+    '手順': ['手順', '方法'],
+}
+
+# 見出し・箇条書きなど、構造のあるメモの目印
+STRUCTURE_MARKERS = ['##', '**', '■', '◆', '①', '1.', '・']
+
+SECTIONS = ('categories', 'document_types', 'domains', 'actions')
+
+
+class KeywordGroup(NamedTuple):
+    label: str
+    weight: float
+    keywords: List[str]
+
+
+def _groups(settings: Dict) -> List[KeywordGroup]:
+    """{ラベル: [キーワード]} または {ラベル: {weight, keywords}} をラベルごとの組にする"""
+    groups = []
+    for label, value in settings.items():
+        if isinstance(value, dict):
+            groups.append(KeywordGroup(label, float(value.get('weight', 1.0)), list(value.get('keywords') or [])))
+        else:
+            groups.append(KeywordGroup(label, 1.0, list(value or [])))
+    return groups
+
+
+class KeywordClassifier:
+    """キーワードの出現からカテゴリ・文書種別・対象領域・動作を推定"""
+
+    def __init__(self, categories: Dict = None, document_types: Dict = None, domains: Dict = None,
+                 actions: Dict = None, structure_markers: Optional[List[str]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.sections = {
+            'categories': _groups(DEFAULT_CATEGORIES if categories is None else categories),
+            'document_types': _groups(DEFAULT_DOCUMENT_TYPES if document_types is None else document_types),
+            'domains': _groups(DEFAULT_DOMAINS if domains is None else domains),
+            'actions': _groups(DEFAULT_ACTIONS if actions is None else actions),
+        }
+        self.structure_markers = STRUCTURE_MARKERS if structure_markers is None else list(structure_markers)
+
+        keywords = list(self.structure_markers)
+        for groups in self.sections.values():
+            for group in groups:
+                keywords.extend(group.keywords)
+        self.automaton = KeywordAutomaton(keywords)
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'KeywordClassifier':
+        """config.yaml の keyword_classification セクションから生成（無い項目は既定のキーワード）"""
+        settings = config.get('keyword_classification', {}) or {}
+        unknown = set(settings) - set(SECTIONS) - {'structure_markers'}
+        if unknown:
+            raise ValueError(f"未対応のキーワード分類の設定です: {', '.join(sorted(unknown))}")
+        return cls(categories=settings.get('categories'),
+                   document_types=settings.get('document_types'),
+                   domains=settings.get('domains'),
+                   actions=settings.get('actions'),
+                   structure_markers=settings.get('structure_markers'))
+
+    def scan(self, content: str) -> Counter:
+        """メモに含まれる全キーワードの出現回数（メモの走査は1回）"""
+        return self.automaton.count(content)
+
+    def scores(self, section: str, hits: Counter) -> Dict[str, float]:
+        """ラベルごとのスコア（キーワードごとに 1 + log(出現回数) を合計して重みを掛ける）
+
+        同じ語の繰り返しより、異なるキーワードが多く出る方を高く評価する
+        """
+        result = {}
+        for group in self.sections[section]:
+            score = sum(1.0 + math.log(hits[keyword]) for keyword in group.keywords if hits.get(keyword))
+            if score > 0:
+                result[group.label] = score * group.weight
+        return result
+
+    def best(self, section: str, hits: Counter) -> Optional[str]:
+        """最もスコアの高いラベル（同点なら設定の先の方、キーワードが無ければNone）"""
+        scores = self.scores(section, hits)
+        if not scores:
+            return None
+        # max は同点のとき最初の要素を返すため、設定の順が優先順になる
+        return max(scores, key=scores.get)
+
+    def classify(self, hits: Counter) -> str:
+        """カテゴリ（該当キーワードが無ければ others）"""
+        return self.best('categories', hits) or 'others'
+
+    def has_structure(self, hits: Counter) -> bool:
+        return any(hits.get(marker) for marker in self.structure_markers)
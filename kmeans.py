@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+k-means - 正規化済みベクトルのクラスタリング（NumPyのみ）
+ベクトルはコサイン類似度で比べるため、重心も毎回正規化する（球面k-means）
+"""
+
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+
+# 最近傍の重心を求めるときに一度に処理する行数
+ASSIGN_BLOCK_ROWS = 16384
+
+# ミニバッチk-meansの1回に読むベクトル数と反復回数の上下限
+MINIBATCH_SIZE = 1024
+MINIBATCH_MIN_ITERATIONS = 50
+MINIBATCH_MAX_ITERATIONS = 500
+
+KMEANS_ALGORITHMS = ('kmeans', 'minibatch-kmeans')
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def nearest(vectors: np.ndarray, centroids: np.ndarray,
+            rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """各ベクトルに最も近い重心の番号とその類似度（メモリマップした行列もブロックごとに読む）
+
+    rows を渡すとその行だけを対象にする
+    """
+    count = vectors.shape[0] if rows is None else rows.size
+    labels = np.empty(count, dtype=np.int64)
+    similarity = np.empty(count, dtype=np.float32)
+    for start in range(0, count, ASSIGN_BLOCK_ROWS):
+        if rows is None:
+            block = vectors[start:start + ASSIGN_BLOCK_ROWS]
+        else:
+            block = vectors[rows[start:start + ASSIGN_BLOCK_ROWS]]
+        scores = np.asarray(block, dtype=np.float32) @ centroids.T
+        end = start + scores.shape[0]
+        labels[start:end] = np.argmax(scores, axis=1)
+        similarity[start:end] = scores[np.arange(scores.shape[0]), labels[start:end]]
+    return labels, similarity
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """各ベクトルに最も近い重心の番号"""
+    return nearest(vectors, centroids)[0]
+
+
+def _init_centroids(vectors: np.ndarray, n_clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """k-means++ で初期重心を選ぶ"""
+    centroids = np.empty((n_clusters, vectors.shape[1]), dtype=np.float32)
+    centroids[0] = vectors[rng.integers(vectors.shape[0])]
+    # 最も近い重心までの距離（正規化済みなので 1 - 類似度）
+    distance = np.maximum(1.0 - vectors @ centroids[0], 0.0)
+    for i in range(1, n_clusters):
+        total = distance.sum()
+        if total <= 0:
+            index = rng.integers(vectors.shape[0])
+        else:
+            index = rng.choice(vectors.shape[0], p=distance / total)
+        centroids[i] = vectors[index]
+        distance = np.minimum(distance, np.maximum(1.0 - vectors @ centroids[i], 0.0))
+    return centroids
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 20,
+           seed: Optional[int] = 0, tolerance: float = 1e-4) -> np.ndarray:
+    """球面k-meansで重心（正規化済み、n_clusters × 次元）を求める"""
+    vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    n_clusters = max(1, min(n_clusters, vectors.shape[0]))
+    rng = np.random.default_rng(seed)
+    centroids = _init_centroids(vectors, n_clusters, rng)
+
+    previous = None
+    for iteration in range(iterations):
+        labels = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_clusters)
+
+        # 空のクラスタは重心から最も遠いベクトルで置き直す
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            similarity = np.einsum('ij,ij->i', vectors, centroids[labels])
+            sums[empty] = vectors[np.argsort(similarity)[:empty.size]]
+
+        centroids = _normalize_rows(sums)
+        inertia = float(np.einsum('ij,ij->i', vectors, centroids[labels]).sum())
+        if previous is not None and abs(inertia - previous) <= tolerance * max(abs(previous), 1.0):
+            break
+        previous = inertia
+
+    logging.getLogger(__name__).debug(f"k-means: {n_clusters}クラスタ, {iteration + 1}回で収束")
+    return centroids
+
+
+def minibatch_kmeans(vectors: np.ndarray, n_clusters: int, rows: Optional[np.ndarray] = None,
+                     batch_size: int = MINIBATCH_SIZE, iterations: Optional[int] = None,
+                     seed: Optional[int] = 0, tolerance: float = 1e-4) -> np.ndarray:
+    """ミニバッチk-means（Sculley 2010）で重心を求める
+
+    反復ごとに batch_size 行だけを読むため、メモリマップした行列でも全件をメモリに載せない
+    """
+    rows = np.arange(vectors.shape[0]) if rows is None else np.asarray(rows, dtype=np.int64)
+    n_clusters = max(1, min(n_clusters, rows.size))
+    batch_size = min(batch_size, rows.size)
+    if iterations is None:
+        # 全体を3周する程度（上下限あり）
+        iterations = int(np.clip(3 * rows.size // batch_size, MINIBATCH_MIN_ITERATIONS, MINIBATCH_MAX_ITERATIONS))
+    rng = np.random.default_rng(seed)
+
+    def read(count: int) -> np.ndarray:
+        batch = np.sort(rng.choice(rows, count, replace=False))
+        return _normalize_rows(np.asarray(vectors[batch], dtype=np.float32))
+
+    centroids = _init_centroids(read(min(rows.size, max(3 * batch_size, 10 * n_clusters))), n_clusters, rng)
+    counts = np.zeros(n_clusters)
+    for iteration in range(iterations):
+        batch = read(batch_size)
+        labels = np.argmax(batch @ centroids.T, axis=1)
+        batch_counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, batch)
+
+        # 重心ごとに、これまでに割り当てた件数の逆数を学習率として新しい平均へ寄せる
+        counts += batch_counts
+        updated = batch_counts > 0
+        previous = centroids.copy()
+        centroids[updated] += (sums[updated] - batch_counts[updated, None] * centroids[updated]) / counts[updated, None]
+        centroids = _normalize_rows(centroids)
+        if np.abs(centroids - previous).sum() <= tolerance * n_clusters:
+            break
+
+    logging.getLogger(__name__).debug(f"ミニバッチk-means: {n_clusters}クラスタ, {iteration + 1}回で収束")
+    return centroids
+
+
+def train_centroids(vectors: np.ndarray, n_clusters: int, algorithm: str = 'kmeans',
+                    seed: Optional[int] = 0) -> np.ndarray:
+    """config.yaml の topic_clustering.algorithm に応じて重心を求める"""
+    if algorithm not in KMEANS_ALGORITHMS:
+        raise ValueError(f"未対応のクラスタリング方式です: {algorithm}")
+    if algorithm == 'minibatch-kmeans':
+        return minibatch_kmeans(vectors, n_clusters, seed=seed)
+    return kmeans(vectors, n_clusters, seed=seed)
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+リンクグラフ - Vaultのノート間の [[wikilink]] とタグの共起から無向グラフを作り、
+中心性とコミュニティをキャッシュする
+ノートごとのリンク先・タグはSQLiteに差分更新で保持し、ノートが変わったときだけ
+CSR形式の隣接行列と中心性を作り直す（結果は npz ファイルに保存して使い回す）
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app_settings import get_cache_dir
+from graph_algorithms import CENTRALITY_MEASURES, CENTRALITY_SAMPLES, centralities, louvain, symmetric_csr
+from vault_scan import SCAN_WORKERS, get_tags, parse_frontmatter, scan_markdown_files, split_frontmatter
+
+# リンクの読み取り方・キャッシュの形式を変えたら更新すること（古い索引は作り直す）
+INDEX_VERSION = 1
+
+# これより多くのノートに付いたタグは共起の辺にしない（ほぼ全ノートを結んでしまうため）
+MAX_TAG_NOTES = 50
+
+# タグの共起の辺の重み（1つのタグから1ノートに張られる辺の重みの合計）
+TAG_EDGE_WEIGHT = 0.5
+
+# 関連ノートの並べ替えで固有ベクトル中心性（最大値を1とした比）に掛ける重み
+CENTRALITY_BOOST = 0.2
+
+# [[ノート名#見出し|表示名]] のノート名部分（![[埋め込み]] も含む）
+_WIKILINK = re.compile(r'\[\[([^\[\]|#^]+)(?:[#^][^\[\]|]*)?(?:\|[^\[\]]*)?\]\]')
+
+
+class GraphScores(NamedTuple):
+    paths: List[str]
+    # 中心性の名前 → ノートごとの値（paths と同じ順）
+    measures: Dict[str, np.ndarray]
+    # コミュニティ番号（min_community_size 未満のコミュニティは -1）
+    communities: np.ndarray
+    edges: int
+
+
+def extract_links(text: str) -> List[str]:
+    """本文中の wikilink のリンク先（小文字、拡張子 .md を除く。画像などの添付は除く）"""
+    links = []
+    for target in _WIKILINK.findall(text):
+        target = target.strip().lower()
+        root, extension = os.path.splitext(target)
+        if extension == '.md':
+            target = root
+        elif extension and ' ' not in extension:
+            continue
+        if target:
+            links.append(target)
+    return links
+
+
+class LinkGraph:
+    """Vaultのノートのリンク・タグ共起グラフと、その中心性・コミュニティのキャッシュ"""
+
+    def __init__(self, vault_path: str, db_path: str = None, refresh_interval: float = 600,
+                 measures: Sequence[str] = CENTRALITY_MEASURES, community_detection: Optional[str] = 'louvain',
+                 min_community_size: int = 3, samples: int = CENTRALITY_SAMPLES):
+        self.logger = logging.getLogger(__name__)
+        self.vault_path = vault_path
+        if not db_path:
+            vault_hash = hashlib.sha256(os.path.abspath(vault_path).encode('utf-8')).hexdigest()[:12]
+            db_path = os.path.join(get_cache_dir(), f'link_graph-{vault_hash}.sqlite3')
+        self.db_path = db_path
+        self.scores_path = os.path.splitext(db_path)[0] + '.npz'
+        self.refresh_interval = refresh_interval
+        self.measures = list(measures)
+        if community_detection not in (None, 'louvain'):
+            raise ValueError(f"未対応のコミュニティ検出方式です: {community_detection}")
+        self.community_detection = community_detection
+        self.min_community_size = min_community_size
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._conn = None
+        self._scores: Optional[GraphScores] = None
+        self._scores_version = None
+        self._compute_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, vault_path: str, config: Dict) -> 'LinkGraph':
+        """config.yaml の network_analysis・note_index セクションから生成"""
+        settings = (config.get('advanced_relation_analysis', {}) or {}).get('network_analysis', {}) or {}
+        note_index = config.get('note_index', {}) or {}
+        return cls(vault_path,
+                   refresh_interval=note_index.get('refresh_interval_seconds', 600),
+                   measures=settings.get('centrality_measures', CENTRALITY_MEASURES),
+                   community_detection=settings.get('community_detection', 'louvain'),
+                   min_community_size=settings.get('min_community_size', 3))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+                self._conn.executescript("""
+                    DROP TABLE IF EXISTS files;
+                    DROP TABLE IF EXISTS meta;
+                """)
+                self._conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    links TEXT NOT NULL,
+                    tags TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                );
+            """)
+        return self._conn
+
+    def _meta(self, conn: sqlite3.Connection, name: str, default: float = 0) -> float:
+        row = conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _prepare(self, path: str) -> Tuple[List[str], List[str]]:
+        """ノートのリンク先とタグ（並行実行される）"""
+        try:
+            with open(os.path.join(self.vault_path, path), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            self.logger.debug(f"リンク読み込みをスキップ: {path}: {e}")
+            return [], []
+        header, body = split_frontmatter(text)
+        return extract_links(body), get_tags(parse_frontmatter(header))
+
+    def _store(self, conn: sqlite3.Connection, path: str, mtime_ns: int, size: int,
+               links: List[str], tags: List[str]):
+        conn.execute(
+            "INSERT OR REPLACE INTO files (path, mtime_ns, size, links, tags) VALUES (?, ?, ?, ?, ?)",
+            (path, mtime_ns, size, json.dumps(links, ensure_ascii=False), json.dumps(tags, ensure_ascii=False)),
+        )
+
+    def _bump_version(self, conn: sqlite3.Connection):
+        conn.execute(
+            "INSERT INTO meta (name, value) VALUES ('version', 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1"
+        )
+
+    def add_file(self, file_path: str):
+        """保存したノートをすぐにグラフへ登録（中心性は次に参照したときに計算し直す）"""
+        try:
+            stat = os.stat(file_path)
+            path = os.path.relpath(file_path, self.vault_path)
+            links, tags = self._prepare(path)
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    self._store(conn, path, stat.st_mtime_ns, stat.st_size, links, tags)
+                    self._bump_version(conn)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f"リンクグラフへの登録に失敗: {e}")
+
+    def refresh(self, force: bool = False):
+        """前回の走査から refresh_interval 秒以上経っていれば、変更されたノートのリンクを読み直す"""
+        if not os.path.isdir(self.vault_path):
+            self.logger.warning(f"Vaultが見つからないため前回のリンクグラフを使用: {self.vault_path}")
+            return
+
+        with self._lock:
+            conn = self._connect()
+            if not force and time.time() - self._meta(conn, 'last_refresh') < self.refresh_interval:
+                return
+
+        current = scan_markdown_files(self.vault_path)
+
+        with self._lock:
+            indexed = {path: (mtime_ns, size)
+                       for path, mtime_ns, size in conn.execute("SELECT path, mtime_ns, size FROM files")}
+            removed = [path for path in indexed if path not in current]
+            changed = [path for path, stat in current.items() if indexed.get(path) != stat]
+
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+                prepared = list(executor.map(self._prepare, changed))
+
+            with conn:
+                conn.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in removed))
+                for path, (links, tags) in zip(changed, prepared):
+                    self._store(conn, path, *current[path], links, tags)
+                if removed or changed:
+                    self._bump_version(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES ('last_refresh', ?)", (time.time(),)
+                )
+
+        if removed or changed:
+            self.logger.info(f"リンクグラフを更新: 変更・追加 {len(changed)}件, 削除 {len(removed)}件")
+
+    def build(self) -> Tuple[List[str], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """登録済みのリンク・タグから (ノートのパス, CSR形式の隣接行列) を作る"""
+        with self._lock:
+            rows = self._connect().execute("SELECT path, links, tags FROM files ORDER BY path").fetchall()
+
+        paths = [path for path, _, _ in rows]
+        # [[フォルダ/ノート]] は相対パスで、[[ノート]] はファイル名で解決する（同名はパス順で先のもの）
+        by_path, by_name = {}, {}
+        for node, path in enumerate(paths):
+            key = os.path.splitext(path)[0].replace(os.sep, '/').lower()
+            by_path[key] = node
+            by_name.setdefault(key.rsplit('/', 1)[-1], node)
+
+        sources, targets, weights = [], [], []
+        notes_by_tag: Dict[str, List[int]] = {}
+        for node, (_, links, tags) in enumerate(rows):
+            for link in json.loads(links):
+                target = by_path.get(link, by_name.get(link.rsplit('/', 1)[-1]))
+                if target is not None:
+                    sources.append(node)
+                    targets.append(target)
+                    weights.append(1.0)
+            for tag in set(json.loads(tags)):
+                notes_by_tag.setdefault(tag.lower(), []).append(node)
+
+        sources, targets, weights = [sources], [targets], [weights]
+        for nodes in notes_by_tag.values():
+            if 2 <= len(nodes) <= MAX_TAG_NOTES:
+                first, second = np.triu_indices(len(nodes), 1)
+                nodes = np.asarray(nodes, dtype=np.int64)
+                sources.append(nodes[first])
+                targets.append(nodes[second])
+                weights.append(np.full(first.size, TAG_EDGE_WEIGHT / (len(nodes) - 1)))
+
+        return paths, symmetric_csr(len(paths),
+                                    np.concatenate(sources).astype(np.int64),
+                                    np.concatenate(targets).astype(np.int64),
+                                    np.concatenate(weights).astype(np.float64))
+
+    def _compute(self) -> GraphScores:
+        started = time.time()
+        paths, graph = self.build()
+        measures = centralities(graph, self.measures, samples=self.samples)
+
+        communities = np.full(len(paths), -1, dtype=np.int64)
+        if self.community_detection == 'louvain' and paths:
+            labels = louvain(graph)
+            sizes = np.bincount(labels)
+            large = sizes >= self.min_community_size
+            renumbered = np.cumsum(large) - 1
+            communities = np.where(large[labels], renumbered[labels], -1)
+
+        edges = int(graph[1].size // 2)
+        self.logger.info(f"リンクグラフの中心性を計算: {len(paths)}ノート, {edges}辺, {time.time() - started:.2f}秒")
+        return GraphScores(paths, measures, communities, edges)
+
+    def _save(self, scores: GraphScores, version: float):
+        temp_path = f'{self.scores_path}.{os.getpid()}.tmp.npz'
+        np.savez(temp_path, version=version, paths=np.asarray(scores.paths, dtype=str),
+                 communities=scores.communities, edges=scores.edges,
+                 **{f'measure_{name}': values for name, values in scores.measures.items()})
+        os.replace(temp_path, self.scores_path)
+
+    def _load(self) -> Tuple[Optional[GraphScores], Optional[float]]:
+        """保存済みの結果とその計算時のグラフの版"""
+        try:
+            with np.load(self.scores_path) as data:
+                measures = {name[len('measure_'):]: data[name] for name in data.files if name.startswith('measure_')}
+                if set(measures) != set(self.measures):
+                    return None, None
+                scores = GraphScores(data['paths'].tolist(), measures, data['communities'], int(data['edges']))
+                return scores, float(data['version'])
+        except (OSError, KeyError, ValueError):
+            return None, None
+
+    def _recompute(self, version: float) -> GraphScores:
+        with self._compute_lock:
+            if self._scores is not None and self._scores_version == version:
+                return self._scores
+            scores = self._compute()
+            self._save(scores, version)
+            self._scores, self._scores_version = scores, version
+            return scores
+
+    def scores(self, wait: bool = True) -> Optional[GraphScores]:
+        """中心性とコミュニティ（グラフが変わっていなければキャッシュを返す）
+
+        wait=False ならVaultの走査も計算もせず、前回計算した結果をそのまま返す（無ければNone）。
+        計算し直すのは wait=True の呼び出し（常駐サーバーの定期更新・graph-stats）だけ
+        """
+        if self._scores is None:
+            self._scores, self._scores_version = self._load()
+        if not wait:
+            return self._scores
+
+        self.refresh()
+        with self._lock:
+            version = self._meta(self._connect(), 'version')
+        if self._scores is not None and self._scores_version == version:
+            return self._scores
+        return self._recompute(version)
+
+    def rerank(self, related: List, limit: int = 3) -> List:
+        """関連ノート（path・score を持つ NamedTuple）をグラフ上の中心性で重み付けして並べ替える"""
+        # プレビューを待たせないよう、前回計算した結果で並べ替える（計算し直すのは常駐サーバーの定期更新）
+        scores = self.scores(wait=False)
+        if scores is None:
+            return related[:limit]
+        eigenvector = scores.measures.get('eigenvector')
+        if eigenvector is None or not eigenvector.size or not eigenvector.max():
+            return related[:limit]
+
+        position = {path: node for node, path in enumerate(scores.paths)}
+        peak = float(eigenvector.max())
+
+        def boosted(note):
+            node = position.get(note.path)
+            centrality = float(eigenvector[node]) / peak if node is not None else 0.0
+            return note.score * (1.0 + CENTRALITY_BOOST * centrality)
+
+        return sorted(related, key=boosted, reverse=True)[:limit]
+
+    def summary(self, top: int = 10) -> Dict:
+        """ノート数・辺数・コミュニティ数と、中心性ごとの上位ノート"""
+        scores = self.scores()
+        communities = scores.communities[scores.communities >= 0]
+        summary = {
+            'notes': len(scores.paths),
+            'edges': scores.edges,
+            'communities': int(np.unique(communities).size),
+            'largest_communities': sorted(np.bincount(communities).tolist(), reverse=True)[:top]
+            if communities.size else [],
+        }
+        for name, values in scores.measures.items():
+            order = np.argsort(-values, kind='stable')[:top]
+            summary[name] = [{'path': scores.paths[node], 'score': round(float(values[node]), 4)}
+                             for node in order if values[node] > 0]
+        return summary
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ローカル分類器 - Vaultの 02_Inbox/<カテゴリ> に保存済みのノートで学習したナイーブベイズ
+確信度が閾値以上のメモはGeminiを呼ばずに分類し、曖昧なメモだけをAPIに送る
+特徴は関連ノート検索と同じ索引語（漢字・カタカナの文字2-gram、英数字の単語）をハッシュで固定次元に畳み込む
+NumPyは学習時と、学習済みモデルで分類するときにだけ読み込む（未学習ならプレビューの起動で読み込まない）
+"""
+
+import os
+import json
+import math
+import time
+import zlib
+import random
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+from app_settings import get_cache_dir
+from bm25 import ngram_terms
+from vault_scan import SCAN_WORKERS, parse_frontmatter, scan_markdown_files, split_frontmatter
+
+# 特徴のハッシュ次元（2のべき乗）
+FEATURE_BITS = 17
+
+# 学習・分類に使う先頭の文字数
+MAX_CLASSIFY_CHARS = 20000
+
+# ラプラス平滑化の係数
+SMOOTHING = 0.1
+
+# 学習時の交差検証の分割数
+CV_FOLDS = 5
+
+# 学習から除くノートのフロントマターの source（import-highlights で取り込んだハイライト）
+EXCLUDED_SOURCES = ('highlight-import',)
+
+Features = Tuple['np.ndarray', 'np.ndarray']
+
+
+class LocalPrediction(NamedTuple):
+    category: str
+    # 事後確率（0-1）
+    confidence: float
+
+
+def extract_features(text: str, bits: int = FEATURE_BITS) -> Features:
+    """索引語を (ハッシュ次元の番号, 1 + log(出現回数)) の疎ベクトルにする"""
+    import numpy as np
+    dimensions = 1 << bits
+    weights: Dict[int, float] = {}
+    for term, count in ngram_terms(text[:MAX_CLASSIFY_CHARS]).items():
+        index = zlib.crc32(term.encode('utf-8')) & (dimensions - 1)
+        weights[index] = weights.get(index, 0.0) + 1.0 + math.log(count)
+    return (np.fromiter(weights.keys(), dtype=np.int64, count=len(weights)),
+            np.fromiter(weights.values(), dtype=np.float64, count=len(weights)))
+
+
+def fit_naive_bayes(features: List[Features], labels: 'np.ndarray', n_classes: int,
+                    bits: int = FEATURE_BITS, smoothing: float = SMOOTHING) -> Tuple['np.ndarray', 'np.ndarray']:
+    """多項ナイーブベイズの (クラスの対数事前確率, クラス×特徴の対数尤度)"""
+    import numpy as np
+    sums = np.zeros((n_classes, 1 << bits))
+    for (indices, values), label in zip(features, labels.tolist()):
+        np.add.at(sums[label], indices, values)
+    sums += smoothing
+    log_likelihood = np.log(sums) - np.log(sums.sum(axis=1, keepdims=True))
+    log_prior = np.log(np.bincount(labels, minlength=n_classes) / labels.size)
+    return log_prior, log_likelihood.astype(np.float32)
+
+
+def posterior(log_prior: 'np.ndarray', log_likelihood: 'np.ndarray', features: Features) -> 'np.ndarray':
+    """クラスごとの事後確率"""
+    import numpy as np
+    indices, values = features
+    scores = log_prior + log_likelihood[:, indices] @ values
+    scores = np.exp(scores - scores.max())
+    return scores / scores.sum()
+
+
+class LocalClassifier:
+    """Vaultのカテゴリ別フォルダで学習したメモ分類器と、API迂回の記録"""
+
+    def __init__(self, model_path: str = None, db_path: str = None, confidence_threshold: float = 0.95,
+                 shadow_rate: float = 0.05, min_notes: int = 10, max_notes: int = 500,
+                 excluded_sources: Tuple[str, ...] = EXCLUDED_SOURCES):
+        self.logger = logging.getLogger(__name__)
+        self.model_path = model_path or os.path.join(get_cache_dir(), 'local_classifier.npz')
+        self.db_path = db_path or os.path.join(get_cache_dir(), 'local_classifier.sqlite3')
+        self.confidence_threshold = confidence_threshold
+        self.shadow_rate = shadow_rate
+        self.min_notes = min_notes
+        # カテゴリごとの学習件数の上限（多いカテゴリが事前確率を占めないよう抽出する。0なら無制限）
+        self.max_notes = max_notes
+        self.excluded_sources = set(excluded_sources)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._model: Optional[Dict] = None
+        self._model_mtime = None
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional['LocalClassifier']:
+        """config.yaml の local_classifier セクションから生成（無効ならNone）"""
+        settings = config.get('local_classifier', {}) or {}
+        if not settings.get('enable', False):
+            return None
+        excluded_sources = settings.get('exclude_sources', EXCLUDED_SOURCES) or ()
+        if isinstance(excluded_sources, str):
+            excluded_sources = (excluded_sources,)
+        return cls(
+            confidence_threshold=settings.get('confidence_threshold', 0.95),
+            shadow_rate=settings.get('shadow_rate', 0.05),
+            min_notes=settings.get('min_notes_per_category', 10),
+            max_notes=settings.get('max_notes_per_category', 500),
+            excluded_sources=tuple(excluded_sources),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS decisions (
+                    created REAL NOT NULL,
+                    predicted TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    bypassed INTEGER NOT NULL,
+                    gemini_category TEXT
+                )
+            """)
+        return self._conn
+
+    def _read_notes(self, vault_path: str, folders: Dict[str, str]) -> Tuple[List[str], List[str], int]:
+        """02_Inbox/<フォルダ> 配下のノート本文とカテゴリ、source で除いたノートの件数"""
+        paths, categories = [], []
+        for category, folder in folders.items():
+            folder_path = os.path.join(vault_path, '02_Inbox', folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for relative_path in sorted(scan_markdown_files(folder_path)):
+                paths.append(os.path.join(folder_path, relative_path))
+                categories.append(category)
+
+        def read(path: str) -> Tuple[Optional[str], bool]:
+            try:
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    header, body = split_frontmatter(f.read())
+            except OSError as e:
+                self.logger.warning(f"ノートを読めません: {path}: {e}")
+                return None, False
+            if header and self._excluded(parse_frontmatter(header).get('source')):
+                return None, True
+            return body, False
+
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            notes = list(executor.map(read, paths))
+        kept = [(text, category) for (text, _), category in zip(notes, categories) if text and text.strip()]
+        excluded = sum(1 for _, skipped in notes if skipped)
+        return [text for text, _ in kept], [category for _, category in kept], excluded
+
+    def _excluded(self, source) -> bool:
+        """フロントマターの source が除外対象か（「source:」だけ・「source: [a, b]」はリストになる）"""
+        if isinstance(source, str):
+            return source in self.excluded_sources
+        if isinstance(source, list):
+            return any(isinstance(item, str) and item in self.excluded_sources for item in source)
+        return False
+
+    def _sample(self, texts: List[str], categories: List[str]) -> Tuple[List[str], List[str]]:
+        """カテゴリごとに max_notes 件まで抽出（学習し直しても同じノートを選ぶよう乱数を固定）"""
+        if self.max_notes <= 0:
+            return texts, categories
+        import numpy as np
+        rng = np.random.default_rng(0)
+        by_category: Dict[str, List[int]] = {}
+        for i, category in enumerate(categories):
+            by_category.setdefault(category, []).append(i)
+        chosen = []
+        for indices in by_category.values():
+            if len(indices) > self.max_notes:
+                indices = rng.choice(indices, self.max_notes, replace=False).tolist()
+            chosen.extend(indices)
+        chosen.sort()
+        return [texts[i] for i in chosen], [categories[i] for i in chosen]
+
+    def _cross_validate(self, features: List[Features], labels: 'np.ndarray', n_classes: int) -> Dict:
+        """分割ごとに学習し直し、正解率と閾値以上の確信度での正解率・迂回できる割合を求める"""
+        import numpy as np
+        folds = np.random.default_rng(0).permutation(labels.size) % CV_FOLDS
+        correct = confident = confident_correct = 0
+        for fold in range(CV_FOLDS):
+            test = np.flatnonzero(folds == fold)
+            train = np.flatnonzero(folds != fold)
+            if not test.size or np.unique(labels[train]).size < n_classes:
+                continue
+            log_prior, log_likelihood = fit_naive_bayes([features[i] for i in train], labels[train], n_classes)
+            for i in test.tolist():
+                probabilities = posterior(log_prior, log_likelihood, features[i])
+                hit = int(np.argmax(probabilities)) == labels[i]
+                correct += hit
+                if probabilities.max() >= self.confidence_threshold:
+                    confident += 1
+                    confident_correct += hit
+        return {
+            'folds': CV_FOLDS,
+            'accuracy': round(correct / labels.size, 4),
+            'bypass_rate': round(confident / labels.size, 4),
+            'bypass_accuracy': round(confident_correct / confident, 4) if confident else None,
+        }
+
+    def train(self, vault_path: str, folders: Dict[str, str]) -> Dict:
+        """Vaultのカテゴリ別フォルダのノートで学習して保存し、件数と交差検証の結果を返す
+
+        folders はカテゴリ → 02_Inbox 配下のフォルダ名。ノートが min_notes 件未満のカテゴリは学習せず、
+        max_notes 件を超えるカテゴリは抽出する。取り込んだハイライトなど excluded_sources のノートは除く
+        """
+        import numpy as np
+        started = time.time()
+        texts, categories, excluded = self._read_notes(vault_path, folders)
+        counts = {category: categories.count(category) for category in folders}
+        texts, categories = self._sample(texts, categories)
+        classes = [category for category in folders if counts[category] >= self.min_notes]
+        report = {'notes': counts, 'categories': classes, 'excluded': excluded}
+        if self.max_notes > 0:
+            report['max_notes_per_category'] = self.max_notes
+        if len(classes) < 2:
+            self.logger.warning(f"学習できるカテゴリが2つ未満です（各 {self.min_notes} 件以上必要）")
+            return report
+
+        kept = [(text, classes.index(category)) for text, category in zip(texts, categories) if category in classes]
+        features = [extract_features(text) for text, _ in kept]
+        labels = np.array([label for _, label in kept], dtype=np.int64)
+        report['cross_validation'] = self._cross_validate(features, labels, len(classes))
+
+        log_prior, log_likelihood = fit_naive_bayes(features, labels, len(classes))
+        meta = {'trained_at': time.time(), 'threshold': self.confidence_threshold, **report}
+        # 読み込み中のプロセスが壊れたファイルを見ないよう一時ファイルから置き換える
+        temporary = f"{self.model_path}.{os.getpid()}.tmp.npz"
+        np.savez(temporary, categories=np.array(classes), log_prior=log_prior,
+                 log_likelihood=log_likelihood, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(temporary, self.model_path)
+
+        with self._lock:
+            self._model = None
+        self.logger.info(f"ローカル分類器を学習: {labels.size}件, {len(classes)}カテゴリ, "
+                         f"{time.time() - started:.2f}秒")
+        return report
+
+    def _load(self) -> Optional[Dict]:
+        """保存済みのモデル（retrain でファイルが更新されていれば読み直す）"""
+        try:
+            mtime = os.stat(self.model_path).st_mtime_ns
+        except OSError:
+            return None
+        if self._model is None or mtime != self._model_mtime:
+            import numpy as np
+            with np.load(self.model_path) as data:
+                self._model = {
+                    'categories': data['categories'].tolist(),
+                    'log_prior': data['log_prior'],
+                    'log_likelihood': data['log_likelihood'],
+                    'meta': json.loads(str(data['meta'])),
+                }
+            self._model_mtime = mtime
+        return self._model
+
+    def predict(self, content: str) -> Optional[LocalPrediction]:
+        """最も確からしいカテゴリと事後確率（未学習ならNone）"""
+        with self._lock:
+            model = self._load()
+        if model is None:
+            return None
+        probabilities = posterior(model['log_prior'], model['log_likelihood'], extract_features(content))
+        best = int(probabilities.argmax())
+        return LocalPrediction(model['categories'][best], float(probabilities[best]))
+
+    def should_bypass(self, prediction: Optional[LocalPrediction]) -> bool:
+        """APIを呼ばずにローカルの分類を使うか
+
+        確信度が閾値以上でも shadow_rate の割合はAPIに送り、Geminiとの一致率を測る
+        """
+        if prediction is None or prediction.confidence < self.confidence_threshold:
+            return False
+        return random.random() >= self.shadow_rate
+
+    def record(self, prediction: LocalPrediction, bypassed: bool, gemini_category: Optional[str] = None):
+        """1件の判定を記録（APIに送った場合はGeminiのカテゴリも）"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO decisions (created, predicted, confidence, bypassed, gemini_category) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (time.time(), prediction.category, prediction.confidence, int(bypassed), gemini_category),
+                    )
+        except sqlite3.Error as e:
+            self.logger.warning(f"ローカル分類の記録に失敗: {e}")
+
+    def report(self) -> Dict:
+        """API迂回率と、APIに送ったメモでのGeminiとの一致率"""
+        with self._lock:
+            model = self._load()
+            total, bypassed = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(bypassed), 0) FROM decisions"
+            ).fetchone()
+            compared, agreed, confident, confident_agreed = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(predicted = gemini_category), 0), "
+                "COALESCE(SUM(confidence >= ?), 0), "
+                "COALESCE(SUM(confidence >= ? AND predicted = gemini_category), 0) "
+                "FROM decisions WHERE bypassed = 0 AND gemini_category IS NOT NULL",
+                (self.confidence_threshold, self.confidence_threshold),
+            ).fetchone()
+
+        return {
+            'model': model['meta'] if model else None,
+            'confidence_threshold': self.confidence_threshold,
+            'memos': total,
+            'bypassed': bypassed,
+            'bypass_rate': round(bypassed / total, 4) if total else 0.0,
+            'compared': compared,
+            'agreement': round(agreed / compared, 4) if compared else None,
+            # 閾値以上でもAPIに送った（shadow_rate）メモでの一致率＝迂回したメモの正解率の見積もり
+            'confident_compared': confident,
+            'confident_agreement': round(confident_agreed / confident, 4) if confident else None,
+        }
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+長いメモの分析 - 見出し・段落で分割した部分を並行して分析し、1つの結果にまとめる（map-reduce）
+処理時間がメモ全体の長さではなく、部分の並列度で決まるようにする
+"""
+
+import re
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from content_formatter import ContentFormatter
+from prompts import MERGE_PROMPT_VERSION, estimate_tokens
+from response_cache import ResponseCache
+
+
+def merge_locally(parts: List[Dict], categories: List[str]) -> Dict:
+    """部分ごとの結果を分量（トークン数）で重み付けしてまとめる（統合用のAPI呼び出しが失敗した場合）"""
+    category_weights = Counter()
+    tag_weights = Counter()
+    keyword_weights = Counter()
+
+    for part in parts:
+        weight = part.get('tokens', 1)
+        if part.get('category') in categories:
+            category_weights[part['category']] += weight
+        for tag in part.get('tags') or []:
+            tag_weights[tag] += weight
+        for keyword in part.get('related_files_keywords') or []:
+            keyword_weights[keyword] += weight
+
+    category = category_weights.most_common(1)[0][0] if category_weights else 'others'
+    main_part = max((part for part in parts if part.get('category') == category),
+                    key=lambda part: part.get('tokens', 0), default=parts[0])
+
+    return {
+        'title': main_part.get('title', ''),
+        'category': category,
+        'tags': [tag for tag, _ in tag_weights.most_common(5)],
+        'related_files_keywords': [keyword for keyword, _ in keyword_weights.most_common(8)],
+    }
+
+
+class LongMemoAnalyzer:
+    """トークン予算を超えるメモを分割して並行分析し、結果を統合"""
+
+    def __init__(self, gemini, formatter: Optional[ContentFormatter] = None, token_budget: int = 8000,
+                 chunk_tokens: int = 3000, max_chunks: int = 16, max_workers: int = 4,
+                 deadline_seconds: float = 60):
+        self.logger = logging.getLogger(__name__)
+        self.gemini = gemini
+        self.formatter = formatter or ContentFormatter()
+        self.token_budget = token_budget
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.max_chunks = max(1, max_chunks)
+        self.max_workers = max(1, max_workers)
+        self.deadline_seconds = deadline_seconds
+
+    @classmethod
+    def from_config(cls, gemini, config: Dict) -> 'LongMemoAnalyzer':
+        """config.yaml の long_memo セクションから生成"""
+        settings = config.get('long_memo', {}) or {}
+        return cls(
+            gemini,
+            token_budget=settings.get('token_budget', 8000),
+            chunk_tokens=settings.get('chunk_tokens', 3000),
+            max_chunks=settings.get('max_chunks', 16),
+            max_workers=settings.get('max_workers', 4),
+            deadline_seconds=settings.get('deadline_seconds', 60),
+        )
+
+    def is_long(self, content: str) -> bool:
+        """分割して分析すべき長さか"""
+        # 1文字1トークン以上にはならないので、短いメモは数えずに判定
+        return len(content) > self.token_budget and estimate_tokens(content) > self.token_budget
+
+    def split(self, content: str) -> List[str]:
+        """見出しの位置で分け、予算を超える節は段落・行・文字数の順に細かく分けてから詰め直す"""
+        pieces = (piece for section in self.formatter.split_sections(content)
+                  for piece in self._split_oversized(section, ('\n\n', '\n')))
+        return list(self._pack(pieces, '\n\n'))
+
+    def _split_oversized(self, text: str, separators) -> Iterator[str]:
+        if estimate_tokens(text) <= self.chunk_tokens:
+            yield text
+            return
+
+        if not separators:
+            # 区切りが無い長い行は文字数で切る（日本語は1文字≒1トークン）
+            for start in range(0, len(text), self.chunk_tokens):
+                yield text[start:start + self.chunk_tokens]
+            return
+
+        separator, rest = separators[0], separators[1:]
+        parts = re.split(r'\n\s*\n', text) if separator == '\n\n' else text.split(separator)
+        pieces = (piece for part in parts if part.strip() for piece in self._split_oversized(part, rest))
+        yield from self._pack(pieces, separator)
+
+    def _pack(self, pieces: Iterable[str], separator: str) -> Iterator[str]:
+        """隣り合う断片を予算内で1つにまとめる"""
+        chunk, chunk_tokens = [], 0
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if chunk and chunk_tokens + tokens > self.chunk_tokens:
+                yield separator.join(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(piece)
+            chunk_tokens += tokens
+        if chunk:
+            yield separator.join(chunk)
+
+    def _select_chunks(self, chunks: List[str]) -> List[str]:
+        """部分が多すぎる場合は先頭・末尾を含めて等間隔に選ぶ"""
+        if len(chunks) <= self.max_chunks:
+            return chunks
+        if self.max_chunks == 1:
+            return chunks[:1]
+
+        step = (len(chunks) - 1) / (self.max_chunks - 1)
+        self.logger.info(f"長いメモの {len(chunks)} 部分から {self.max_chunks} 部分を選んで分析")
+        return [chunks[round(i * step)] for i in range(self.max_chunks)]
+
+    def analyze(self, content: str, categories: List[str], deadline: Optional[float] = None) -> Dict:
+        """分割・並行分析・統合を行い、analyze_memo と同じ形式の結果を返す"""
+        cache = self.gemini.cache
+        cache_key = None
+        if cache:
+            cache_key = ResponseCache.make_key(
+                content, categories, self.gemini.cache_model_name(),
+                f"{MERGE_PROMPT_VERSION}-{self.gemini.prompt.version}-{self.chunk_tokens}")
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self.logger.info("長いメモの分析結果を応答キャッシュから取得")
+                return cached
+
+        chunks = self._select_chunks(self.split(content))
+        self.logger.info(f"長いメモを {len(chunks)} 部分に分けて分析")
+
+        parts = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+            futures = [executor.submit(self.gemini.analyze_memo, chunk, categories, deadline)
+                       for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.logger.warning(f"長いメモの部分分析に失敗: {e}")
+                    errors.append(e)
+                    continue
+                if result.get('title') or result.get('category'):
+                    parts.append(dict(result, tokens=estimate_tokens(chunk)))
+
+        if not parts:
+            if errors:
+                raise errors[0]
+            raise Exception("長いメモのどの部分も分析できませんでした")
+
+        local = merge_locally(parts, categories)
+        try:
+            merged = self.gemini.merge_analyses(parts, categories, deadline=deadline)
+        except Exception as e:
+            self.logger.warning(f"部分の分析結果の統合に失敗したため分量で重み付けして統合: {e}")
+            merged = {}
+        if not isinstance(merged, dict):
+            merged = {}
+
+        if merged.get('category') not in categories:
+            merged['category'] = local['category']
+        for key in ('title', 'tags', 'related_files_keywords'):
+            if not merged.get(key):
+                merged[key] = local[key]
+
+        # 一部の分析に失敗した結果は次回やり直せるよう保存しない
+        if cache_key and not errors:
+            cache.put(cache_key, merged)
+        return merged
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ノート索引 - Vaultのノートの転置索引（索引語ごとの出現ノートと文書頻度）をSQLiteに保持し、
+BM25で関連ノートを検索する
+索引語は漢字・カタカナの文字2-gram、英数字の単語、TagAnalyzer のタグ候補とノートのタグ
+"""
+
+import os
+import time
+import heapq
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import date, datetime
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app_settings import get_cache_dir
+from bm25 import idf, ngram_terms, phrase_terms, term_score
+from tag_analyzer import TagAnalyzer
+from vault_scan import SCAN_WORKERS, get_tags, parse_frontmatter, scan_markdown_files, split_frontmatter
+
+# 索引の形式を変えたら更新すること（古い索引は作り直す）
+INDEX_VERSION = 3
+
+# タイトル・タグの語は本文より重く数える
+TITLE_BOOST = 3
+TAG_BOOST = 3
+
+# 1回の検索に使う索引語の最大数と、使わない語の文書頻度の割合（ほぼ全ノートに出る語）
+MAX_QUERY_TERMS = 64
+MAX_DF_RATIO = 0.25
+
+# 文書頻度で語を除くのはこの件数以上のノートがあるときだけ（少ないVaultでは共通の語もすべて使う）
+MIN_DF_CUTOFF_DOCS = 20
+
+# 並行して読み込んでから登録するノート数（初回構築時のメモリ使用量を抑える）
+READ_BATCH_SIZE = 256
+
+# ノートの日付（1970-01-01からの日数）を求めるための1日のナノ秒数
+_DAY_NS = 86400 * 10 ** 9
+_EPOCH = date(1970, 1, 1)
+
+# 全文検索と意味検索の順位を統合するときの定数（Reciprocal Rank Fusion）
+RRF_K = 60
+
+# SQLiteの1文あたりのパラメータ数の上限に収めるための分割数
+_SQL_CHUNK = 500
+
+
+class RelatedNote(NamedTuple):
+    title: str
+    path: str
+    category: str
+    score: float
+    # メモ自身を文書とみなした場合のスコアに対する比（0-1）
+    relevance: float
+
+
+def parse_note(text: str, default_title: str) -> Dict:
+    """ノートからタイトル・カテゴリ・タグ・本文を取り出す"""
+    header, body = split_frontmatter(text)
+    meta = parse_frontmatter(header)
+    title = meta.get('title')
+    category = meta.get('category')
+    return {
+        'title': title if isinstance(title, str) and title else default_title,
+        'category': category if isinstance(category, str) else '',
+        'tags': get_tags(meta),
+        'body': body,
+        'day': _created_day(meta.get('created')),
+    }
+
+
+def _created_day(created) -> Optional[int]:
+    """フロントマターの created（YYYY-MM-DD ...）を日数に変換（無い・読めない場合はNone）"""
+    if not isinstance(created, str):
+        return None
+    try:
+        return (datetime.strptime(created.strip()[:10], '%Y-%m-%d').date() - _EPOCH).days
+    except ValueError:
+        return None
+
+
+def today() -> int:
+    """今日の日付（1970-01-01からの日数）"""
+    return (date.today() - _EPOCH).days
+
+
+def relevance_stars(relevance: float) -> str:
+    """正規化した関連度を1-3星に換算"""
+    if relevance >= 0.5:
+        return "★★★"
+    if relevance >= 0.25:
+        return "★★"
+    return "★"
+
+
+def fuse_related(lexical: List[RelatedNote], semantic: Iterable, limit: int = 3) -> List[RelatedNote]:
+    """BM25の結果と意味検索の結果（key・label・score を持つ）を順位の逆数の和で統合
+
+    関連度は両者の高い方（意味検索はメモ自身とのコサイン類似度1を満点とみなす）
+    """
+    fused: Dict[str, RelatedNote] = {}
+    for rank, note in enumerate(lexical):
+        fused[note.path] = note._replace(score=1.0 / (RRF_K + rank + 1))
+    for rank, hit in enumerate(semantic):
+        score = 1.0 / (RRF_K + rank + 1)
+        relevance = min(1.0, max(0.0, hit.score))
+        note = fused.get(hit.key)
+        if note:
+            fused[hit.key] = note._replace(score=note.score + score, relevance=max(note.relevance, relevance))
+        else:
+            fused[hit.key] = RelatedNote(hit.label, hit.key, '', score, relevance)
+    return heapq.nlargest(limit, fused.values(), key=lambda note: note.score)
+
+
+def _chunks(items: List, size: int = _SQL_CHUNK):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class NoteIndex:
+    """Vaultのノートの転置索引（変更されたファイルだけを登録し直す）"""
+
+    def __init__(self, vault_path: str, db_path: str = None, refresh_interval: float = 600,
+                 tag_analyzer: Optional[TagAnalyzer] = None, time_window_days: int = 30,
+                 decay_factor: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.tag_analyzer = tag_analyzer or TagAnalyzer(vault_path)
+        self.vault_path = vault_path
+        if not db_path:
+            vault_hash = hashlib.sha256(os.path.abspath(vault_path).encode('utf-8')).hexdigest()[:12]
+            db_path = os.path.join(get_cache_dir(), f'note_index-{vault_hash}.sqlite3')
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        # time_window_days 日ごとにスコアへ decay_factor を掛ける（1.0 なら日付を考慮しない）
+        self.time_window_days = time_window_days
+        self.decay_factor = decay_factor
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def from_config(cls, vault_path: str, config: Dict) -> 'NoteIndex':
+        """config.yaml の note_index・temporal_analysis セクションから生成"""
+        settings = config.get('note_index', {}) or {}
+        temporal = (config.get('advanced_relation_analysis', {}) or {}).get('temporal_analysis', {}) or {}
+        return cls(vault_path, refresh_interval=settings.get('refresh_interval_seconds', 600),
+                   time_window_days=temporal.get('time_window_days', 30),
+                   decay_factor=temporal.get('decay_factor', 0.9) if temporal.get('enable', False) else 1.0)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+                self._conn.executescript("""
+                    DROP TABLE IF EXISTS notes;
+                    DROP TABLE IF EXISTS notes_fts;
+                    DROP TABLE IF EXISTS terms;
+                    DROP TABLE IF EXISTS postings;
+                    DROP TABLE IF EXISTS meta;
+                """)
+                self._conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS notes (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    day INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    term_ids BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS notes_day ON notes (day);
+                CREATE TABLE IF NOT EXISTS terms (
+                    id INTEGER PRIMARY KEY,
+                    term TEXT UNIQUE NOT NULL,
+                    df INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term_id INTEGER NOT NULL,
+                    note_id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term_id, note_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                );
+            """)
+        return self._conn
+
+    def document_terms(self, note: Dict) -> Counter:
+        """ノートの索引語と重み付き出現回数"""
+        terms = ngram_terms(note['body'])
+        for term, count in ngram_terms(note['title']).items():
+            terms[term] += TITLE_BOOST * count
+        phrases = phrase_terms(self.tag_analyzer.extract_candidates(note['title'] + '\n' + note['body']))
+        for term, count in phrase_terms(note['tags']).items():
+            phrases[term] += TAG_BOOST * count
+        terms.update(phrases)
+        return terms
+
+    def query_terms(self, content: str, keywords: Iterable[str] = ()) -> Counter:
+        """メモ内容と分析結果のキーワードから検索用の索引語を作る"""
+        terms = ngram_terms(content)
+        terms.update(phrase_terms(self.tag_analyzer.extract_candidates(content)))
+        terms.update(phrase_terms(keywords))
+        return terms
+
+    def _prepare(self, path: str) -> Tuple[Dict, Counter]:
+        """ノートを読み込んで索引語を数える（並行実行される）"""
+        try:
+            with open(os.path.join(self.vault_path, path), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            self.logger.debug(f"索引登録をスキップ: {path}: {e}")
+            text = ''
+
+        note = parse_note(text, os.path.splitext(os.path.basename(path))[0])
+        return note, self.document_terms(note)
+
+    def _remove(self, conn: sqlite3.Connection, path: str):
+        row = conn.execute("SELECT id, term_ids FROM notes WHERE path = ?", (path,)).fetchone()
+        if not row:
+            return
+        note_id, term_ids = row[0], array('q', row[1])
+        conn.executemany("UPDATE terms SET df = df - 1 WHERE id = ?", ((term_id,) for term_id in term_ids))
+        conn.executemany("DELETE FROM postings WHERE term_id = ? AND note_id = ?",
+                         ((term_id, note_id) for term_id in term_ids))
+        conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+
+    def _add(self, conn: sqlite3.Connection, path: str, mtime_ns: int, size: int,
+             note: Dict, terms: Counter):
+        self._remove(conn, path)
+
+        words = list(terms)
+        conn.executemany(
+            "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+            ((word,) for word in words),
+        )
+        term_ids = {}
+        for chunk in _chunks(words):
+            term_ids.update(conn.execute(
+                f"SELECT term, id FROM terms WHERE term IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+
+        ids = array('q', (term_ids[word] for word in words))
+        cursor = conn.execute(
+            "INSERT INTO notes (path, mtime_ns, size, title, category, day, length, term_ids) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, mtime_ns, size, note['title'], note['category'],
+             note['day'] if note['day'] is not None else mtime_ns // _DAY_NS,
+             sum(terms.values()), ids.tobytes()),
+        )
+        conn.executemany(
+            "INSERT INTO postings (term_id, note_id, tf) VALUES (?, ?, ?)",
+            ((term_ids[word], cursor.lastrowid, count) for word, count in terms.items()),
+        )
+
+    def add_file(self, file_path: str):
+        """保存したノートをすぐに索引へ登録（Vault全体の走査を待たない）"""
+        try:
+            stat = os.stat(file_path)
+            path = os.path.relpath(file_path, self.vault_path)
+            note, terms = self._prepare(path)
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    self._add(conn, path, stat.st_mtime_ns, stat.st_size, note, terms)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f"ノート索引への登録に失敗: {e}")
+
+    def refresh(self, force: bool = False):
+        """前回の走査から refresh_interval 秒以上経っていれば、変更されたファイルを登録し直す"""
+        if not os.path.isdir(self.vault_path):
+            self.logger.warning(f"Vaultが見つからないため前回のノート索引を使用: {self.vault_path}")
+            return
+
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM meta WHERE name = 'last_refresh'").fetchone()
+            if not force and row and time.time() - row[0] < self.refresh_interval:
+                return
+
+        current = scan_markdown_files(self.vault_path)
+
+        with self._lock:
+            indexed = {path: (mtime_ns, size)
+                       for path, mtime_ns, size in conn.execute("SELECT path, mtime_ns, size FROM notes")}
+            removed = [path for path in indexed if path not in current]
+            changed = [path for path, stat in current.items() if indexed.get(path) != stat]
+            with conn:
+                for path in removed:
+                    self._remove(conn, path)
+
+        # 本文も索引するため変更されたノートは全体を読む（一定件数ずつ並行して読み込む）
+        # 検索を長く止めないよう、読み込みはロックの外で行い、一定件数ごとに登録を確定させる
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            for batch in _chunks(changed, READ_BATCH_SIZE):
+                prepared = list(executor.map(self._prepare, batch))
+                with self._lock, conn:
+                    for path, (note, terms) in zip(batch, prepared):
+                        self._add(conn, path, *current[path], note, terms)
+
+        with self._lock, conn:
+            conn.execute("DELETE FROM terms WHERE df <= 0")
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('last_refresh', ?)", (time.time(),)
+            )
+
+        if removed or changed:
+            self.logger.info(f"ノート索引を更新: 変更・追加 {len(changed)}件, 削除 {len(removed)}件")
+
+    def search(self, query: Counter, limit: int = 3, within_window: bool = False) -> List[RelatedNote]:
+        """索引語を含むノートをBM25スコア（日付による減衰込み）の上位から返す
+
+        within_window なら直近 time_window_days 日のノートだけを日付の索引から絞り込んで調べる
+        """
+        if not query:
+            return []
+
+        current_day = today()
+        with self._lock:
+            conn = self._connect()
+            n_docs, total_length = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM notes").fetchone()
+            if not n_docs:
+                return []
+
+            words = list(query)
+            known = []
+            for chunk in _chunks(words):
+                known.extend(conn.execute(
+                    f"SELECT id, term, df FROM terms WHERE df > 0 AND term IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall())
+
+            # ほぼ全ノートに出る語は除き、珍しい語から使う（ノートが少ないうちは除かない）
+            max_df = int(n_docs * MAX_DF_RATIO) if n_docs >= MIN_DF_CUTOFF_DOCS else n_docs
+            selected = heapq.nlargest(
+                MAX_QUERY_TERMS,
+                ((term_id, word, idf(df, n_docs)) for term_id, word, df in known if df <= max_df),
+                key=lambda item: item[2],
+            )
+            if not selected:
+                return []
+
+            idf_by_id = {term_id: term_idf for term_id, _, term_idf in selected}
+            term_ids = list(idf_by_id)
+            avg_length = total_length / n_docs
+            scores: Dict[int, float] = defaultdict(float)
+            days: Dict[int, int] = {}
+
+            if within_window:
+                # 期間内のノートを日付の索引で取り出し、その組み合わせだけ転置索引を引く
+                lengths = {}
+                for note_id, day, length in conn.execute(
+                        "SELECT id, day, length FROM notes WHERE day >= ?", (current_day - self.time_window_days,)):
+                    days[note_id] = day
+                    lengths[note_id] = length
+                for chunk in _chunks(list(days), _SQL_CHUNK - len(term_ids)):
+                    rows = conn.execute(
+                        "SELECT term_id, note_id, tf FROM postings "
+                        f"WHERE term_id IN ({','.join('?' * len(term_ids))}) "
+                        f"AND note_id IN ({','.join('?' * len(chunk))})", term_ids + chunk
+                    )
+                    for term_id, note_id, tf in rows:
+                        scores[note_id] += term_score(tf, lengths[note_id], avg_length, idf_by_id[term_id])
+            else:
+                for chunk in _chunks(term_ids):
+                    rows = conn.execute(
+                        "SELECT p.term_id, p.note_id, p.tf, n.length, n.day FROM postings p "
+                        "JOIN notes n ON n.id = p.note_id "
+                        f"WHERE p.term_id IN ({','.join('?' * len(chunk))})", chunk
+                    )
+                    for term_id, note_id, tf, length, day in rows:
+                        scores[note_id] += term_score(tf, length, avg_length, idf_by_id[term_id])
+                        days[note_id] = day
+
+            if self.decay_factor < 1.0:
+                for note_id in scores:
+                    age = max(0, current_day - days[note_id])
+                    scores[note_id] *= self.decay_factor ** (age / self.time_window_days)
+
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            notes = {
+                row[0]: row[1:] for row in conn.execute(
+                    f"SELECT id, title, path, category FROM notes WHERE id IN ({','.join('?' * len(top))})",
+                    [note_id for note_id, _ in top],
+                )
+            } if top else {}
+
+        # メモ自身を文書とみなした場合のスコアを満点として正規化
+        query_length = sum(query.values())
+        best = sum(term_score(query[word], query_length, avg_length, term_idf)
+                   for _, word, term_idf in selected)
+
+        return [
+            RelatedNote(*notes[note_id], score=score, relevance=min(1.0, score / best) if best else 0.0)
+            for note_id, score in top if note_id in notes
+        ]
+
+    def find_related(self, content: str, keywords: Iterable[str] = (), limit: int = 3,
+                     within_window: bool = False) -> List[RelatedNote]:
+        """メモ内容と分析結果のキーワードから関連ノートを検索
+
+        索引の作成・更新（refresh）は行わず、登録済みのノートだけを調べる（未作成なら空）
+        """
+        return self.search(self.query_terms(content, keywords), limit=limit, within_window=within_window)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ノート書き出し - 分析結果をVaultの 02_Inbox/<フォルダ> にノートとして保存
+一時ファイルに書き終えてから名前を付けるため、中断しても書きかけのノートがVaultに現れない。
+ファイル名は既存・書き出し中のノートと重ならないよう連番を付け、一括処理では専用のスレッドがまとめて書き出す
+"""
+
+import os
+import time
+import queue
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from content_formatter import ContentFormatter
+
+# 安全な文字が残らないタイトルのファイル名
+DEFAULT_TITLE = 'メモ'
+
+# ファイル名のタイトル部分の上限（UTF-8のバイト数。ファイル名の上限255バイトに日時と連番を足しても収まる）
+MAX_NAME_BYTES = 200
+
+# 書き出し中の一時ファイル（Obsidianは . で始まるファイルを表示しない）
+TEMP_PREFIX = '.writing-'
+TEMP_SUFFIX = '.tmp'
+
+# これより古い一時ファイルは中断で残ったものとみなして削除する
+STALE_TEMP_SECONDS = 3600
+
+# mkstemp は所有者だけが読める権限で作るため、通常の open と同じ権限に直す
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+NOTE_MODE = 0o666 & ~_UMASK
+
+
+def safe_filename(title: str) -> str:
+    """タイトルからファイル名に使える文字だけを残す（何も残らなければ DEFAULT_TITLE）"""
+    name = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
+    name = name.encode('utf-8')[:MAX_NAME_BYTES].decode('utf-8', 'ignore').strip()
+    return name or DEFAULT_TITLE
+
+
+def render_header(title: str, category: str, tags: List[str], when: datetime,
+                  source: Optional[str] = None) -> str:
+    """YAMLフロントマターと見出し（source は取り込み元などノートの出どころ）"""
+    # タグをYAML形式に変換
+    tags_yaml = "\n".join([f"  - {tag}" for tag in tags])
+    source_yaml = f"source: {source}\n" if source else ""
+
+    return f"""---
+title: {title}
+category: {category}
+tags:
+{tags_yaml}
+{source_yaml}created: {when.strftime("%Y-%m-%d %H:%M:%S")}
+---
+
+# {title}
+
+"""
+
+
+class VaultWriter:
+    """ノートを一時ファイル経由で重複しない名前に保存する
+
+    write はその場で保存し、submit は書き出し用のスレッドに渡して Future を返す。
+    スレッドは溜まったノートを batch_size 件ずつ書き、フォルダの同期（fsync）をまとめて1回で済ませる
+    """
+
+    def __init__(self, vault_path: str, folders: Dict[str, str], default_folder: str = 'Others',
+                 formatter: Optional[ContentFormatter] = None, fsync: bool = True,
+                 batch_size: int = 32, queue_size: int = 256,
+                 on_written: Optional[Callable[[List[str]], None]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.vault_path = vault_path
+        self.folders = folders
+        self.default_folder = default_folder
+        self.formatter = formatter or ContentFormatter()
+        self.fsync = fsync
+        self.batch_size = max(1, batch_size)
+        self.queue_size = max(1, queue_size)
+        # 保存したノートのパスを受け取る（索引への登録など）
+        self.on_written = on_written
+        self._lock = threading.Lock()
+        # 名前を決めてからノートを置くまでの間、他の書き出しに同じ名前を使わせない
+        self._reserved: Set[str] = set()
+        # 名前（タイトル_日時）ごとに最後に付けた連番（同じ秒に多数保存しても先頭から調べ直さない）
+        self._numbers: Dict[str, int] = {}
+        self._prepared: Set[str] = set()
+        self._queue: Optional[queue.Queue] = None
+        self._worker: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, vault_path: str, folders: Dict[str, str], config: Dict,
+                    formatter: Optional[ContentFormatter] = None,
+                    on_written: Optional[Callable[[List[str]], None]] = None) -> 'VaultWriter':
+        """config.yaml の note_writer セクションから生成"""
+        settings = config.get('note_writer', {}) or {}
+        return cls(
+            vault_path, folders,
+            formatter=formatter,
+            fsync=settings.get('fsync', True),
+            batch_size=settings.get('batch_size', 32),
+            queue_size=settings.get('queue_size', 256),
+            on_written=on_written,
+        )
+
+    def _folder_path(self, category: str) -> str:
+        """カテゴリのフォルダ（初回は作成し、中断で残った一時ファイルを片付ける）"""
+        folder_path = os.path.join(self.vault_path, "02_Inbox", self.folders.get(category, self.default_folder))
+        if folder_path in self._prepared:
+            return folder_path
+        os.makedirs(folder_path, exist_ok=True)
+        now = time.time()
+        for name in os.listdir(folder_path):
+            if not (name.startswith(TEMP_PREFIX) and name.endswith(TEMP_SUFFIX)):
+                continue
+            path = os.path.join(folder_path, name)
+            try:
+                # 他のプロセスが書き出し中の一時ファイルは残す
+                if now - os.stat(path).st_mtime > STALE_TEMP_SECONDS:
+                    os.unlink(path)
+                    self.logger.info(f"書きかけの一時ファイルを削除: {path}")
+            except OSError:
+                pass
+        self._prepared.add(folder_path)
+        return folder_path
+
+    def _reserve(self, folder_path: str, title: str, when: datetime) -> str:
+        """既存のノート・書き出し中のノートと重ならないパスを予約する"""
+        base = f"{safe_filename(title)}_{when.strftime('%Y%m%d_%H%M%S')}"
+        key = os.path.join(folder_path, base)
+        with self._lock:
+            number = self._numbers.get(key, 1)
+            while True:
+                name = f"{base}.md" if number == 1 else f"{base}_{number}.md"
+                path = os.path.join(folder_path, name)
+                if path not in self._reserved and not os.path.lexists(path):
+                    self._reserved.add(path)
+                    if len(self._numbers) >= 1024:
+                        self._numbers.clear()
+                    self._numbers[key] = number + 1
+                    return path
+                number += 1
+
+    def _release(self, path: str):
+        with self._lock:
+            self._reserved.discard(path)
+
+    def _write_temp(self, content: str, analysis_result: Dict, when: datetime,
+                    formatter: Optional[ContentFormatter] = None) -> Tuple[str, str, str]:
+        """ノートを一時ファイルに書き出し、(一時ファイル, フォルダ, タイトル) を返す"""
+        result = analysis_result.get('result', {})
+        title = result.get('title') or DEFAULT_TITLE
+        category = result.get('category', 'others')
+        tags = result.get('tags', ['メモ'])
+
+        with self._lock:
+            folder_path = self._folder_path(category)
+        # 同じフォルダに置くことで、名前の変更が同じファイルシステム内で一度に行われる
+        fd, temp_path = tempfile.mkstemp(dir=folder_path, prefix=TEMP_PREFIX, suffix=TEMP_SUFFIX)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                os.chmod(temp_path, NOTE_MODE)
+                f.write(render_header(title, category, tags, when, result.get('source')))
+                # 整形した本文は1行ずつ書き出す
+                (formatter or self.formatter).write(content, f)
+                f.write("\n")
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path, folder_path, title
+
+    def _place(self, temp_path: str, folder_path: str, title: str, when: datetime) -> str:
+        """一時ファイルに重複しない名前を付ける
+
+        他のプロセスが同じ名前のノートを置いた場合に上書きしないよう、ハードリンクで名前を付けて
+        一時ファイル名を消す（ハードリンクを作れないファイルシステムでは置き換え）
+        """
+        try:
+            while True:
+                path = self._reserve(folder_path, title, when)
+                try:
+                    try:
+                        os.link(temp_path, path)
+                    except FileExistsError:
+                        continue
+                    except OSError:
+                        os.replace(temp_path, path)
+                        return path
+                    os.unlink(temp_path)
+                    return path
+                finally:
+                    self._release(path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def _sync_folders(self, folder_paths: Set[str]):
+        """名前の変更をディスクに反映（フォルダごとに1回）"""
+        if not self.fsync:
+            return
+        for folder_path in folder_paths:
+            try:
+                fd = os.open(folder_path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass  # フォルダの fsync に対応しないファイルシステム
+            finally:
+                os.close(fd)
+
+    def _notify(self, paths: List[str]):
+        if self.on_written and paths:
+            try:
+                self.on_written(paths)
+            except Exception as e:
+                self.logger.warning(f"保存後の処理に失敗: {e}")
+
+    def write(self, content: str, analysis_result: Dict, formatter: Optional[ContentFormatter] = None) -> str:
+        """ノートをその場で保存してパスを返す"""
+        when = datetime.now()
+        temp_path, folder_path, title = self._write_temp(content, analysis_result, when, formatter)
+        path = self._place(temp_path, folder_path, title, when)
+        self._sync_folders({folder_path})
+        self.logger.info(f"ファイル作成成功: {path}")
+        self._notify([path])
+        return path
+
+    def submit(self, content: str, analysis_result: Dict) -> Future:
+        """ノートを書き出し用のスレッドに渡す（保存したパスを返す Future。キューが満杯なら空くまで待つ）"""
+        future: Future = Future()
+        with self._lock:
+            if self._worker is None:
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._worker = threading.Thread(target=self._run, name='note-writer', daemon=True)
+                self._worker.start()
+        self._queue.put((content, analysis_result, datetime.now(), future))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[Tuple[str, Dict, datetime, Future]]):
+        """まとめて書き出し、フォルダの同期と保存後の処理を1回で済ませる"""
+        written = []
+        folder_paths = set()
+        for content, analysis_result, when, future in batch:
+            try:
+                temp_path, folder_path, title = self._write_temp(content, analysis_result, when)
+                path = self._place(temp_path, folder_path, title, when)
+            except Exception as e:
+                self.logger.error(f"ファイル作成エラー: {e}")
+                future.set_exception(e)
+                continue
+            folder_paths.add(folder_path)
+            written.append((path, future))
+        self._sync_folders(folder_paths)
+
+        for path, future in written:
+            self.logger.info(f"ファイル作成成功: {path}")
+            future.set_result(path)
+        self._notify([path for path, _ in written])
+
+    def close(self):
+        """キューに残ったノートを書き終えてスレッドを止める"""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
+
+    def __enter__(self) -> 'VaultWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
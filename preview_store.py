@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+プレビュー結果ストア - プレビューで承認された分析結果を保存時に再利用
+メモ内容のハッシュをキーに、キャッシュディレクトリへJSONで保存する
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from typing import Dict, Optional
+
+from app_settings import get_cache_dir
+
+
+class PreviewStore:
+    """プレビュー時の分析結果をメモ内容のハッシュで保存"""
+
+    def __init__(self, store_dir: str = None, ttl_seconds: float = 24 * 3600):
+        self.logger = logging.getLogger(__name__)
+        self.store_dir = store_dir or os.path.join(get_cache_dir(), 'previews')
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.store_dir, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def content_key(content: str) -> str:
+        """メモ内容のハッシュキー"""
+        return hashlib.sha256(content.strip().encode('utf-8')).hexdigest()
+
+    def _path(self, content: str) -> str:
+        return os.path.join(self.store_dir, f"{self.content_key(content)}.json")
+
+    def save(self, content: str, analysis_result: Dict) -> str:
+        """分析結果を保存してキーを返す"""
+        self._prune()
+        key = self.content_key(content)
+        record = {'created': time.time(), 'analysis_result': analysis_result}
+
+        # 書き込み途中のファイルを読まれないよう一時ファイル経由で置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(content))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        return key
+
+    def load(self, content: str) -> Optional[Dict]:
+        """保存済みの分析結果を取得（期限切れ・未保存ならNone）"""
+        try:
+            with open(self._path(content), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - record.get('created', 0) > self.ttl_seconds:
+            self.discard(content)
+            return None
+
+        return record.get('analysis_result')
+
+    def discard(self, content: str):
+        """保存済みの分析結果を削除"""
+        try:
+            os.unlink(self._path(content))
+        except OSError:
+            pass
+
+    def _prune(self):
+        """期限切れのエントリを削除"""
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            for entry in os.scandir(self.store_dir):
+                if entry.name.endswith(('.json', '.tmp')) and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+        except OSError as e:
+            self.logger.warning(f"プレビューストア整理エラー: {e}")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+プロンプト比較 - 固定のメモ集合で各プロンプト版のトークン数・応答時間・分類の一致率を比べる
+既定では送信せずにトークン数の概算だけを出し、live 指定時は実際にAPIを呼ぶ
+"""
+
+import time
+import logging
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+from app_settings import CONFIG_PATH
+from prompts import estimate_tokens, get_prompt_template
+
+
+def estimate_variants(memos: List[Tuple[str, str]], categories: List[str],
+                      versions: List[str]) -> Dict[str, Dict]:
+    """APIを呼ばずに、各版の入力トークン数（概算）を集計"""
+    memo_tokens = sum(estimate_tokens(content) for _, content in memos)
+    report = {}
+    for version in versions:
+        template = get_prompt_template(version)
+        instruction_tokens = template.instruction_tokens(categories) * len(memos)
+        prompt_tokens = instruction_tokens + memo_tokens
+        report[version] = {
+            'memos': len(memos),
+            'prompt_tokens': prompt_tokens,
+            'memo_tokens': memo_tokens,
+            'instruction_tokens': instruction_tokens,
+            'avg_prompt_tokens': round(prompt_tokens / len(memos), 1) if memos else 0.0,
+        }
+    return report
+
+
+def run_live(memos: List[Tuple[str, str]], categories: List[str], versions: List[str],
+             config_path: str = CONFIG_PATH) -> Dict[str, Dict]:
+    """各版で実際に分析し、トークン数・応答時間と、先頭の版との分類一致率を集計"""
+    from gemini_client import GeminiClient
+
+    logger = logging.getLogger(__name__)
+    baseline: Dict[str, Optional[str]] = {}
+    report = {}
+
+    for version in versions:
+        client = GeminiClient(config_path, prompt_version=version)
+        # 比較のため応答キャッシュは使わない
+        client.cache = None
+
+        totals = {'prompt_tokens': 0, 'output_tokens': 0}
+        latencies = []
+        categories_by_id = {}
+        errors = 0
+
+        for memo_id, content in memos:
+            started = time.monotonic()
+            try:
+                result = client.analyze_memo(content, categories)
+            except Exception as e:
+                logger.warning(f"プロンプト比較: {version} / {memo_id} の分析に失敗: {e}")
+                errors += 1
+                continue
+            latencies.append(time.monotonic() - started)
+            categories_by_id[memo_id] = result.get('category')
+            for key in totals:
+                totals[key] += (client.last_usage or {}).get(key, 0)
+
+        if not baseline:
+            baseline = categories_by_id
+        compared = [memo_id for memo_id in categories_by_id if memo_id in baseline]
+        agreed = sum(1 for memo_id in compared if categories_by_id[memo_id] == baseline[memo_id])
+
+        latencies.sort()
+        report[version] = {
+            'memos': len(memos),
+            'errors': errors,
+            'prompt_tokens': totals['prompt_tokens'],
+            'output_tokens': totals['output_tokens'],
+            'avg_latency_ms': round(1000 * sum(latencies) / len(latencies)) if latencies else None,
+            'p90_latency_ms': round(1000 * latencies[int(0.9 * (len(latencies) - 1))]) if latencies else None,
+            'category_agreement': round(agreed / len(compared), 3) if compared else None,
+        }
+    return report
+
+
+def run_prompt_bench(source: str, categories: List[str], versions: List[str], live: bool = False,
+                     limit: Optional[int] = None) -> Dict[str, Dict]:
+    """メモ集合（ディレクトリまたはJSONL）を読み込んで各版を比較"""
+    from batch_runner import iter_memos
+
+    # 読めなかったメモは比較から除く
+    memos = [(memo_id, content) for memo_id, content, error in islice(iter_memos(source), limit)
+             if not error and content.strip()]
+    if live:
+        return run_live(memos, categories, versions)
+    return estimate_variants(memos, categories, versions)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+プロンプトテンプレート - Geminiに送る分析プロンプトを版ごとに管理
+カテゴリで決まる前後の部分は一度だけ組み立て、呼び出しごとにはメモ内容を挟むだけにする
+"""
+
+from typing import Dict, Iterable, List, Tuple
+
+CONTENT_MARKER = '{content}'
+MEMOS_MARKER = '{memos}'
+CATEGORY_MARKER = '{category_list}'
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語は1文字≒1トークン、英数字は4文字≒1トークン）"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+class PromptTemplate:
+    """単体・一括分析のプロンプトを1つの版としてまとめたもの"""
+
+    def __init__(self, version: str, single: str, packed: str):
+        self.version = version
+        self.packed_version = f"packed-{version}"
+        self._templates = {'single': (single, CONTENT_MARKER), 'packed': (packed, MEMOS_MARKER)}
+        # (種類, カテゴリ) -> (前半, 後半, 指示部分のトークン数)
+        self._compiled: Dict[Tuple[str, Tuple[str, ...]], Tuple[str, str, int]] = {}
+
+    def _compile(self, kind: str, categories: Iterable[str]) -> Tuple[str, str, int]:
+        key = (kind, tuple(categories))
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            template, marker = self._templates[kind]
+            head, tail = template.replace(CATEGORY_MARKER, ", ".join(key[1])).split(marker)
+            compiled = (head, tail, estimate_tokens(head + tail))
+            self._compiled[key] = compiled
+        return compiled
+
+    def build(self, content: str, categories: List[str]) -> str:
+        """単体分析用のプロンプト"""
+        head, tail, _ = self._compile('single', categories)
+        return head + content + tail
+
+    def build_packed(self, pack: List[Tuple[str, str]], categories: List[str]) -> str:
+        """一括分析用のプロンプト（各メモには1からの番号を振る）"""
+        head, tail, _ = self._compile('packed', categories)
+        memo_blocks = "\n".join(
+            f'<memo id="{index}">\n{content.strip()}\n</memo>'
+            for index, (_, content) in enumerate(pack, 1)
+        )
+        return head + memo_blocks + tail
+
+    def instruction_tokens(self, categories: List[str], packed: bool = False) -> int:
+        """メモ以外の指示部分のトークン数（概算）"""
+        return self._compile('packed' if packed else 'single', categories)[2]
+
+
+# v1: 旧来のプロンプト（カテゴリ規則が2か所に重複している）
+_V1_RULES = """        # 根本的分析手順
+        1. **文章全体を3回読み返す**: 全体像を把握してから詳細を分析
+        2. **中心的主題の特定**: 文章が何について説明しているかを1文で要約
+        3. **具体的内容の抽出**: 抽象的概念ではなく文章で実際に扱われている具体的事項
+        4. **誤解しやすいパターンの回避**: 「AI」「教育」などの単語だけで判断せず、文脈を重視
+
+        # タイトル生成の厳格なルール
+        - 文章の中心的主題を正確に反映すること（例: セキュリティ対策なら「AIセキュリティ対策」）
+        - 抽象的で曖昧なタイトルは絶対に避けること（例: 「AI活用法」「教育プログラム」等）
+        - 体言止め（名詞で終わる）にすること
+        - 10-20文字程度で簡潔にすること
+
+        # カテゴリ分類の厳格なルール（優先順位順）
+        - 個人名や打ち合わせ・会議・ビジネス戦略・コンサルティング → consulting（最優先）
+        - プログラミング、システム、技術解説 → tech  
+        - 教育手法、学習方法、指導法 → education
+        - 書籍内容、読書記録 → kindle
+        - 音楽理論、演奏技術 → music
+        - SNS・YouTube・note等外部発信、コンテンツ制作、メディア → media
+        - 上記以外 → others
+
+        # 利用可能なカテゴリ
+        {category_list}
+
+        # タイトル生成の原則
+        
+        **絶対ルール**: 
+        1. 与えられたメモ内容の中から具体的なキーワードを抽出してタイトルを構成する
+        2. メモに含まれていない単語や概念をタイトルに使わない
+        3. 料金・プランに関する内容の場合、具体的なプラン名やサービス名を含める
+        4. 汎用的なタイトル（「活用法」「解説」等）を避け、内容の特徴を捉える
+        
+        # タイトル生成の思考プロセス（参考）
+        
+        ステップ1: メモから重要な固有名詞を抽出
+        - 例: Opus, Sonnet, Claude, Obsidian, Proプランなど
+        
+        ステップ2: メモの主題を表す動作や状態を特定
+        - 例: 料金体系、使用制限、比較、構築、管理など
+        
+        ステップ3: 固有名詞と主題を組み合わせてタイトル化
+        - 例: 「Opus/Sonnet料金体系」「Proプラン使用制限」
+        
+        **注意**: 上記はあくまで思考プロセスの例であり、実際のタイトルはメモ内容に即して生成すること。
+
+        # カテゴリ分類の優先ルール（厳格な優先順位）
+        **重要**: ビジネス要素がある場合は必ずconsultingを優先
+        - 個人の名前（嶋村氏など）や打ち合わせ・会議・ビジネス戦略・経営・マーケティング → consulting（最優先）
+        - プログラミング、AI、技術的内容 → tech
+        - 教育・学習・指導内容（ビジネス要素なし） → education
+        - 読書・Kindle・本の内容 → kindle
+        - 音楽・演奏・楽器関連 → music
+        - SNS・YouTube・note等外部発信、コンテンツ制作（ビジネス要素なし） → media
+        - その他 → others
+"""
+
+V1 = PromptTemplate(
+    'v1',
+    single="""
+        あなたは文章解析の専門家です。以下のメモ内容の主題を正確に特定し、適切なタイトル、カテゴリ、タグ、関連ファイル検索用のキーワードをJSON形式で提案してください。
+
+""" + _V1_RULES + """
+        # メモ内容
+        ---
+        {content}
+        ---
+
+        # 出力形式 (JSON)
+        {
+          "title": "（体言止めのタイトル）",
+          "category": "（カテゴリリストから選択）",
+          "tags": ["（タグ1）", "（タグ2）", "..."],
+          "related_files_keywords": ["（キーワード1）", "（キーワード2）", "..."]
+        }
+        """,
+    packed="""
+        あなたは文章解析の専門家です。以下の複数のメモそれぞれについて主題を正確に特定し、適切なタイトル、カテゴリ、タグ、関連ファイル検索用のキーワードをJSON形式で提案してください。
+        メモ同士は無関係です。各メモを独立に分析してください。
+        
+""" + _V1_RULES + """        
+        # メモ一覧（各メモは <memo id="番号"> で区切られています）
+{memos}
+
+        # 出力形式 (JSON配列、入力の各メモにつき1要素)
+        [
+          {
+            "id": "（メモの番号）",
+            "title": "（体言止めのタイトル）",
+            "category": "（カテゴリリストから選択）",
+            "tags": ["（タグ1）", "（タグ2）", "..."],
+            "related_files_keywords": ["（キーワード1）", "（キーワード2）", "..."]
+          }
+        ]
+        """,
+)
+
+
+# v2: 重複していたカテゴリ規則を1つにまとめ、インデントを除いた版
+_V2_RULES = """
+# 分析手順
+1. 全体を読んでから、文章が何について説明しているかを1文で要約する
+2. 「AI」「教育」などの単語だけで判断せず、文脈から具体的な主題を抽出する
+
+# タイトル
+- メモ内の具体的なキーワード（固有名詞・プラン名・サービス名など）で構成し、メモにない語は使わない
+- 「活用法」「解説」「教育プログラム」などの抽象的・汎用的な表現は避ける
+- 体言止めで10-20文字程度（例: 「Opus/Sonnet料金体系」「Proプラン使用制限」）
+
+# カテゴリ（上から優先。ビジネス要素があれば必ずconsulting）
+- 個人名（嶋村氏など）・打ち合わせ・会議・ビジネス戦略・経営・マーケティング・コンサルティング → consulting
+- プログラミング・システム・AIなどの技術的内容 → tech
+- 教育手法・学習方法・指導法 → education
+- 書籍内容・読書記録・Kindle → kindle
+- 音楽理論・演奏技術・楽器 → music
+- SNS・YouTube・note等の外部発信、コンテンツ制作、メディア → media
+- 上記以外 → others
+
+利用可能なカテゴリ: {category_list}
+"""
+
+V2 = PromptTemplate(
+    'v2',
+    single="""あなたは文章解析の専門家です。メモの主題を正確に特定し、タイトル・カテゴリ・タグ・関連ファイル検索用キーワードをJSONで返してください。
+""" + _V2_RULES + """
+# メモ内容
+---
+{content}
+---
+
+# 出力形式（JSONのみ）
+{"title": "体言止めのタイトル", "category": "カテゴリ", "tags": ["タグ"], "related_files_keywords": ["キーワード"]}
+""",
+    packed="""あなたは文章解析の専門家です。以下の複数のメモはそれぞれ無関係です。各メモを独立に分析し、タイトル・カテゴリ・タグ・関連ファイル検索用キーワードをJSONで返してください。
+""" + _V2_RULES + """
+# メモ一覧（<memo id="番号"> で区切り）
+{memos}
+
+# 出力形式（JSON配列のみ、各メモにつき1要素）
+[{"id": "メモの番号", "title": "体言止めのタイトル", "category": "カテゴリ", "tags": ["タグ"], "related_files_keywords": ["キーワード"]}]
+""",
+)
+
+PROMPT_VARIANTS = {template.version: template for template in (V1, V2)}
+DEFAULT_PROMPT_VERSION = 'v2'
+
+
+def get_prompt_template(version: str = None) -> PromptTemplate:
+    """版を指定してテンプレートを取得（未知の版は例外）"""
+    version = version or DEFAULT_PROMPT_VERSION
+    if version not in PROMPT_VARIANTS:
+        raise ValueError(f"未知のプロンプト版です: {version}（{', '.join(PROMPT_VARIANTS)}）")
+    return PROMPT_VARIANTS[version]
+
+
+# 長いメモの部分ごとの分析結果を1つにまとめるプロンプト
+MERGE_PROMPT_VERSION = 'merge-v1'
+
+_MERGE_TEMPLATE = """あなたは文章解析の専門家です。以下は1つの長いメモを分割し、部分ごとに分析した結果です。メモ全体の主題を表すタイトル・カテゴリ・タグ・関連ファイル検索用キーワードをJSONで返してください。
+
+# ルール
+- タイトルは部分のタイトル・タグに現れる具体的なキーワードで構成し、体言止めで10-20文字程度にする
+- カテゴリは分量（トークン数）の多い部分を重視して1つ選ぶ（ビジネス要素が中心ならconsulting）
+- タグは全体に共通する具体的な語を優先して5個以内
+
+利用可能なカテゴリ: {category_list}
+
+# 部分ごとの分析結果
+{parts}
+
+# 出力形式（JSONのみ）
+{"title": "体言止めのタイトル", "category": "カテゴリ", "tags": ["タグ"], "related_files_keywords": ["キーワード"]}
+"""
+
+
+def build_merge_prompt(parts: List[Dict], categories: List[str]) -> str:
+    """部分ごとの分析結果（title, category, tags, tokens）からまとめ用のプロンプトを作成"""
+    lines = [
+        f"{index}. [{part.get('tokens', 0)}トークン] {part.get('title', '')} / {part.get('category', '')}"
+        f" / {', '.join(part.get('tags') or [])}"
+        for index, part in enumerate(parts, 1)
+    ]
+    head, tail = _MERGE_TEMPLATE.replace(CATEGORY_MARKER, ", ".join(categories)).split('{parts}')
+    return head + "\n".join(lines) + tail
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API呼び出しの耐障害性 - 期限付きリトライとサーキットブレーカー
+遅い・落ちているAPIでUIが固まらないよう、待ち時間に上限を設ける
+"""
+
+import os
+import json
+import time
+import fcntl
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional, TypeVar
+
+from app_settings import get_cache_dir
+
+T = TypeVar('T')
+
+# 再試行する価値のある一時的なエラー（google.api_core の例外名）
+TRANSIENT_ERROR_NAMES = {
+    'DeadlineExceeded', 'ServiceUnavailable', 'InternalServerError', 'TooManyRequests',
+    'ResourceExhausted', 'GatewayTimeout', 'Aborted', 'RetryError',
+}
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているためAPIを呼ばなかった"""
+
+
+def is_transient_error(error: Exception) -> bool:
+    """一時的なエラー（タイムアウト・過負荷・接続断）か判定"""
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+
+def remaining_time(deadline: Optional[float]) -> Optional[float]:
+    """期限（time.monotonic 基準）までの残り秒数"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_with_retries(func: Callable[[Optional[float]], T], deadline: Optional[float] = None,
+                      max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0) -> T:
+    """
+    func(残り秒数) を一時的なエラーの間だけ再試行する
+    待機はジッター付き指数バックオフで、期限を超える再試行は行わない
+    """
+    logger = logging.getLogger(__name__)
+
+    for attempt in range(max_attempts):
+        timeout = remaining_time(deadline)
+        if timeout is not None and timeout <= 0:
+            raise TimeoutError("API呼び出しの期限を超過しました")
+
+        try:
+            return func(timeout)
+        except Exception as e:
+            if not is_transient_error(e) or attempt == max_attempts - 1:
+                raise
+
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            timeout = remaining_time(deadline)
+            if timeout is not None and timeout <= delay:
+                raise TimeoutError(f"API呼び出しの期限内に再試行できません: {e}") from e
+
+            logger.warning(f"一時的なエラーのため {delay:.2f}秒後に再試行 ({attempt + 1}/{max_attempts}): {e}")
+            time.sleep(delay)
+
+    raise RuntimeError("max_attempts は1以上を指定してください")
+
+
+class CircuitBreaker:
+    """連続失敗でAPI呼び出しを一定時間止める（状態はプロセス間で共有）
+
+    待機時間が過ぎた後（半開）は、試行の権利を状態ファイルに記録した1つの呼び出しだけを通し、
+    その結果が出るまで他の呼び出し（バッチの並行実行・常駐サーバーの別スレッド・別プロセス）は止めたままにする
+    """
+
+    def __init__(self, state_path: str = None, failure_threshold: int = 3, reset_timeout: float = 120):
+        self.logger = logging.getLogger(__name__)
+        self.state_path = state_path or os.path.join(get_cache_dir(), 'circuit_breaker.json')
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """状態の読み書きをスレッド・プロセスの間で排他する"""
+        with self._lock:
+            try:
+                lock_file = open(f"{self.state_path}.lock", 'a')
+            except OSError as e:
+                self.logger.warning(f"サーキットブレーカーのロックを取得できません: {e}")
+                yield
+                return
+            with lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'failures': 0, 'opened_at': None}
+
+    def _save(self, state: dict):
+        try:
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            self.logger.warning(f"サーキットブレーカー状態の保存に失敗: {e}")
+
+    def allow_request(self) -> bool:
+        """呼び出してよいか（開いている間はFalse、待機時間経過後は1つの呼び出しだけ試行を許可）"""
+        state = self._load()
+        if state.get('opened_at') is None:
+            return True
+
+        with self._locked():
+            state = self._load()
+            opened_at = state.get('opened_at')
+            if opened_at is None:
+                return True
+            now = time.time()
+            if now - opened_at < self.reset_timeout:
+                return False
+            # 試行中の呼び出しが結果を記録しないまま終わった（プロセスの異常終了など）場合は、
+            # もう一度待機時間が過ぎたら次の呼び出しに試行を譲る
+            probe_at = state.get('probe_at')
+            if probe_at is not None and now - probe_at < self.reset_timeout:
+                return False
+            self._save({**state, 'probe_at': now})
+        self.logger.info("APIの一時停止を解除できるか1件だけ試行します")
+        return True
+
+    @staticmethod
+    def _dirty(state: dict) -> bool:
+        return bool(state.get('failures') or state.get('opened_at') or state.get('probe_at'))
+
+    def record_success(self):
+        if not self._dirty(self._load()):
+            return
+        with self._locked():
+            state = self._load()
+            if self._dirty(state):
+                self._save({'failures': 0, 'opened_at': None})
+
+    def release_probe(self):
+        """試行がAPIの障害以外の理由で失敗した（結果で開閉を判断できない）ときに、次の呼び出しに試行を譲る"""
+        if self._load().get('probe_at') is None:
+            return
+        with self._locked():
+            state = self._load()
+            if state.get('probe_at') is not None:
+                state.pop('probe_at')
+                self._save(state)
+
+    def record_failure(self):
+        with self._locked():
+            state = self._load()
+            failures = state.get('failures', 0) + 1
+            opened_at = state.get('opened_at')
+            if failures >= self.failure_threshold:
+                if opened_at is None:
+                    self.logger.warning(f"API呼び出しが {failures} 回連続で失敗したため一時停止します")
+                # 試行中の失敗でも開き直して待機時間を延長（試行の権利も取り消す）
+                opened_at = time.time()
+            self._save({'failures': failures, 'opened_at': opened_at})
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+応答キャッシュ - 同じメモの再分析でGemini APIを呼ばないためのディスクキャッシュ
+内容ハッシュをキーにSQLiteへ保存し、件数上限（LRU）と有効期限で管理する
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+
+from app_settings import get_cache_dir
+
+
+def normalize_content(content: str) -> str:
+    """キャッシュキー用にメモ内容を正規化（Unicode正規化・改行・行末空白を統一）"""
+    content = unicodedata.normalize('NFC', content)
+    lines = content.strip().splitlines()
+    return '\n'.join(line.rstrip() for line in lines)
+
+
+class ResponseCache:
+    """analyze_memo の応答をLRU・TTL付きで保存"""
+
+    def __init__(self, db_path: str = None, max_entries: int = 2000, ttl_seconds: float = 30 * 86400):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path or os.path.join(get_cache_dir(), 'responses.sqlite3')
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional['ResponseCache']:
+        """config.yaml の response_cache セクションから生成（無効ならNone）"""
+        settings = config.get('response_cache', {}) or {}
+        if not settings.get('enable', True):
+            return None
+        return cls(
+            max_entries=settings.get('max_entries', 2000),
+            ttl_seconds=settings.get('ttl_days', 30) * 86400,
+        )
+
+    @staticmethod
+    def make_key(content: str, categories: List[str], model_name: str, prompt_version: str) -> str:
+        """メモ内容・カテゴリ・モデル・プロンプト版からキーを生成"""
+        payload = json.dumps(
+            [normalize_content(content), list(categories), model_name, prompt_version],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access);
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+        return self._conn
+
+    def _increment(self, conn: sqlite3.Connection, name: str):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, key: str) -> Optional[Dict]:
+        """キャッシュを取得（期限切れ・未登録ならNone）"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    now = time.time()
+                    row = conn.execute(
+                        "SELECT value, created FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+
+                    if row and now - row[1] <= self.ttl_seconds:
+                        conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                        self._increment(conn, 'hits')
+                        return json.loads(row[0])
+
+                    if row:
+                        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._increment(conn, 'misses')
+                    return None
+        except (sqlite3.Error, ValueError) as e:
+            self.logger.warning(f"応答キャッシュ読み込みエラー: {e}")
+            return None
+
+    def put(self, key: str, value: Dict):
+        """キャッシュを保存し、上限を超えた分を古い順に削除"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    now = time.time()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, created, last_access) "
+                        "VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), now, now),
+                    )
+                    conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+
+                    overflow = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+                    if overflow > 0:
+                        conn.execute(
+                            "DELETE FROM responses WHERE key IN "
+                            "(SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                            (overflow,),
+                        )
+                        conn.execute(
+                            "INSERT INTO counters (name, value) VALUES ('evictions', ?) "
+                            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                            (overflow,),
+                        )
+        except sqlite3.Error as e:
+            self.logger.warning(f"応答キャッシュ書き込みエラー: {e}")
+
+    def stats(self) -> Dict:
+        """ヒット・ミス数などの統計"""
+        with self._lock:
+            conn = self._connect()
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐次JSONパーサー - ストリーミング応答からトップレベルのフィールドを完成した順に取り出す
+応答が途中で切れても、完成済みのフィールドは回収できる
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+_WHITESPACE = ' \t\r\n'
+
+# デコードできなかった値の目印
+_INVALID = object()
+
+
+class IncrementalJSONObjectParser:
+    """JSONオブジェクトを断片ごとに受け取り、値が確定したフィールドを返す
+
+    オブジェクトの前後にあるコードフェンスなどの文字は無視する
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._state = 'start'
+        self._buf: List[str] = []
+        self._key: Optional[str] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # 値が配列のとき、最後に完成した要素の直後の位置（途中切断時の回収用）
+        self._last_element_end = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """断片を読み込み、この断片で確定した (キー, 値) のリストを返す"""
+        completed = []
+        for ch in chunk:
+            if self.done:
+                break
+            self._consume(ch, completed)
+        return completed
+
+    def partial(self) -> Dict[str, Any]:
+        """確定済みのフィールド（途中の配列は完成した要素まで）を返す"""
+        fields = dict(self.fields)
+        if self._state == 'value' and self._buf and self._buf[0] == '[' and self._key is not None:
+            salvaged = self._decode(''.join(self._buf[:self._last_element_end]) + ']')
+            if isinstance(salvaged, list):
+                fields[self._key] = salvaged
+        return fields
+
+    def _consume(self, ch: str, completed: List[Tuple[str, Any]]):
+        state = self._state
+
+        if state == 'start':
+            if ch == '{':
+                self._state = 'key'
+
+        elif state == 'key':
+            if ch == '"':
+                self._buf = [ch]
+                self._in_string = True
+                self._state = 'key_string'
+            elif ch == '}':
+                self.done = True
+
+        elif state == 'key_string':
+            self._buf.append(ch)
+            if self._string_closed(ch):
+                key = self._decode(''.join(self._buf))
+                self._key = key if isinstance(key, str) else None
+                self._state = 'colon'
+
+        elif state == 'colon':
+            if ch == ':':
+                self._state = 'value_start'
+
+        elif state == 'value_start':
+            if ch in _WHITESPACE:
+                return
+            self._buf = [ch]
+            self._depth = 0
+            self._last_element_end = 1
+            if ch == '"':
+                self._in_string = True
+                self._state = 'value'
+            elif ch in '[{':
+                self._depth = 1
+                self._state = 'value'
+            else:
+                self._state = 'literal'
+
+        elif state == 'value':
+            self._buf.append(ch)
+            if self._in_string:
+                if self._string_closed(ch) and self._depth == 0:
+                    self._complete(completed)
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '[{':
+                self._depth += 1
+            elif ch in ']}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete(completed)
+            elif ch == ',' and self._depth == 1:
+                self._last_element_end = len(self._buf) - 1
+
+        elif state == 'literal':
+            if ch in ',}' or ch in _WHITESPACE:
+                self._complete(completed)
+                self._consume(ch, completed)
+            else:
+                self._buf.append(ch)
+
+        elif state == 'after_value':
+            if ch == ',':
+                self._state = 'key'
+            elif ch == '}':
+                self.done = True
+
+    def _string_closed(self, ch: str) -> bool:
+        """文字列内の1文字を処理し、閉じ引用符ならTrue"""
+        if self._escape:
+            self._escape = False
+        elif ch == '\\':
+            self._escape = True
+        elif ch == '"':
+            self._in_string = False
+            return True
+        return False
+
+    def _complete(self, completed: List[Tuple[str, Any]]):
+        value = self._decode(''.join(self._buf))
+        if self._key is not None and value is not _INVALID:
+            self.fields[self._key] = value
+            completed.append((self._key, value))
+        self._buf = []
+        self._key = None
+        self._state = 'after_value'
+
+    @staticmethod
+    def _decode(text: str):
+        try:
+            # LLMの応答は文字列内に生の改行を含むことがあるため strict=False
+            return json.loads(text, strict=False)
+        except ValueError:
+            return _INVALID
+
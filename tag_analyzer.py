@@ -4,24 +4,171 @@
 動的タグ分析システム - 個別具体的な単語を優先
 """
 
-import os
 import re
-import glob
+import time
 from collections import Counter
-from typing import List, Set, Dict, Tuple
+from typing import List, Set, Dict, NamedTuple, Tuple
 import logging
 
+from app_settings import get_vault_path
+from tag_index import TagIndex
+
+# 文字種ごとの連続部分（本文はこの正規表現で1回だけ走査し、タグ候補は連続部分の並びから組み立てる）
+_KATAKANA = '\u30a1-\u30f6\u30fc'
+_KANJI = '\u4e00-\u9fa5'
+_RUN = re.compile(
+    r'(?P<latin>[A-Za-z]+)|(?P<digit>\d+)'
+    rf'|(?P<katakana>[{_KATAKANA}]+)|(?P<kanji>[{_KANJI}]+)|(?P<hyphen>-)'
+    rf'|(?P<other>[^\W\dA-Za-z{_KATAKANA}{_KANJI}]+)'
+)
+_UPPER = re.compile(r'[A-Z]{2,}')
+_DIGITS = re.compile(r'\d+')
+
+# 候補の種類（旧来のパターンの優先順。候補の並び順は種類ごとの初出位置による）
+PROPER_NOUN, KATAKANA_WORD, KANJI_WORD, KATAKANA_KANJI, KANJI_KATAKANA, VERSIONED, JOINED, MODEL_NAME = range(8)
+
+# 漢字熟語として切り出す最大文字数
+MAX_KANJI_WORD = 6
+
+
+class TagCandidate(NamedTuple):
+    word: str
+    # 本文中で候補として切り出された回数と最初の位置
+    count: int
+    first_offset: int
+    # 固有名詞らしい（英大文字始まり、またはカタカナのみ）
+    proper_noun: bool
+    # 複合語・専門用語らしい（ハイフン・アンダースコア・数字を含む）
+    compound: bool
+
+
+class _CandidateCounter:
+    """切り出した候補の出現回数・初出位置・並び順を集計"""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.first_offsets: Dict[str, int] = {}
+        self.order: Dict[str, Tuple[int, int]] = {}
+        self.kinds: Dict[str, int] = {}
+
+    def add(self, word: str, kind: int, offset: int):
+        if word in self.counts:
+            self.counts[word] += 1
+            self.first_offsets[word] = min(self.first_offsets[word], offset)
+            self.order[word] = min(self.order[word], (kind, offset))
+            return
+        self.counts[word] = 1
+        self.first_offsets[word] = offset
+        self.order[word] = (kind, offset)
+        self.kinds[word] = kind
+
+    def candidates(self) -> List[TagCandidate]:
+        return [
+            TagCandidate(word, self.counts[word], self.first_offsets[word],
+                         'A' <= word[0] <= 'Z' or self.kinds[word] == KATAKANA_WORD,
+                         self.kinds[word] in (VERSIONED, JOINED, MODEL_NAME))
+            for word in sorted(self.order, key=self.order.__getitem__)
+        ]
+
+
+def _add_part(counter: _CandidateCounter, runs: List[Tuple[str, str, int]]):
+    """ハイフンで区切られた1部分（英数字・かな漢字の連続）から候補を切り出す"""
+    kinds = [kind for kind, _, _ in runs]
+    if kinds == ['latin'] and 'A' <= runs[0][1][0] <= 'Z' and len(runs[0][1]) >= 2:
+        counter.add(runs[0][1], PROPER_NOUN, runs[0][2])
+    elif kinds == ['latin', 'digit']:
+        counter.add(runs[0][1] + runs[1][1], VERSIONED, runs[0][2])
+
+    for i, (kind, text, start) in enumerate(runs):
+        if kind == 'katakana':
+            if len(text) >= 3:
+                counter.add(text, KATAKANA_WORD, start)
+            if i + 1 < len(runs) and runs[i + 1][0] == 'kanji':
+                counter.add(text + runs[i + 1][1], KATAKANA_KANJI, start)
+        elif kind == 'kanji':
+            for offset in range(0, len(text), MAX_KANJI_WORD):
+                chunk = text[offset:offset + MAX_KANJI_WORD]
+                if len(chunk) >= 2:
+                    counter.add(chunk, KANJI_WORD, start + offset)
+            if i + 1 < len(runs) and runs[i + 1][0] == 'katakana':
+                counter.add(text + runs[i + 1][1], KANJI_KATAKANA, start)
+
+
+def _add_segment(counter: _CandidateCounter, parts: List[Tuple[str, int]]):
+    """空白・記号で区切られた1語（ハイフンを含む）から、ハイフン・アンダースコアでつないだ候補を切り出す"""
+    found = set()
+    i = 0
+    while i < len(parts):
+        text, start = parts[i]
+        if text and i + 1 < len(parts) and parts[i + 1][0]:
+            found.add((f"{text}-{parts[i + 1][0]}", JOINED, start))
+            i += 2
+            continue
+        if '_' in text[1:-1]:
+            found.add((text, JOINED, start))
+        i += 1
+
+    for (text, start), (following, _) in zip(parts, parts[1:]):
+        if _UPPER.fullmatch(text) and _DIGITS.fullmatch(following):
+            found.add((f"{text}-{following}", MODEL_NAME, start))
+
+    # 同じ位置の同じ語は1回と数える
+    seen = set()
+    for word, kind, start in sorted(found, key=lambda item: item[1]):
+        if (word, start) not in seen:
+            seen.add((word, start))
+            counter.add(word, kind, start)
+
+
+def scan_tag_candidates(content: str) -> List[TagCandidate]:
+    """本文を1回走査してタグ候補と出現回数・初出位置・文字種の特徴を求める
+
+    英語の固有名詞、3文字以上のカタカナ語、2-6文字の漢字熟語、カタカナと漢字の複合語、
+    英字+数字（バージョンなど）、ハイフン・アンダースコアでつないだ語、「GPT-4」形式の語を切り出す
+    """
+    counter = _CandidateCounter()
+    parts: List[Tuple[str, int]] = []
+    runs: List[Tuple[str, str, int]] = []
+    part_start = segment_end = -1
+
+    for match in _RUN.finditer(content):
+        start = match.start()
+        if start != segment_end:
+            # 空白・記号を挟んだら1語が終わる
+            if runs or parts:
+                _add_part(counter, runs)
+                parts.append((content[part_start:segment_end], part_start))
+                _add_segment(counter, parts)
+            runs, parts = [], []
+            part_start = start
+        segment_end = match.end()
+
+        kind = match.lastgroup
+        if kind == 'hyphen':
+            _add_part(counter, runs)
+            parts.append((content[part_start:start], part_start))
+            runs = []
+            part_start = segment_end
+        else:
+            runs.append((kind, match.group(), start))
+
+    if runs or parts:
+        _add_part(counter, runs)
+        parts.append((content[part_start:segment_end], part_start))
+        _add_segment(counter, parts)
+
+    return counter.candidates()
+
 class TagAnalyzer:
     """既存ファイルのタグ頻度を分析し、ユニークなタグを優先"""
     
-    def __init__(self, vault_path: str = None):
+    def __init__(self, vault_path: str = None, refresh_interval: float = 600):
         self.logger = logging.getLogger(__name__)
         
         # Obsidianの保管場所
-        if vault_path:
-            self.vault_path = vault_path
-        else:
-            self.vault_path = "/Users/yoshiikatsuhiko/Library/Mobile Documents/iCloud~md~obsidian/Documents"
+        self.vault_path = vault_path or get_vault_path()
+        # タグ使用頻度を読み直す間隔（秒）
+        self.refresh_interval = refresh_interval
         
         # 一般的すぎる単語のブラックリスト
         self.common_words = {
@@ -41,47 +188,43 @@ class TagAnalyzer:
             'data', 'info', 'system', 'method', 'problem', 'solution'
         }
         
-        # 既存タグの使用頻度を計算（初回のみ）
+        # 既存タグの使用頻度（初回に読み込み、以降は refresh_existing_tag_frequency で更新）
         self._existing_tag_frequency = None
+        self._frequency_loaded_at = 0.0
+        self._tag_index = None
+    
+    @classmethod
+    def from_config(cls, config: Dict, vault_path: str = None) -> 'TagAnalyzer':
+        """config.yaml の note_index セクションの更新間隔で生成"""
+        settings = config.get('note_index', {}) or {}
+        return cls(vault_path, refresh_interval=settings.get('refresh_interval_seconds', 600))
     
     def get_existing_tag_frequency(self) -> Counter:
         """既存ファイルのタグ使用頻度を取得（キャッシュ付き）"""
         if self._existing_tag_frequency is None:
-            self._existing_tag_frequency = self._analyze_vault_tags()
+            self.refresh_existing_tag_frequency(force=True)
         return self._existing_tag_frequency
     
+    def refresh_existing_tag_frequency(self, force: bool = False) -> Counter:
+        """前回の読み込みから refresh_interval 秒以上経っていれば、変更されたファイルのタグを読み直す"""
+        if (not force and self._existing_tag_frequency is not None
+                and time.time() - self._frequency_loaded_at < self.refresh_interval):
+            return self._existing_tag_frequency
+        frequency = self._analyze_vault_tags()
+        self._existing_tag_frequency = frequency
+        self._frequency_loaded_at = time.time()
+        return frequency
+    
     def _analyze_vault_tags(self) -> Counter:
-        """Vaultの既存ファイルからタグ使用頻度を分析"""
-        tag_counter = Counter()
-        
+        """Vaultの全ファイルのタグ使用頻度を取得（索引済みのファイルは読み直さない）"""
         try:
-            # マークダウンファイルを検索
-            md_files = glob.glob(os.path.join(self.vault_path, "**/*.md"), recursive=True)
-            
-            for file_path in md_files[:100]:  # パフォーマンスのため最大100ファイル
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        
-                    # YAMLフロントマターからタグを抽出
-                    if content.startswith('---'):
-                        yaml_match = re.search(r'^---\s*\n(.*?)\n---', content, re.DOTALL)
-                        if yaml_match:
-                            yaml_content = yaml_match.group(1)
-                            # tags: の行を探す
-                            tags_match = re.search(r'tags:\s*\[(.*?)\]', yaml_content)
-                            if tags_match:
-                                tags_str = tags_match.group(1)
-                                tags = [tag.strip().strip('"').strip("'") for tag in tags_str.split(',')]
-                                tag_counter.update(tags)
-                                
-                except Exception as e:
-                    continue
-                    
+            if self._tag_index is None:
+                self._tag_index = TagIndex(self.vault_path)
+            return self._tag_index.refresh()
         except Exception as e:
             self.logger.warning(f"Vault分析エラー: {e}")
-            
-        return tag_counter
+            # 読み直しに失敗した間は前回の頻度を使う
+            return self._existing_tag_frequency or Counter()
     
     def generate_unique_tags(self, content: str, max_tags: int = 5) -> List[str]:
         """個別具体的でユニークなタグを生成"""
@@ -89,15 +232,15 @@ class TagAnalyzer:
         # 既存タグの頻度を取得
         existing_frequency = self.get_existing_tag_frequency()
         
-        # 候補となる単語を抽出
-        candidates = self._extract_tag_candidates(content)
+        # 候補となる単語を出現回数・位置と一緒に抽出（本文の走査は1回）
+        candidates = scan_tag_candidates(content)
         
         # スコアリング（低頻度・具体的な単語を優先）
         scored_tags = []
-        for word in candidates:
-            score = self._calculate_tag_score(word, existing_frequency, content)
+        for candidate in candidates:
+            score = self._calculate_tag_score(candidate, existing_frequency)
             if score > 0:
-                scored_tags.append((word, score))
+                scored_tags.append((candidate.word, score))
         
         # スコア順でソート
         scored_tags.sort(key=lambda x: x[1], reverse=True)
@@ -105,48 +248,29 @@ class TagAnalyzer:
         # 上位のタグを返す
         return [tag for tag, _ in scored_tags[:max_tags]]
     
+    def extract_candidates(self, content: str) -> List[str]:
+        """一般的すぎる単語を除いたタグ候補（関連ノート検索の索引語にも使う）"""
+        return [word for word in self._extract_tag_candidates(content)
+                if word.lower() not in self.common_words and 2 <= len(word) <= 20]
+    
     def _extract_tag_candidates(self, content: str) -> List[str]:
-        """タグ候補となる単語を抽出"""
-        candidates = []
-        
-        # 固有名詞パターン
-        patterns = [
-            # 英語の固有名詞（大文字始まり、単語単位）
-            r'\b[A-Z][a-zA-Z]+\b',
-            # カタカナ語（3文字以上）
-            r'[\u30a1-\u30f6\u30fc]{3,}',
-            # 漢字熟語（2-6文字）
-            r'[\u4e00-\u9fa5]{2,6}',
-            # カタカナ+漢字の複合語
-            r'[\u30a1-\u30f6\u30fc]+[\u4e00-\u9fa5]+',
-            # 漢字+カタカナの複合語
-            r'[\u4e00-\u9fa5]+[\u30a1-\u30f6\u30fc]+',
-            # 数字を含む語（バージョンなど）
-            r'\b[A-Za-z]+\d+\b',
-            # ハイフン・アンダースコア含む複合語
-            r'\b\w+[-_]\w+\b',
-            # 英数字混合（GPT-4など）
-            r'\b[A-Z]{2,}-\d+\b'
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, content)
-            candidates.extend(matches)
-        
-        # 重複除去と正規化
-        seen = set()
-        unique_candidates = []
-        for word in candidates:
-            normalized = word.strip()
-            if normalized and normalized not in seen:
-                seen.add(normalized)
-                unique_candidates.append(normalized)
-        
-        return unique_candidates
+        """タグ候補となる単語を抽出（英語の固有名詞、カタカナ語、漢字熟語、複合語など）"""
+        return [candidate.word for candidate in scan_tag_candidates(content)]
+    
+    def _describe_tag(self, word: str, content: str) -> TagCandidate:
+        """候補として切り出されなかった語（既存のタグなど）の特徴を本文から求める"""
+        return TagCandidate(
+            word,
+            content.count(word),
+            content.find(word),
+            bool(re.match(r'^[A-Z]', word) or re.match(r'^[\u30a1-\u30f6\u30fc]+$', word)),
+            bool('-' in word or '_' in word or re.search(r'\d', word)),
+        )
     
-    def _calculate_tag_score(self, word: str, existing_frequency: Counter, content: str) -> float:
+    def _calculate_tag_score(self, candidate: TagCandidate, existing_frequency: Counter) -> float:
         """タグのスコアを計算（低頻度・具体的を高評価）"""
         
+        word = candidate.word
         word_lower = word.lower()
         
         # 一般的な単語は除外
@@ -176,15 +300,15 @@ class TagAnalyzer:
             score -= 1.0  # 高頻度タグは低評価
         
         # 固有名詞判定（大文字始まりやカタカナ）
-        if re.match(r'^[A-Z]', word) or re.match(r'^[\u30a1-\u30f6\u30fc]+$', word):
+        if candidate.proper_noun:
             score += 1.5
         
         # 複合語・専門用語判定
-        if '-' in word or '_' in word or re.search(r'\d', word):
+        if candidate.compound:
             score += 1.0
         
         # コンテンツ内での重要度（出現回数）
-        occurrences = content.count(word)
+        occurrences = candidate.count
         if occurrences >= 3:
             score += 0.5
         elif occurrences == 1:
@@ -192,7 +316,7 @@ class TagAnalyzer:
         
         # 文脈での役割判定
         # タイトルっぽい位置（最初の方）に出現
-        if content[:100].find(word) >= 0:
+        if 0 <= candidate.first_offset and candidate.first_offset + len(word) <= 100:
             score += 0.5
         
         return max(0, score)
@@ -201,19 +325,19 @@ class TagAnalyzer:
         """タグ候補とそのスコアを返す（デバッグ用）"""
         
         existing_frequency = self.get_existing_tag_frequency()
-        candidates = self._extract_tag_candidates(content)
+        candidates = scan_tag_candidates(content)
         
         suggestions = {}
-        for word in candidates:
-            score = self._calculate_tag_score(word, existing_frequency, content)
+        for candidate in candidates:
+            score = self._calculate_tag_score(candidate, existing_frequency)
             if score > 0:
-                suggestions[word] = score
+                suggestions[candidate.word] = score
         
         # 現在のタグがある場合は、それらのスコアも表示
         if current_tags:
             for tag in current_tags:
                 if tag not in suggestions:
-                    suggestions[tag] = self._calculate_tag_score(tag, existing_frequency, content)
+                    suggestions[tag] = self._calculate_tag_score(self._describe_tag(tag, content), existing_frequency)
         
         return dict(sorted(suggestions.items(), key=lambda x: x[1], reverse=True))
 
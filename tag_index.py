@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vaultタグ索引 - 全ノートのタグ使用頻度をSQLiteに保存し、変更されたファイルだけを読み直す
+ファイルごとに更新時刻とサイズを記録し、追加・変更・削除の差分で頻度を更新する
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from app_settings import get_cache_dir
+from vault_scan import SCAN_WORKERS, read_tags, scan_markdown_files
+
+# タグの読み取り方を変えたら更新すること（古い索引は作り直す）
+INDEX_VERSION = 2
+
+
+class TagIndex:
+    """Vault全体のタグ使用頻度を差分更新で保持"""
+
+    def __init__(self, vault_path: str, db_path: str = None):
+        self.logger = logging.getLogger(__name__)
+        self.vault_path = vault_path
+        if not db_path:
+            vault_hash = hashlib.sha256(os.path.abspath(vault_path).encode('utf-8')).hexdigest()[:12]
+            db_path = os.path.join(get_cache_dir(), f'tag_index-{vault_hash}.sqlite3')
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    tags TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS tag_counts (
+                    tag TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL
+                );
+            """)
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+                with self._conn:
+                    self._conn.execute("DELETE FROM files")
+                    self._conn.execute("DELETE FROM tag_counts")
+                    self._conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        return self._conn
+
+    def frequency(self) -> Counter:
+        """索引済みのタグ使用頻度"""
+        with self._lock:
+            return self._frequency_locked(self._connect())
+
+    def refresh(self) -> Counter:
+        """追加・変更・削除されたファイルだけを読み直して頻度を更新し、更新後の頻度を返す"""
+        if not os.path.isdir(self.vault_path):
+            # iCloudの未接続などでVaultが見えない間は索引を消さずに前回の結果を使う
+            self.logger.warning(f"Vaultが見つからないため前回のタグ索引を使用: {self.vault_path}")
+            return self.frequency()
+
+        current = scan_markdown_files(self.vault_path)
+
+        with self._lock:
+            conn = self._connect()
+            indexed = {
+                path: (mtime_ns, size, tags)
+                for path, mtime_ns, size, tags in conn.execute("SELECT path, mtime_ns, size, tags FROM files")
+            }
+
+            removed = [path for path in indexed if path not in current]
+            changed = [path for path, stat in current.items()
+                       if path not in indexed or indexed[path][:2] != stat]
+            if not removed and not changed:
+                return self._frequency_locked(conn)
+
+            # フロントマターだけを並行して読む
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+                tags_by_path = dict(zip(changed, executor.map(self._read_tags, changed)))
+
+            delta = Counter()
+            with conn:
+                for path in removed:
+                    delta.subtract(json.loads(indexed[path][2]))
+                    conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+                for path in changed:
+                    tags = tags_by_path[path]
+                    if path in indexed:
+                        delta.subtract(json.loads(indexed[path][2]))
+                    delta.update(tags)
+                    mtime_ns, size = current[path]
+                    conn.execute(
+                        "INSERT OR REPLACE INTO files (path, mtime_ns, size, tags) VALUES (?, ?, ?, ?)",
+                        (path, mtime_ns, size, json.dumps(tags, ensure_ascii=False)),
+                    )
+
+                for tag, count in delta.items():
+                    if count:
+                        conn.execute(
+                            "INSERT INTO tag_counts (tag, count) VALUES (?, ?) "
+                            "ON CONFLICT(tag) DO UPDATE SET count = count + excluded.count",
+                            (tag, count),
+                        )
+                conn.execute("DELETE FROM tag_counts WHERE count <= 0")
+
+            self.logger.info(f"タグ索引を更新: 変更・追加 {len(changed)}件, 削除 {len(removed)}件")
+            return self._frequency_locked(conn)
+
+    def _read_tags(self, path: str) -> List[str]:
+        try:
+            return read_tags(os.path.join(self.vault_path, path))
+        except OSError as e:
+            self.logger.debug(f"タグ読み込みをスキップ: {path}: {e}")
+            return []
+
+    @staticmethod
+    def _frequency_locked(conn: sqlite3.Connection) -> Counter:
+        return Counter(dict(conn.execute("SELECT tag, count FROM tag_counts").fetchall()))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+トークン計測 - API呼び出しごとの入力（指示・メモ）と出力のトークン数をプロンプト版別に集計
+SDKが使用量を返せばその値を、返さなければ概算値を使う
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+from typing import Dict, Optional
+
+from app_settings import get_cache_dir
+
+
+class TokenMeter:
+    """プロンプト版ごとのトークン使用量をSQLiteに累積"""
+
+    def __init__(self, db_path: str = None):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path or os.path.join(get_cache_dir(), 'token_usage.sqlite3')
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage (
+                    prompt_version TEXT PRIMARY KEY,
+                    calls INTEGER NOT NULL,
+                    estimated_calls INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    memo_tokens INTEGER NOT NULL,
+                    output_tokens INTEGER NOT NULL
+                )
+            """)
+        return self._conn
+
+    def record(self, prompt_version: str, prompt_tokens: int, memo_tokens: int,
+               output_tokens: int, estimated: bool = False):
+        """1回の呼び出しの使用量を加算"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO usage (prompt_version, calls, estimated_calls, prompt_tokens, "
+                        "memo_tokens, output_tokens) VALUES (?, 1, ?, ?, ?, ?) "
+                        "ON CONFLICT(prompt_version) DO UPDATE SET "
+                        "calls = calls + 1, "
+                        "estimated_calls = estimated_calls + excluded.estimated_calls, "
+                        "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                        "memo_tokens = memo_tokens + excluded.memo_tokens, "
+                        "output_tokens = output_tokens + excluded.output_tokens",
+                        (prompt_version, int(estimated), prompt_tokens, memo_tokens, output_tokens),
+                    )
+        except sqlite3.Error as e:
+            self.logger.warning(f"トークン使用量の記録に失敗: {e}")
+
+    def stats(self) -> Dict[str, Dict]:
+        """版ごとの合計と1呼び出しあたりの平均"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT prompt_version, calls, estimated_calls, prompt_tokens, memo_tokens, output_tokens "
+                "FROM usage ORDER BY prompt_version"
+            ).fetchall()
+
+        stats = {}
+        for version, calls, estimated_calls, prompt_tokens, memo_tokens, output_tokens in rows:
+            instruction_tokens = max(0, prompt_tokens - memo_tokens)
+            stats[version] = {
+                'calls': calls,
+                'estimated_calls': estimated_calls,
+                'prompt_tokens': prompt_tokens,
+                'memo_tokens': memo_tokens,
+                'instruction_tokens': instruction_tokens,
+                'output_tokens': output_tokens,
+                'avg_prompt_tokens': round(prompt_tokens / calls, 1) if calls else 0.0,
+                'avg_output_tokens': round(output_tokens / calls, 1) if calls else 0.0,
+                'instruction_share': round(instruction_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+            }
+        return stats
+
+
+def usage_from_response(response) -> Optional[Dict[str, int]]:
+    """応答の usage_metadata から入力・出力トークン数を取り出す（無ければNone）"""
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', None)
+    if not prompt_tokens:
+        return None
+    return {
+        'prompt_tokens': int(prompt_tokens),
+        'output_tokens': int(getattr(usage, 'candidates_token_count', 0) or 0),
+    }
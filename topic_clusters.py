@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+トピッククラスタ - Vaultのノートのベクトルをミニバッチk-meansでまとめ、
+重心と各ノートの割り当てをベクトルストアと同じディレクトリに保存する
+新しいメモは重心との類似度を1回計算するだけでクラスタを提案できる
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from kmeans import KMEANS_ALGORITHMS, MINIBATCH_SIZE, minibatch_kmeans, nearest
+from vector_store import VectorStore
+
+# クラスタの代表として保存するノート数（重心に近い順）
+REPRESENTATIVE_NOTES = 3
+
+# ノートの割り当てを読み出す・書き込む単位
+_WRITE_CHUNK = 500
+
+
+class TopicMatch(NamedTuple):
+    cluster: int
+    similarity: float
+    # 重心に近い代表ノートのタイトル
+    titles: List[str]
+
+
+class TopicClusters:
+    """ベクトルストアのノートのトピッククラスタ（重心と割り当て）"""
+
+    def __init__(self, store: VectorStore, n_clusters: int = 10, algorithm: str = 'kmeans',
+                 min_cluster_size: int = 5, cluster_threshold: float = 0.7,
+                 batch_size: int = MINIBATCH_SIZE):
+        self.logger = logging.getLogger(__name__)
+        if algorithm not in KMEANS_ALGORITHMS:
+            raise ValueError(f"未対応のクラスタリング方式です: {algorithm}")
+        self.store = store
+        self.n_clusters = n_clusters
+        self.algorithm = algorithm
+        self.min_cluster_size = min_cluster_size
+        self.cluster_threshold = cluster_threshold
+        self.batch_size = batch_size
+        self.centroids_path = os.path.join(store.directory, 'topic_centroids.npy')
+        self._lock = threading.Lock()
+        self._conn = None
+        self._centroids: Optional[np.ndarray] = None
+        self._titles: Dict[int, List[str]] = {}
+
+    @classmethod
+    def from_config(cls, store: VectorStore, config: Dict) -> 'TopicClusters':
+        """config.yaml の topic_clustering セクションから生成"""
+        settings = (config.get('advanced_relation_analysis', {}) or {}).get('topic_clustering', {}) or {}
+        return cls(store,
+                   n_clusters=settings.get('n_clusters', 10),
+                   algorithm=settings.get('algorithm', 'kmeans'),
+                   min_cluster_size=settings.get('min_cluster_size', 5),
+                   cluster_threshold=settings.get('cluster_threshold', 0.7))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(os.path.join(self.store.directory, 'topics.sqlite3'),
+                                         check_same_thread=False)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS clusters (
+                    id INTEGER PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    titles TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS assignments (
+                    path TEXT PRIMARY KEY,
+                    cluster INTEGER NOT NULL,
+                    similarity REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+        return self._conn
+
+    def run(self) -> Dict:
+        """登録済みの全ノートをクラスタリングし直して保存し、クラスタごとの件数と代表ノートを返す
+
+        min_cluster_size 未満のクラスタは解消して残りの重心へ振り直し、
+        重心との類似度が cluster_threshold 未満のノートはどのクラスタにも入れない
+        """
+        started = time.time()
+        rows = self.store.registered_rows()
+        if rows.size == 0:
+            return {'notes': 0, 'clusters': []}
+        matrix = self.store.matrix()
+
+        # algorithm が kmeans でも、全件をメモリに載せないようミニバッチで学習する
+        centroids = minibatch_kmeans(matrix, self.n_clusters, rows=rows, batch_size=self.batch_size)
+        labels, similarity = nearest(matrix, centroids, rows=rows)
+
+        sizes = np.bincount(labels, minlength=centroids.shape[0])
+        large = sizes >= self.min_cluster_size
+        if large.any() and not large.all():
+            centroids = centroids[large]
+            labels, similarity = nearest(matrix, centroids, rows=rows)
+        labels = np.where(similarity >= self.cluster_threshold, labels, -1)
+
+        titles = {}
+        for cluster in range(centroids.shape[0]):
+            members = np.flatnonzero(labels == cluster)
+            closest = members[np.argsort(-similarity[members])[:REPRESENTATIVE_NOTES]]
+            found = self.store.lookup(rows[closest].tolist())
+            titles[cluster] = [found[row][1] for row in rows[closest].tolist() if row in found]
+        sizes = np.bincount(labels[labels >= 0], minlength=centroids.shape[0])
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM clusters")
+                conn.execute("DELETE FROM assignments")
+                conn.executemany("INSERT INTO clusters (id, size, titles) VALUES (?, ?, ?)", [
+                    (cluster, int(sizes[cluster]), json.dumps(titles[cluster], ensure_ascii=False))
+                    for cluster in range(centroids.shape[0])
+                ])
+                for start in range(0, rows.size, _WRITE_CHUNK):
+                    chunk = rows[start:start + _WRITE_CHUNK].tolist()
+                    keys = self.store.lookup(chunk)
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO assignments (path, cluster, similarity) VALUES (?, ?, ?)",
+                        [(keys[row][0], int(labels[start + i]), float(similarity[start + i]))
+                         for i, row in enumerate(chunk) if row in keys],
+                    )
+                conn.execute("DELETE FROM meta")
+                conn.executemany("INSERT INTO meta (name, value) VALUES (?, ?)", [
+                    ('embedder', self.store.embedder_name),
+                    ('clustered_at', str(time.time())),
+                ])
+            np.save(self.centroids_path, centroids)
+            self._centroids, self._titles = centroids, titles
+
+        self.logger.info(f"トピッククラスタを作成: {rows.size}件, {centroids.shape[0]}クラスタ, "
+                         f"{time.time() - started:.2f}秒")
+        return {
+            'notes': int(rows.size),
+            'unassigned': int((labels < 0).sum()),
+            'clusters': [
+                {'cluster': cluster, 'size': int(sizes[cluster]), 'titles': titles[cluster]}
+                for cluster in np.argsort(-sizes, kind='stable').tolist()
+            ],
+        }
+
+    def _load(self) -> bool:
+        """保存済みの重心を読み込む（埋め込み方式が変わっていれば使わない）"""
+        if self._centroids is not None:
+            return True
+        if not os.path.exists(self.centroids_path):
+            return False
+        conn = self._connect()
+        meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+        if meta.get('embedder') != self.store.embedder_name:
+            return False
+        self._titles = {cluster: json.loads(titles)
+                        for cluster, titles in conn.execute("SELECT id, titles FROM clusters")}
+        self._centroids = np.load(self.centroids_path)
+        return True
+
+    def assign(self, vector: np.ndarray) -> Optional[TopicMatch]:
+        """メモのベクトルに最も近いクラスタ（cluster_threshold 未満・未作成ならNone）"""
+        with self._lock:
+            if not self._load():
+                return None
+            similarity = self._centroids @ np.asarray(vector, dtype=np.float32)
+            cluster = int(np.argmax(similarity))
+            if similarity[cluster] < self.cluster_threshold:
+                return None
+            return TopicMatch(cluster, float(similarity[cluster]), self._titles.get(cluster, []))
+
@@ -7,191 +7,233 @@
 
 import sys
 import os
+import time
+import argparse
 import logging
-from datetime import datetime
+from typing import Callable, Optional, Tuple
+
+
+class StartupProfile:
+    """起動から初回出力までの時間を計測（--startup-profile）"""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+    
+    def mark(self, name: str):
+        self.marks.append((name, time.perf_counter()))
+    
+    def report(self) -> str:
+        parts = [f"{name}={(at - self.start) * 1000:.1f}ms" for name, at in self.marks]
+        heavy = [name for name in ('google.generativeai', 'yaml', 'numpy') if name in sys.modules]
+        parts.append(f"heavy_imports={','.join(heavy) or 'none'}")
+        return "STARTUP_PROFILE: " + " ".join(parts)
+
+startup_profile = StartupProfile()
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# モジュールをインポート
+# モジュールをインポート（分析エンジンは重いため必要になるまで読み込まない）
 try:
-    from universal_analyzer import UniversalAnalyzer
     from content_formatter import ContentFormatter
+    from preview_store import PreviewStore
 except ImportError as e:
     logger.error(f"モジュールインポートエラー: {e}")
     print(f"ERROR: モジュールインポートに失敗しました: {e}")
     sys.exit(1)
 
-def create_obsidian_file(content: str, analysis_result: dict) -> str:
-    """Obsidianファイルを作成"""
-    
+startup_profile.mark('imports')
+
+# カテゴリリスト
+CATEGORIES = ['consulting', 'tech', 'education', 'kindle', 'music', 'media', 'others']
+
+# フォルダ名（02_Inbox配下の既存フォルダに合わせる）
+FOLDER_MAP = {
+    'consulting': 'Consulting',
+    'tech': 'Tech',
+    'education': 'Education',
+    'kindle': 'kindle',  # 既存フォルダは小文字
+    'music': 'Music',
+    'media': 'Media',
+    'others': 'Others',
+    'readwise': 'Readwise'  # import-highlights で取り込んだReadwiseの書き出し（分析では選ばれない）
+}
+
+# 関連ノート検索用の全文索引（プロセス内で使い回す）
+_note_index = None
+
+def get_note_index():
+    """Vaultの全文索引を取得"""
+    global _note_index
+    if _note_index is None:
+        from app_settings import get_vault_path, load_config
+        from note_index import NoteIndex
+        _note_index = NoteIndex.from_config(get_vault_path(), load_config())
+    return _note_index
+
+# 意味検索用のベクトル索引（プロセス内で使い回す）
+_semantic_index = None
+
+def get_semantic_index():
+    """Vaultのベクトル索引を取得（semantic_search.enable が false ならNone）"""
+    global _semantic_index
+    if _semantic_index is None:
+        from app_settings import get_vault_path, load_config
+        config = load_config()
+        settings = (config.get('advanced_relation_analysis', {}) or {}).get('semantic_search', {}) or {}
+        if not settings.get('enable', False):
+            return None
+        from vector_store import SemanticNoteIndex
+        _semantic_index = SemanticNoteIndex.from_config(get_vault_path(), config)
+    return _semantic_index
+
+# ノート間のリンクグラフ（プロセス内で使い回す）
+_link_graph = None
+
+def get_link_graph():
+    """Vaultのリンクグラフを取得（network_analysis.enable が false ならNone）"""
+    global _link_graph
+    if _link_graph is None:
+        from app_settings import get_vault_path, load_config
+        config = load_config()
+        settings = (config.get('advanced_relation_analysis', {}) or {}).get('network_analysis', {}) or {}
+        if not settings.get('enable', False):
+            return None
+        from link_graph import LinkGraph
+        _link_graph = LinkGraph.from_config(get_vault_path(), config)
+    return _link_graph
+
+# トピッククラスタ（プロセス内で使い回す）
+_topic_clusters = None
+
+def get_topic_clusters():
+    """トピッククラスタを取得（topic_clustering・semantic_search のどちらかが無効ならNone）"""
+    global _topic_clusters
+    if _topic_clusters is None:
+        from app_settings import load_config
+        settings = (load_config().get('advanced_relation_analysis', {}) or {}).get('topic_clustering', {}) or {}
+        semantic_index = get_semantic_index()
+        if not settings.get('enable', False) or semantic_index is None:
+            return None
+        from topic_clusters import TopicClusters
+        _topic_clusters = TopicClusters.from_config(semantic_index.store, load_config())
+    return _topic_clusters
+
+def suggest_topic(content: str) -> Optional[str]:
+    """メモが属するトピッククラスタ（cluster コマンドで作成済みの場合のみ）"""
     try:
-        result = analysis_result.get('result', {})
-        title = result.get('title', 'メモ')
-        category = result.get('category', 'others')
-        tags = result.get('tags', ['メモ'])
-        
-        # フォルダ名を決定（02_Inbox配下の既存フォルダに合わせる）
-        folder_map = {
-            'consulting': 'Consulting',
-            'tech': 'Tech', 
-            'education': 'Education',
-            'kindle': 'kindle',  # 既存フォルダは小文字
-            'music': 'Music',
-            'media': 'Media',
-            'others': 'Others'
-        }
-        folder = folder_map.get(category, 'Others')
-        
-        # ファイル名を生成（安全な文字のみ）
-        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{safe_title}_{timestamp}.md"
-        
-        # Obsidianの02_Inboxディレクトリ
-        obsidian_base = "/Users/yoshiikatsuhiko/Library/Mobile Documents/iCloud~md~obsidian/Documents"
-        folder_path = os.path.join(obsidian_base, "02_Inbox", folder)
-        
-        # フォルダが存在しない場合は作成
-        os.makedirs(folder_path, exist_ok=True)
-        
-        # ファイルパス
-        file_path = os.path.join(folder_path, filename)
-        
-        # YAMLフロントマターとコンテンツを作成
-        formatter = ContentFormatter()
-        formatted_content = formatter.format_content(content)
-        
-        # タグをYAML形式に変換
-        tags_yaml = "\n".join([f"  - {tag}" for tag in tags])
-        
-        file_content = f"""---
-title: {title}
-category: {category}
-tags:
-{tags_yaml}
-created: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
----
+        topic_clusters = get_topic_clusters()
+        if topic_clusters is None:
+            return None
+        match = topic_clusters.assign(get_semantic_index().embedder.embed(content))
+        if match is None:
+            return None
+        return f"トピック{match.cluster}: {', '.join(match.titles)}"
+    except Exception as e:
+        logger.warning(f"トピック推定エラー: {e}")
+        return None
 
-# {title}
+def register_notes(file_paths: list):
+    """保存したノートを、次の関連ノート検索ですぐに見つかるよう索引へ登録"""
+    note_index = get_note_index()
+    semantic_index = get_semantic_index()
+    link_graph = get_link_graph()
+    for file_path in file_paths:
+        note_index.add_file(file_path)
+        if semantic_index:
+            semantic_index.add_file(file_path)
+        if link_graph:
+            link_graph.add_file(file_path)
 
-{formatted_content}
-"""
-        
-        # ファイルに書き込み
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(file_content)
-        
-        logger.info(f"ファイル作成成功: {file_path}")
-        return file_path
+def create_note_writer(formatter: Optional[ContentFormatter] = None):
+    """Vaultへのノートの書き出し（保存したノートは索引へ登録）"""
+    from app_settings import get_vault_path, load_config
+    from note_writer import VaultWriter
+    return VaultWriter.from_config(get_vault_path(), FOLDER_MAP, load_config(),
+                                   formatter=formatter, on_written=register_notes)
+
+# ノートの書き出し（プロセス内で使い回す）
+_note_writer = None
+
+def create_obsidian_file(content: str, analysis_result: dict,
+                         formatter: Optional[ContentFormatter] = None) -> str:
+    """Obsidianファイルを作成（一時ファイルに書いてから重複しない名前を付ける）"""
+    global _note_writer
+    
+    try:
+        if _note_writer is None:
+            _note_writer = create_note_writer()
+        return _note_writer.write(content, analysis_result, formatter=formatter)
         
     except Exception as e:
         logger.error(f"ファイル作成エラー: {e}")
         return ""
 
-def calculate_relevance_score(content: str, file_title: str, file_tags: list) -> int:
-    """関連度スコアを計算（1-3星）"""
-    score = 0
-    content_lower = content.lower()
-    title_lower = file_title.lower()
-    
-    # タイトルキーワードマッチング
-    content_words = set(content_lower.split())
-    title_words = set(title_lower.split())
-    common_words = content_words.intersection(title_words)
-    
-    # スコア計算
-    if len(common_words) >= 3:
-        score = 3  # 高関連度
-    elif len(common_words) >= 2:
-        score = 2  # 中関連度
-    elif len(common_words) >= 1:
-        score = 1  # 低関連度
-    
-    # タグによる関連度アップ
-    if file_tags:
-        for tag in file_tags:
-            if tag.lower() in content_lower:
-                score = min(3, score + 1)
-                break
-    
-    return max(1, min(3, score))  # 1-3の範囲に制限
-
-def find_related_files(content: str, category: str) -> str:
-    """関連ファイルを検索（関連度星印付き）"""
+def index_refresh_jobs(analyzer=None) -> list:
+    """常駐サーバーが起動時と一定間隔ごとに裏で実行する索引の作成・更新
+    
+    analyzer を渡すと、その分析エンジンが使う既存タグの使用頻度も更新する
+    """
+    def refresh_semantic_index():
+        # 意味検索が有効なら、変更されたノートのベクトル化と近似最近傍索引の学習も裏で行う
+        semantic_index = get_semantic_index()
+        if semantic_index:
+            semantic_index.refresh()
+    
+    def refresh_link_graph():
+        # リンクを読み直し、グラフが変わっていれば中心性・コミュニティを計算し直す
+        link_graph = get_link_graph()
+        if link_graph:
+            link_graph.scores()
+    
+    jobs = [
+        ('ノート索引', lambda: get_note_index().refresh()),
+        ('ベクトル索引', refresh_semantic_index),
+        ('リンクグラフ', refresh_link_graph),
+    ]
+    if analyzer is not None:
+        jobs.append(('タグ頻度', analyzer.tag_analyzer.refresh_existing_tag_frequency))
+    return jobs
+
+def find_related_files(content: str, category: str, keywords: Optional[list] = None) -> str:
+    """関連ファイルを検索（関連度星印付き）
+    
+    Vaultの全文索引から、メモ内容と分析結果のキーワードに関連するノートをカテゴリを問わず上位から返す
+    （semantic_search が有効なら意味検索の結果と順位を統合し、network_analysis が有効なら
+    リンクグラフの中心性で並べ替える）。索引は常駐サーバーが裏で作成・更新し、ここでは作成済みの
+    索引を引くだけにする（未作成なら「関連ファイルなし」）
+    """
     try:
-        # Obsidianの02_Inboxディレクトリを検索
-        obsidian_base = "/Users/yoshiikatsuhiko/Library/Mobile Documents/iCloud~md~obsidian/Documents"
-        folder_map = {
-            'consulting': 'Consulting',
-            'tech': 'Tech', 
-            'education': 'Education',
-            'kindle': 'kindle',
-            'music': 'Music',
-            'media': 'Media',
-            'others': 'Others'
-        }
+        from app_settings import load_config
+        from note_index import fuse_related, relevance_stars
         
-        # 同カテゴリのフォルダを検索
-        target_folder = folder_map.get(category, 'Others')
-        search_path = os.path.join(obsidian_base, "02_Inbox", target_folder)
+        limit = (load_config().get('note_index', {}) or {}).get('top_k', 3)
+        # リンクグラフで並べ替える場合は多めに候補を取る
+        link_graph = get_link_graph()
+        candidates = limit * 3 if link_graph else limit
+        related = get_note_index().find_related(content, keywords or [], limit=candidates)
         
-        if not os.path.exists(search_path):
+        # 意味検索が有効なら、語が一致しなくても内容の近いノートを順位統合で加える
+        semantic_index = get_semantic_index()
+        if semantic_index:
+            related = fuse_related(related, semantic_index.search(content, top_k=candidates), limit=candidates)
+        if link_graph:
+            related = link_graph.rerank(related, limit=limit)
+        related = related[:limit]
+        if not related:
             return "関連ファイルなし"
         
-        # 最近の3件のファイルを取得してタイトル・タグを分析
-        files = []
-        for file in os.listdir(search_path):
-            if file.endswith('.md') and not file.startswith('.'):
-                file_path = os.path.join(search_path, file)
-                file_title = file.replace('.md', '')
-                
-                # ファイルのYAMLフロントマターからタグを抽出
-                file_tags = []
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        file_content = f.read()
-                        if file_content.startswith('---'):
-                            yaml_end = file_content.find('---', 3)
-                            if yaml_end > 0:
-                                yaml_content = file_content[3:yaml_end]
-                                for line in yaml_content.split('\n'):
-                                    if line.strip().startswith('- '):
-                                        file_tags.append(line.strip()[2:])
-                except:
-                    pass
-                
-                # 関連度スコアを計算
-                relevance_score = calculate_relevance_score(content, file_title, file_tags)
-                star_rating = "★" * relevance_score
-                
-                files.append((file_title, os.path.getmtime(file_path), star_rating))
-        
-        # 時系列でソートして最新3件
-        files.sort(key=lambda x: x[1], reverse=True)
-        recent_files = [(f[0], f[2]) for f in files[:3]]
-        
-        if recent_files:
-            file_list = [f"{title} {stars}" for title, stars in recent_files[:2]]
-            return f"同カテゴリ最新: {', '.join(file_list)}"
-        else:
-            return "関連ファイルなし"
+        file_list = [f"{note.title} {relevance_stars(note.relevance)}" for note in related]
+        return f"関連: {', '.join(file_list)}"
             
     except Exception as e:
+        logger.warning(f"関連ファイル検索エラー: {e}")
         return "関連ファイルなし"
 
-def main():
-    """メイン処理"""
-    
-    if len(sys.argv) < 3:
-        print("ERROR: 引数が不足しています")
-        print("使用方法: python universal_analysis.py [preview|save] [メモ内容] [API_KEY(optional)]")
-        sys.exit(1)
-    
-    mode = sys.argv[1]
-    content = sys.argv[2]
-    
+def load_api_key():
+    """API keyを読み込んで環境変数に設定"""
     # 抜本的解決：API keyを直接インポート
     try:
         from api_config import get_api_key
@@ -201,70 +243,509 @@ def main():
     except ImportError as e:
         logger.error(f"Failed to import API config: {e}")
         raise Exception("API設定ファイルが見つかりません")
+
+def create_analyzer():
+    """分析エンジンを生成（google.generativeai は初回のAPI呼び出しまで読み込まない）"""
+    from universal_analyzer import UniversalAnalyzer
+    analyzer = UniversalAnalyzer()
+    startup_profile.mark('analyzer_init')
+    return analyzer
+
+def run_mode(mode: str, content: str, analyzer=None,
+             formatter: Optional[ContentFormatter] = None,
+             preview_store: Optional[PreviewStore] = None,
+             deadline_seconds: Optional[float] = None,
+             emit: Optional[Callable[[str], None]] = None) -> Tuple[str, int]:
+    """preview/save を実行し、出力テキストと終了コードを返す
+    
+    emit を渡すとプレビューをストリーミングで分析し、確定した行から emit に渡す
+    （emit 済みの行は戻り値に含めない）
+    """
+    
+    if mode not in ("preview", "save"):
+        return f"ERROR: 不明なモード: {mode}", 1
     
     if not content.strip():
-        print("ERROR: メモ内容が空です")
-        sys.exit(1)
+        return "ERROR: メモ内容が空です", 1
+    
+    lines = []
     
-    # カテゴリリスト
-    categories = ['consulting', 'tech', 'education', 'kindle', 'music', 'media', 'others']
+    def out(line: str):
+        if emit:
+            emit(line)
+        else:
+            lines.append(line)
+    
+    # ストリーミング時はタイトル・カテゴリを確定した時点で出力
+    shown = set()
+    on_field = None
+    if mode == "preview" and emit:
+        out("RESULT_START")
+        
+        def on_field(key: str, value):
+            if key in shown:
+                return
+            shown.add(key)
+            if key == 'title':
+                out(f"TITLE:{value}")
+            else:
+                out(f"CATEGORY:{value}")
+                out(f"FOLDER:{FOLDER_MAP.get(value, 'Others')}")
     
     try:
-        # 普遍的分析実行
-        analyzer = UniversalAnalyzer()
-        analysis_result = analyzer.analyze(content, categories)
+        preview_store = preview_store or PreviewStore()
+        
+        # 保存時はプレビューで承認された結果をそのまま使う（モデル呼び出しなし）
+        analysis_result = preview_store.load(content) if mode == "save" else None
+        
+        if analysis_result is None:
+            # 普遍的分析実行
+            analyzer = analyzer or create_analyzer()
+            analysis_result = analyzer.analyze(content, CATEGORIES, deadline_seconds=deadline_seconds,
+                                               on_field=on_field)
+        else:
+            logger.info("プレビュー時の分析結果を再利用")
         
         if not analysis_result.get('success'):
-            print("ERROR: 分析に失敗しました")
-            sys.exit(1)
+            return "ERROR: 分析に失敗しました", 1
         
         result = analysis_result.get('result', {})
         
         if mode == "preview":
-            # プレビュー結果を出力
-            print("RESULT_START")
-            print(f"TITLE:{result.get('title', 'メモ')}")
-            print(f"CATEGORY:{result.get('category', 'others')}")
+            preview_store.save(content, analysis_result)
             
-            # フォルダ名（02_Inbox配下）
-            folder_map = {
-                'consulting': 'Consulting',
-                'tech': 'Tech',
-                'education': 'Education', 
-                'kindle': 'kindle',  # 既存フォルダは小文字
-                'music': 'Music',
-                'media': 'Media',
-                'others': 'Others'
-            }
-            folder = folder_map.get(result.get('category', 'others'), 'Others')
-            print(f"FOLDER:{folder}")
+            # プレビュー結果を出力
+            if not emit:
+                out("RESULT_START")
+            if 'title' not in shown:
+                out(f"TITLE:{result.get('title', 'メモ')}")
+            if 'category' not in shown:
+                out(f"CATEGORY:{result.get('category', 'others')}")
+                
+                # フォルダ名（02_Inbox配下）
+                folder = FOLDER_MAP.get(result.get('category', 'others'), 'Others')
+                out(f"FOLDER:{folder}")
             
             # タグ
             tags = result.get('tags', ['メモ'])
-            print(f"TAGS:{' '.join(tags)}")
+            out(f"TAGS:{' '.join(tags)}")
             
             # 関連ファイル検索（簡易版）
-            related_files = find_related_files(content, result.get('category', 'others'))
-            print(f"RELATIONS:{related_files}")
-            print("RESULT_END")
-            
-        elif mode == "save":
-            # ファイル保存
-            file_path = create_obsidian_file(content, analysis_result)
-            if file_path:
-                print("SUCCESS")
-            else:
-                print("ERROR: ファイル保存に失敗しました")
-                sys.exit(1)
+            related_files = find_related_files(content, result.get('category', 'others'),
+                                               keywords=result.get('tags', []) + result.get('keywords', []))
+            out(f"RELATIONS:{related_files}")
+            topic = suggest_topic(content)
+            if topic:
+                out(f"CLUSTER:{topic}")
+            out("RESULT_END")
+            return "\n".join(lines), 0
         
-        else:
-            print(f"ERROR: 不明なモード: {mode}")
-            sys.exit(1)
+        # ファイル保存
+        file_path = create_obsidian_file(content, analysis_result, formatter=formatter)
+        if file_path:
+            preview_store.discard(content)
+            return "SUCCESS", 0
+        return "ERROR: ファイル保存に失敗しました", 1
             
     except Exception as e:
         logger.error(f"メイン処理エラー: {e}")
-        print(f"ERROR: {e}")
+        return f"ERROR: {e}", 1
+
+def serve_command(args):
+    """分析エンジンを常駐させてリクエストを待ち受ける"""
+    from analysis_server import create_server, serve
+    from index_refresher import IndexRefresher
+    
+    # 温める前にソケットを待ち受け、その間に届いたリクエストが別のサーバーを起動しないようにする
+    try:
+        server = create_server(socket_path=args.socket, idle_timeout=args.idle_timeout)
+    except RuntimeError as e:
+        logger.info(str(e))
+        return 0
+    
+    load_api_key()
+    
+    # クライアント・タグ統計・フォーマッターを起動時に温めておく（届いたリクエストは温め終わるまで待つ）
+    analyzer = create_analyzer()
+    analyzer.tag_analyzer.get_existing_tag_frequency()
+    formatter = ContentFormatter()
+    
+    # Vaultの索引とタグ統計は起動時と一定間隔ごとに裏で作成・更新する（プレビューは待たない）
+    refresher = IndexRefresher(index_refresh_jobs(analyzer))
+    refresher.start()
+    preview_store = PreviewStore()
+    
+    def handle(mode: str, content: str, options: dict, emit: Callable[[str], None]) -> Tuple[str, int]:
+        return run_mode(mode, content, analyzer=analyzer, formatter=formatter,
+                        preview_store=preview_store, deadline_seconds=options.get('deadline'),
+                        emit=emit if options.get('stream') else None)
+    
+    try:
+        serve(server, handle)
+    finally:
+        refresher.stop()
+    return 0
+
+def print_line(line: str):
+    """1行をすぐに出力（ストリーミング時に呼び出し元へ逐次届ける）"""
+    print(line, flush=True)
+    startup_profile.mark('first_output')
+
+def print_result(output: str, exit_code: int) -> int:
+    """残りの出力を表示して終了コードを返す"""
+    if output:
+        print(output)
+        startup_profile.mark('first_output')
+    return exit_code
+
+def client_command(args):
+    """常駐サーバーに処理を依頼（未起動ならその場で処理し、次回用にサーバーを起動）"""
+    from analysis_server import send_request, spawn_server
+    
+    request = {'mode': args.mode, 'content': args.content, 'deadline': args.deadline, 'stream': args.stream}
+    try:
+        response = send_request(request, socket_path=args.socket, on_line=print_line)
+    except ConnectionError as e:
+        # 途中出力を表示済み・保存済みの可能性があるため、プロセス内でやり直さない
+        logger.error(str(e))
+        return print_result(f"ERROR: {e}", 1)
+    if response is not None:
+        return print_result(response.get('output', ''), response.get('exit_code', 1))
+    
+    logger.info("分析サーバーに接続できないため、プロセス内で処理します")
+    if not args.no_spawn:
+        spawn_server(os.path.abspath(__file__), socket_path=args.socket)
+    
+    load_api_key()
+    output, exit_code = run_mode(args.mode, args.content, deadline_seconds=args.deadline,
+                                 emit=print_line if args.stream else None)
+    return print_result(output, exit_code)
+
+def local_command(args):
+    """プロセス内で preview/save を実行"""
+    load_api_key()
+    output, exit_code = run_mode(args.command, args.content, deadline_seconds=args.deadline,
+                                 emit=print_line if args.stream else None)
+    return print_result(output, exit_code)
+
+def batch_command(args):
+    """ディレクトリ/JSONLのメモを並行して分析・保存"""
+    from batch_runner import run_batch
+    
+    load_api_key()
+    analyzer = create_analyzer()
+    formatter = ContentFormatter()
+    
+    # ノートは書き出し用のスレッドがまとめて保存する
+    with create_note_writer(formatter) as writer:
+        summary = run_batch(
+            args.source, analyzer, CATEGORIES,
+            write_note=None if args.dry_run else writer.submit,
+            output_path=args.output,
+            concurrency=args.concurrency,
+            packed=args.packed,
+        )
+    return 1 if summary['error'] else 0
+
+def import_highlights_command(args):
+    """Kindleの My Clippings.txt / Readwise の書き出しを本ごとのメモにして一括保存"""
+    from highlight_import import import_highlights
+    
+    load_api_key()
+    analyzer = create_analyzer()
+    formatter = ContentFormatter()
+    
+    output = open(args.output, 'a', encoding='utf-8') if args.output else None
+    try:
+        with create_note_writer(formatter) as writer:
+            summary = import_highlights(
+                args.source, analyzer, CATEGORIES,
+                write_note=None if args.dry_run else writer.submit,
+                source_format=args.format,
+                group=args.group,
+                concurrency=args.concurrency,
+                out=output,
+            )
+    finally:
+        if output:
+            output.close()
+    return 1 if summary['error'] else 0
+
+def cache_stats_command(args):
+    """応答キャッシュの統計を表示"""
+    import json
+    from app_settings import load_config
+    from response_cache import ResponseCache
+    
+    cache = ResponseCache.from_config(load_config())
+    if cache is None:
+        print("応答キャッシュは無効です（config.yaml の response_cache.enable）")
+        return 0
+    
+    print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    return 0
+
+def metrics_command(args):
+    """プロンプト版ごとのトークン使用量を表示"""
+    import json
+    from token_meter import TokenMeter
+    
+    print(json.dumps(TokenMeter().stats(), ensure_ascii=False, indent=2))
+    return 0
+
+def related_command(args):
+    """メモ内容に関連するVaultのノートを表示（--recent で直近 time_window_days 日に限る）"""
+    import json
+    
+    note_index = get_note_index()
+    note_index.refresh()
+    related = note_index.find_related(args.query, limit=args.top_k, within_window=args.recent)
+    print(json.dumps([note._asdict() for note in related], ensure_ascii=False, indent=2))
+    return 0
+
+def semantic_search_command(args):
+    """メモ内容に意味的に近いVaultのノートを表示"""
+    import json
+    
+    semantic_index = get_semantic_index()
+    if semantic_index is None:
+        print("ERROR: config.yaml の semantic_search.enable が false です")
+        return 1
+    
+    semantic_index.refresh()
+    hits = semantic_index.search(args.query, top_k=args.top_k)
+    print(json.dumps([hit._asdict() for hit in hits], ensure_ascii=False, indent=2))
+    return 0
+
+def ann_bench_command(args):
+    """近似最近傍索引の nprobe ごとの再現率と応答時間を全件検索と比較"""
+    import json
+    from ivf_index import benchmark
+    
+    semantic_index = get_semantic_index()
+    if semantic_index is None:
+        print("ERROR: config.yaml の semantic_search.enable が false です")
+        return 1
+    
+    semantic_index.refresh(force=True)
+    nprobes = [int(value) for value in args.nprobe.split(',')]
+    report = benchmark(semantic_index.ann, queries=args.queries, top_k=args.top_k, nprobes=nprobes)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+def graph_stats_command(args):
+    """リンクグラフのノート数・コミュニティ数と、中心性の上位ノートを表示"""
+    import json
+    
+    link_graph = get_link_graph()
+    if link_graph is None:
+        print("ERROR: config.yaml の network_analysis.enable が false です")
+        return 1
+    
+    link_graph.refresh(force=True)
+    print(json.dumps(link_graph.summary(top=args.top), ensure_ascii=False, indent=2))
+    return 0
+
+def cluster_command(args):
+    """Vaultのノートをトピッククラスタにまとめる（--assign でメモの所属クラスタを表示）"""
+    import json
+    
+    topic_clusters = get_topic_clusters()
+    if topic_clusters is None:
+        print("ERROR: config.yaml の topic_clustering.enable または semantic_search.enable が false です")
+        return 1
+    
+    if args.assign:
+        match = topic_clusters.assign(get_semantic_index().embedder.embed(args.assign))
+        print(json.dumps(match._asdict() if match else None, ensure_ascii=False, indent=2))
+        return 0
+    
+    get_semantic_index().refresh(force=True)
+    print(json.dumps(topic_clusters.run(), ensure_ascii=False, indent=2))
+    return 0
+
+def classifier_command(args):
+    """ローカル分類器を学習し直す（--report でAPI迂回率とGeminiとの一致率を表示）"""
+    import json
+    from app_settings import get_vault_path, load_config
+    from local_classifier import LocalClassifier
+    
+    classifier = LocalClassifier.from_config(load_config())
+    if classifier is None:
+        print("ERROR: config.yaml の local_classifier.enable が false です")
+        return 1
+    
+    if args.report:
+        print(json.dumps(classifier.report(), ensure_ascii=False, indent=2))
+        return 0
+    
+    report = classifier.train(get_vault_path(), {category: folder for category, folder in FOLDER_MAP.items()
+                                                 if category in CATEGORIES})
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if 'cross_validation' in report else 1
+
+def prompt_bench_command(args):
+    """固定のメモ集合でプロンプト版を比較"""
+    import json
+    from prompt_bench import run_prompt_bench
+    
+    if args.live:
+        load_api_key()
+    report = run_prompt_bench(args.source, CATEGORIES, args.variants.split(','),
+                              live=args.live, limit=args.limit)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+# メモ内容を取るコマンドと、サブコマンド名から数えたメモ内容の位置
+CONTENT_POSITIONS = {'preview': 1, 'save': 1, 'client': 2}
+
+# メモ内容を取るコマンドのオプション名（build_parser で登録）
+_content_options = {}
+
+def build_parser() -> argparse.ArgumentParser:
+    """コマンドライン引数の定義"""
+    parser = argparse.ArgumentParser(
+        description="普遍的メモ分析システム",
+        usage="python universal_analysis.py [--startup-profile] [preview|save|serve|client] ..."
+    )
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="インポート・初期化・初回出力までの時間を標準エラーに出力")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    for mode in ("preview", "save"):
+        sub = subparsers.add_parser(mode)
+        sub.add_argument('content', help="メモ内容")
+        sub.add_argument('api_key', nargs='?', help="未使用（互換性のため）")
+        sub.add_argument('--deadline', type=float, help="API応答を待つ最大秒数（既定は config.yaml）")
+        sub.add_argument('--stream', action='store_true',
+                         help="ストリーミングで分析し、タイトル・カテゴリが確定した時点で出力")
+        sub.set_defaults(func=local_command)
+        _content_options[mode] = {option for action in sub._actions for option in action.option_strings}
+    
+    serve_parser = subparsers.add_parser('serve', help="分析サーバーを常駐起動")
+    serve_parser.add_argument('--socket', help="Unixソケットのパス")
+    serve_parser.add_argument('--idle-timeout', type=float, default=0,
+                              help="無操作でサーバーを終了するまでの秒数（0で無期限）")
+    serve_parser.set_defaults(func=serve_command)
+    
+    client_parser = subparsers.add_parser('client', help="常駐サーバー経由で preview/save を実行")
+    client_parser.add_argument('mode', choices=["preview", "save"])
+    client_parser.add_argument('content', help="メモ内容")
+    client_parser.add_argument('--socket', help="Unixソケットのパス")
+    client_parser.add_argument('--deadline', type=float, help="API応答を待つ最大秒数（既定は config.yaml）")
+    client_parser.add_argument('--stream', action='store_true',
+                               help="ストリーミングで分析し、タイトル・カテゴリが確定した時点で出力")
+    client_parser.add_argument('--no-spawn', action='store_true',
+                               help="サーバー未起動時にバックグラウンド起動しない")
+    client_parser.set_defaults(func=client_command)
+    _content_options['client'] = {option for action in client_parser._actions for option in action.option_strings}
+    
+    batch_parser = subparsers.add_parser('batch', help="大量のメモを並行して分析・保存")
+    batch_parser.add_argument('source', help="テキストファイルのディレクトリ、またはJSONLファイル（id, content）")
+    batch_parser.add_argument('--output', help="結果JSONLの出力先（指定時は追記し、中断後に再開可能）")
+    batch_parser.add_argument('--concurrency', type=int, default=4, help="同時に実行するAPIリクエスト数")
+    batch_parser.add_argument('--packed', action='store_true',
+                              help="短いメモを複数まとめて1リクエストで分析")
+    batch_parser.add_argument('--dry-run', action='store_true', help="分析のみ行い、ファイルを保存しない")
+    batch_parser.set_defaults(func=batch_command)
+    
+    import_parser = subparsers.add_parser('import-highlights',
+                                          help="Kindle・Readwiseのハイライトをメモとして一括保存")
+    import_parser.add_argument('source', help="My Clippings.txt、またはReadwiseのCSV/JSON書き出し")
+    import_parser.add_argument('--format', default='auto',
+                               choices=['auto', 'kindle', 'readwise-csv', 'readwise-json'],
+                               help="書き出し形式（既定は拡張子から判定）")
+    import_parser.add_argument('--group', default='book', choices=['book', 'highlight'],
+                               help="本ごとにまとめるか、ハイライトごとに1メモにするか")
+    import_parser.add_argument('--output', help="結果JSONLの出力先（追記）")
+    import_parser.add_argument('--concurrency', type=int, default=4, help="同時に実行するAPIリクエスト数")
+    import_parser.add_argument('--dry-run', action='store_true',
+                               help="分析のみ行い、ファイルを保存せず取り込み済みにもしない")
+    import_parser.set_defaults(func=import_highlights_command)
+    
+    stats_parser = subparsers.add_parser('cache-stats', help="応答キャッシュの統計を表示")
+    stats_parser.set_defaults(func=cache_stats_command)
+    
+    metrics_parser = subparsers.add_parser('metrics', help="プロンプト版ごとのトークン使用量を表示")
+    metrics_parser.set_defaults(func=metrics_command)
+    
+    bench_parser = subparsers.add_parser('prompt-bench', help="固定のメモ集合でプロンプト版を比較")
+    bench_parser.add_argument('source', help="テキストファイルのディレクトリ、またはJSONLファイル（id, content）")
+    bench_parser.add_argument('--variants', default='v1,v2', help="比較するプロンプト版（カンマ区切り）")
+    bench_parser.add_argument('--live', action='store_true',
+                              help="実際にAPIを呼び、応答時間・トークン数・分類の一致率を比較")
+    bench_parser.add_argument('--limit', type=int, help="使用するメモの最大件数")
+    bench_parser.set_defaults(func=prompt_bench_command)
+    
+    related_parser = subparsers.add_parser('related', help="関連するVaultのノートを検索（BM25・日付による減衰）")
+    related_parser.add_argument('query', help="検索するメモ内容")
+    related_parser.add_argument('--top-k', type=int, default=10, help="表示する件数")
+    related_parser.add_argument('--recent', action='store_true',
+                                help="temporal_analysis.time_window_days 日以内のノートに限る")
+    related_parser.set_defaults(func=related_command)
+    
+    semantic_parser = subparsers.add_parser('semantic-search', help="意味的に近いVaultのノートを検索")
+    semantic_parser.add_argument('query', help="検索するメモ内容")
+    semantic_parser.add_argument('--top-k', type=int, default=10, help="表示する件数")
+    semantic_parser.set_defaults(func=semantic_search_command)
+    
+    ann_parser = subparsers.add_parser('ann-bench', help="近似最近傍索引の再現率と応答時間を全件検索と比較")
+    ann_parser.add_argument('--queries', type=int, default=100, help="登録済みノートから抽出するクエリ数")
+    ann_parser.add_argument('--top-k', type=int, default=10, help="再現率を測る上位件数")
+    ann_parser.add_argument('--nprobe', default='1,2,4,8,16', help="比較する探索リスト数（カンマ区切り）")
+    ann_parser.set_defaults(func=ann_bench_command)
+    
+    graph_parser = subparsers.add_parser('graph-stats', help="リンクグラフの中心性とコミュニティを表示")
+    graph_parser.add_argument('--top', type=int, default=10, help="中心性ごとに表示するノート数")
+    graph_parser.set_defaults(func=graph_stats_command)
+    
+    cluster_parser = subparsers.add_parser('cluster', help="Vaultのノートをトピッククラスタにまとめる")
+    cluster_parser.add_argument('--assign', metavar='CONTENT',
+                                help="クラスタを作り直さず、メモが属するクラスタを表示")
+    cluster_parser.set_defaults(func=cluster_command)
+    
+    classifier_parser = subparsers.add_parser(
+        'classifier', help="Vaultのカテゴリ別フォルダでローカル分類器を学習し直す")
+    classifier_parser.add_argument('--report', action='store_true',
+                                   help="学習せず、API迂回率とGeminiとの一致率を表示")
+    classifier_parser.set_defaults(func=classifier_command)
+    
+    return parser
+
+def parse_args(parser: argparse.ArgumentParser, argv: list) -> argparse.Namespace:
+    """引数を解析（「-メモ」のように '-' で始まる1語のメモも、メモ内容の位置にあれば内容として扱う）
+    
+    argparse はオプションと区別できないため、その位置だけ置き換えて解析し、後から戻す
+    """
+    index = 0
+    while index < len(argv) and argv[index] == '--startup-profile':
+        index += 1
+    if index < len(argv) and argv[index] in CONTENT_POSITIONS:
+        position = index + CONTENT_POSITIONS[argv[index]]
+        options = _content_options[argv[index]]
+        if (position < len(argv) and argv[position].startswith('-') and argv[position] != '--'
+                and argv[position].split('=', 1)[0] not in options):
+            content = argv[position]
+            args = parser.parse_args(argv[:position] + ['_'] + argv[position + 1:])
+            args.content = content
+            return args
+    return parser.parse_args(argv)
+
+def main():
+    """メイン処理"""
+    
+    parser = build_parser()
+    args = parse_args(parser, sys.argv[1:])
+    
+    if not getattr(args, 'func', None):
+        print("ERROR: 引数が不足しています")
+        print("使用方法: python universal_analysis.py [preview|save] [メモ内容] [API_KEY(optional)]")
         sys.exit(1)
+    
+    exit_code = args.func(args)
+    if args.startup_profile:
+        print(startup_profile.report(), file=sys.stderr)
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -8,13 +8,22 @@
 import os
 import re
 import json
-from typing import Dict, List, Optional
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 import logging
 
+from app_settings import load_config
 from gemini_client import GeminiClient
+from keyword_classifier import KeywordClassifier
+from long_memo import LongMemoAnalyzer
+from resilience import CircuitOpenError
 from tag_analyzer import TagAnalyzer
 
+# 分析結果として受け付けるカテゴリ
+KNOWN_CATEGORIES = ['consulting', 'tech', 'education', 'kindle', 'music', 'media', 'others']
+
 class UniversalAnalyzer:
     """普遍的メモ分析システム - ジャンルに依存しない分析"""
     
@@ -23,63 +32,198 @@ class UniversalAnalyzer:
         config_path = os.path.join(script_dir, 'config.yaml')
         
         self.gemini = GeminiClient(config_path=config_path)
-        self.tag_analyzer = TagAnalyzer()
         self.logger = logging.getLogger(__name__)
         
-    def analyze(self, content: str, categories: List[str]) -> Dict:
-        """コンテンツを普遍的に分析してタイトル・カテゴリ・タグを生成"""
+        config = load_config(config_path)
+        
+        # 既存タグの使用頻度は note_index.refresh_interval_seconds ごとに読み直す
+        self.tag_analyzer = TagAnalyzer.from_config(config)
+        
+        # API呼び出しに使える時間の既定値（秒）
+        resilience_settings = config.get('resilience', {}) or {}
+        self.deadline_seconds = resilience_settings.get('deadline_seconds', 20)
+        
+        # トークン予算を超える長いメモは分割して並行分析
+        self.long_memo = LongMemoAnalyzer.from_config(self.gemini, config)
+        
+        # 構造分析（フォールバック）のキーワード分類
+        self.keywords = KeywordClassifier.from_config(config)
+        
+        # 確信度の高いメモはVaultで学習したローカル分類器で分類し、APIを呼ばない（NumPyは学習済みモデルで分類するときだけ読み込む）
+        self.local_classifier = None
+        if (config.get('local_classifier', {}) or {}).get('enable', False):
+            from local_classifier import LocalClassifier
+            self.local_classifier = LocalClassifier.from_config(config)
+        
+    def analyze(self, content: str, categories: List[str], deadline_seconds: Optional[float] = None,
+                on_field: Optional[Callable[[str, object], None]] = None) -> Dict:
+        """コンテンツを普遍的に分析してタイトル・カテゴリ・タグを生成
+        
+        deadline_seconds 以内にAPIが応答しなければ構造的フォールバックを返す
+        on_field を渡すとストリーミングで分析し、検証を通るタイトル・カテゴリを確定した時点で通知する
+        長いメモは分割して並行分析する（ストリーミングは行わない）
+        ローカル分類器の確信度が閾値以上のメモはAPIを呼ばずに分類する
+        """
         
         # GeminiClient.analyze_memo()を使用するため、独自プロンプトは不要
         
+        local = self._predict_locally(content)
+        if local and self.local_classifier.should_bypass(local) and local.category in categories:
+            self.local_classifier.record(local, bypassed=True)
+            return self._local_result(content, local)
+        
+        is_long = self.long_memo.is_long(content)
+        if deadline_seconds is not None:
+            budget = deadline_seconds
+        else:
+            budget = self.long_memo.deadline_seconds if is_long else self.deadline_seconds
+        deadline = time.monotonic() + budget if budget else None
+        
         try:
-            # GeminiClient.analyze_memo()を使用（修正されたプロンプト適用）
-            result = self.gemini.analyze_memo(content, categories)
+            if is_long:
+                result = self.long_memo.analyze(content, categories, deadline=deadline)
+            elif on_field:
+                def forward(key: str, value):
+                    # 後段の検証で差し替えられる値は通知しない
+                    if key == 'title' and isinstance(value, str) and 3 <= len(value) <= 30:
+                        on_field(key, value)
+                    elif key == 'category' and value in KNOWN_CATEGORIES:
+                        on_field(key, value)
+                
+                result = self.gemini.analyze_memo_stream(content, categories, on_field=forward, deadline=deadline)
+            else:
+                # GeminiClient.analyze_memo()を使用（修正されたプロンプト適用）
+                result = self.gemini.analyze_memo(content, categories, deadline=deadline)
             
             if result:
                 # 結果の検証と補完
                 result = self._validate_and_enhance(result, content)
+                if local:
+                    self.local_classifier.record(local, bypassed=False, gemini_category=result['category'])
+                return self._build_result(result)
                 
-                return {
-                    'success': True,
-                    'result': {
-                        'title': result.get('title', '分析メモ'),
-                        'category': result.get('category', 'others'),
-                        'tags': result.get('tags', ['メモ']),
-                        'meta': {
-                            'document_type': result.get('document_type', '不明'),
-                            'main_action': result.get('main_action', '記録'),
-                            'target_domain': result.get('target_domain', '一般'),
-                            'confidence': result.get('confidence', 0.7)
-                        }
-                    },
-                    'confidence': result.get('confidence', 0.7),
-                    'model': 'universal-analyzer'
-                }
-                
+        except CircuitOpenError as e:
+            self.logger.warning(f"構造分析に切り替え: {e}")
         except Exception as e:
             self.logger.error(f"普遍的分析エラー: {e}")
             
         # フォールバック：基本的な構造分析
         return self._structural_fallback(content, categories)
     
+    def analyze_many(self, memos: List[Tuple[str, str]], categories: List[str]) -> Dict[str, Dict]:
+        """短いメモをまとめて分析し、{id: 分析結果} を返す（一括プロンプトを使用）"""
+        
+        # 長いメモは一括プロンプトに入れず、分割して個別に分析
+        results = {memo_id: self.analyze(content, categories)
+                   for memo_id, content in memos if self.long_memo.is_long(content)}
+        
+        # ローカル分類器で確信を持って分類できるメモも一括プロンプトに入れない
+        local_predictions = {}
+        for memo_id, content in memos:
+            if memo_id in results:
+                continue
+            local = self._predict_locally(content)
+            if local and self.local_classifier.should_bypass(local) and local.category in categories:
+                self.local_classifier.record(local, bypassed=True)
+                results[memo_id] = self._local_result(content, local)
+            elif local:
+                local_predictions[memo_id] = local
+        short_memos = [(memo_id, content) for memo_id, content in memos if memo_id not in results]
+        
+        try:
+            raw_results = self.gemini.analyze_memos_packed(short_memos, categories) if short_memos else {}
+        except Exception as e:
+            self.logger.error(f"一括分析エラー: {e}")
+            raw_results = {}
+        
+        for memo_id, content in short_memos:
+            result = raw_results.get(memo_id)
+            if result:
+                result = self._validate_and_enhance(result, content)
+                if memo_id in local_predictions:
+                    self.local_classifier.record(local_predictions[memo_id], bypassed=False,
+                                                 gemini_category=result['category'])
+                results[memo_id] = self._build_result(result)
+            else:
+                results[memo_id] = self._structural_fallback(content, categories)
+        
+        return results
+    
+    def _predict_locally(self, content: str):
+        """ローカル分類器の予測（無効・未学習・エラー時はNone）"""
+        if self.local_classifier is None:
+            return None
+        try:
+            return self.local_classifier.predict(content)
+        except Exception as e:
+            self.logger.warning(f"ローカル分類エラー: {e}")
+            return None
+    
+    def _local_result(self, content: str, prediction) -> Dict:
+        """ローカル分類器のカテゴリに、構造的タイトルと TagAnalyzer のタグを合わせた結果"""
+        
+        tags = self.tag_analyzer.generate_unique_tags(content)
+        return {
+            'success': True,
+            'result': {
+                'title': self._generate_structural_title('', '', '', content),
+                'category': prediction.category,
+                'tags': tags[:5] if tags else ['メモ'],
+                'meta': {
+                    'document_type': 'ローカル分類',
+                    'main_action': '記録',
+                    'target_domain': '一般',
+                    'confidence': round(prediction.confidence, 3)
+                }
+            },
+            'confidence': round(prediction.confidence, 3),
+            'model': 'local-classifier'
+        }
+    
+    def _build_result(self, result: Dict) -> Dict:
+        """検証済みの結果を応答形式に整える"""
+        
+        return {
+            'success': True,
+            'result': {
+                'title': result.get('title', '分析メモ'),
+                'category': result.get('category', 'others'),
+                'tags': result.get('tags', ['メモ']),
+                'keywords': result.get('related_files_keywords', []),
+                'meta': {
+                    'document_type': result.get('document_type', '不明'),
+                    'main_action': result.get('main_action', '記録'),
+                    'target_domain': result.get('target_domain', '一般'),
+                    'confidence': result.get('confidence', 0.7)
+                }
+            },
+            'confidence': result.get('confidence', 0.7),
+            'model': 'universal-analyzer'
+        }
+    
     def _validate_and_enhance(self, result: Dict, content: str) -> Dict:
         """結果の検証と普遍的強化"""
         
+        # キーワードの走査はタイトル・カテゴリの両方で必要になっても1回だけ
+        hits = None
+        
         # タイトルの検証
         title = result.get('title', '')
         if not title or len(title) < 3 or len(title) > 30:
             # 構造的にタイトルを再生成
+            hits = self.keywords.scan(content)
             title = self._generate_structural_title(
                 result.get('document_type', ''), 
                 result.get('target_domain', ''), 
                 result.get('main_action', ''),
-                content
+                content,
+                hits
             )
             result['title'] = title
         
         # カテゴリの検証
-        if result.get('category') not in ['consulting', 'tech', 'education', 'kindle', 'music', 'media', 'others']:
-            result['category'] = self._classify_by_content_structure(content)
+        if result.get('category') not in KNOWN_CATEGORIES:
+            result['category'] = self._classify_by_content_structure(content, hits)
         
         # タグの強化
         if not result.get('tags') or len(result['tags']) < 2:
@@ -87,56 +231,34 @@ class UniversalAnalyzer:
         
         return result
     
-    def _generate_structural_title(self, doc_type: str, domain: str, action: str, content: str) -> str:
-        """構造的タイトル生成 - キーワードに依存しない"""
+    def _generate_structural_title(self, doc_type: str, domain: str, action: str, content: str,
+                                   hits: Optional[Counter] = None) -> str:
+        """構造的タイトル生成 - キーワードに依存しない
+        
+        hits には KeywordClassifier.scan() の結果を渡せる（省略時はここで走査する）
+        """
+        
+        if hits is None:
+            hits = self.keywords.scan(content)
         
         # 内容の長さと複雑さを判定
         word_count = len(content)
-        has_structure = any(marker in content for marker in ['##', '**', '■', '◆', '①', '1.', '・'])
+        has_structure = self.keywords.has_structure(hits)
         
         # 文書種別の判定
         if not doc_type or doc_type == '不明':
-            if '戦略' in content or '計画' in content:
-                doc_type = '戦略'
-            elif '手順' in content or 'ステップ' in content or '方法' in content:
-                doc_type = '手順'
-            elif '分析' in content or '検証' in content or '評価' in content:
-                doc_type = '分析'
-            elif '提案' in content or '案' in content:
-                doc_type = '提案'
-            elif word_count > 1000 and has_structure:
-                doc_type = 'レポート'
-            else:
-                doc_type = 'メモ'
+            doc_type = self.keywords.best('document_types', hits)
+            if not doc_type:
+                doc_type = 'レポート' if word_count > 1000 and has_structure else 'メモ'
         
         # 対象領域の判定
         if not domain or domain == '一般':
-            if any(word in content for word in ['教育', '学習', '授業', '生徒', '指導']):
-                domain = '教育'
-            elif any(word in content for word in ['マーケティング', 'ブランディング', '集客', '営業']):
-                domain = 'マーケティング'
-            elif any(word in content for word in ['コード', 'プログラミング', 'システム', 'AI', 'DX']):
-                domain = '技術'
-            elif any(word in content for word in ['経営', 'ビジネス', '事業', '戦略']):
-                domain = 'ビジネス'
-            else:
-                # 内容から最頻出の名詞を抽出
-                domain = self._extract_main_topic(content)
+            # 該当しなければ内容から最頻出の名詞を抽出
+            domain = self.keywords.best('domains', hits) or self._extract_main_topic(content)
         
         # 動作の判定
         if not action or action == '記録':
-            if '提案' in content or '案' in content:
-                action = '提案'
-            elif '分析' in content or '検証' in content:
-                action = '分析'
-            elif '計画' in content or '戦略' in content:
-                action = '計画'
-            elif '説明' in content or '解説' in content:
-                action = '説明'
-            elif '手順' in content or '方法' in content:
-                action = '手順'
-            else:
-                action = '検討'
+            action = self.keywords.best('actions', hits) or '検討'
         
         # タイトル組み立て
         if domain and action:
@@ -171,61 +293,20 @@ class UniversalAnalyzer:
         
         return '一般'
     
-    def _classify_by_content_structure(self, content: str) -> str:
-        """内容の構造からカテゴリを分類"""
-        
-        content_lower = content.lower()
-        
-        # ビジネス・コンサル要素（最優先）
-        business_keywords = [
-            '戦略', '計画', '提案', 'コンサル', '営業', '売上', '収益', '事業', '経営',
-            'マーケティング', 'ブランディング', '集客', '顧客', 'クライアント',
-            '打ち合わせ', '会議', 'ミーティング', '検討', '分析', '企画'
-        ]
-        
-        # ビジネス要素がある場合は他の要素より優先してconsulting
-        if any(keyword in content for keyword in business_keywords):
-            return 'consulting'
-        
-        # 技術要素
-        tech_keywords = [
-            'プログラミング', 'コード', 'システム', 'アプリ', 'API', 'AI', 'DX',
-            'バイブコーディング', 'リファクタリング', '開発', '実装', 'ファイル'
-        ]
-        
-        if any(keyword in content for keyword in tech_keywords):
-            return 'tech'
-        
-        # 教育要素（ビジネス要素がない場合のみ）
-        education_keywords = ['教育', '学習', '授業', '指導', '生徒', '学校', '塾']
-        
-        if any(keyword in content for keyword in education_keywords):
-            return 'education'
-        
-        # その他の判定
-        if any(keyword in content for keyword in ['本', '書籍', '読書', 'Kindle']):
-            return 'kindle'
-        
-        if any(keyword in content for keyword in ['音楽', '楽器', '演奏', 'ライブ']):
-            return 'music'
-        
-        # メディア・外部発信要素（ビジネス要素がない場合のみ）
-        media_keywords = [
-            'SNS', 'YouTube', 'note', 'ブログ', 'Instagram', 'Twitter', 'TikTok',
-            'コンテンツ制作', '外部発信', 'ニュース', '記事', 'メディア'
-        ]
-        
-        if any(keyword in content for keyword in media_keywords):
-            return 'media'
+    def _classify_by_content_structure(self, content: str, hits: Optional[Counter] = None) -> str:
+        """内容の構造からカテゴリを分類（キーワードの出現を重み付きで合計し、最もスコアの高いカテゴリ）"""
         
-        return 'others'
+        if hits is None:
+            hits = self.keywords.scan(content)
+        return self.keywords.classify(hits)
     
     def _structural_fallback(self, content: str, categories: List[str]) -> Dict:
         """構造的フォールバック処理"""
         
-        # 基本的な構造分析
-        title = self._generate_structural_title('', '', '', content)
-        category = self._classify_by_content_structure(content)
+        # 基本的な構造分析（キーワードの走査は1回）
+        hits = self.keywords.scan(content)
+        title = self._generate_structural_title('', '', '', content, hits)
+        category = self._classify_by_content_structure(content, hits)
         tags = self.tag_analyzer.generate_unique_tags(content)
         
         return {
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vault走査 - ノートの一覧取得とYAMLフロントマターの読み取り
+iCloud Drive上では1ファイルの読み込みが高価なため、フォルダは並行して走査し、
+フロントマターは先頭から区切り行までだけを少しずつ読む
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional, Tuple
+
+# 走査・読み込みに使うスレッド数
+SCAN_WORKERS = 8
+
+# フロントマターを探す読み込み単位と上限（これを超えるヘッダーは無いものとみなす）
+HEADER_CHUNK_SIZE = 4096
+MAX_HEADER_BYTES = 64 * 1024
+
+_OPENING = re.compile(rb'---[ \t]*\r?\n')
+_CLOSING = re.compile(rb'\r?\n---[ \t]*\r?\n')
+_TEXT_CLOSING = re.compile(r'^---[ \t]*\r?\n(.*?)\r?\n---[ \t]*(?:\r?\n|$)', re.DOTALL)
+
+
+def _scan_directory(path: str) -> Tuple[List[Tuple[str, int, int]], List[str]]:
+    """1フォルダ分の (.mdファイルのパス, 更新時刻ns, サイズ) とサブフォルダを返す"""
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith('.md') and entry.is_file():
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_mtime_ns, stat.st_size))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, subdirs
+
+
+def scan_markdown_files(vault_path: str, max_workers: int = SCAN_WORKERS) -> Dict[str, Tuple[int, int]]:
+    """Vault内の .md ファイルの {相対パス: (更新時刻ns, サイズ)}（隠しファイル・フォルダは除く）
+
+    フォルダごとに os.scandir をスレッドプールで並行実行する
+    """
+    files = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_scan_directory, vault_path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, subdirs = future.result()
+                for path, mtime_ns, size in found:
+                    files[os.path.relpath(path, vault_path)] = (mtime_ns, size)
+                pending.update(executor.submit(_scan_directory, subdir) for subdir in subdirs)
+    return files
+
+
+def read_frontmatter(file_path: str, chunk_size: int = HEADER_CHUNK_SIZE,
+                     max_bytes: int = MAX_HEADER_BYTES) -> Optional[str]:
+    """フロントマターの中身だけを読む（閉じ区切りが見つかった時点で読み込みをやめる）
+
+    フロントマターが無い・閉じていない場合はNone
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read(chunk_size)
+        opening = _OPENING.match(data)
+        if not opening:
+            return None
+
+        # 空のフロントマターでも閉じ区切りの直前の改行を見られるようにする
+        search_from = opening.end() - 1
+        while True:
+            closing = _CLOSING.search(data, search_from)
+            if closing:
+                return data[opening.end():closing.start()].decode('utf-8', errors='replace')
+            if len(data) >= max_bytes:
+                return None
+
+            chunk = f.read(chunk_size)
+            if not chunk:
+                # 閉じ区切りの後に改行が無いままファイルが終わっている場合
+                closing = _CLOSING.search(data + b'\n', search_from)
+                if closing:
+                    return data[opening.end():closing.start()].decode('utf-8', errors='replace')
+                return None
+
+            # 区切り行が読み込み単位をまたいでも見つかるよう少し戻って探す
+            search_from = max(search_from, len(data) - 8)
+            data += chunk
+
+
+def split_frontmatter(text: str) -> Tuple[Optional[str], str]:
+    """読み込み済みのノートを (フロントマター, 本文) に分ける"""
+    match = _TEXT_CLOSING.match(text)
+    if not match:
+        return None, text
+    return match.group(1), text[match.end():]
+
+
+def _strip_quotes(value: str) -> str:
+    return value.strip().strip('"\'')
+
+
+def parse_frontmatter(header: Optional[str]) -> Dict[str, object]:
+    """フロントマターの簡易パース（key: value、key: [a, b]、key: の後の「- 項目」リストに対応）"""
+    meta: Dict[str, object] = {}
+    if not header:
+        return meta
+
+    list_key = None
+    for line in header.split('\n'):
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+
+        if list_key and stripped.startswith('-'):
+            item = _strip_quotes(stripped[1:])
+            if item:
+                meta[list_key].append(item)
+            continue
+        list_key = None
+
+        key, separator, value = stripped.partition(':')
+        if not separator:
+            continue
+        key, value = key.strip(), value.strip()
+
+        if not value:
+            meta[key] = []
+            list_key = key
+        elif value.startswith('[') and value.endswith(']'):
+            meta[key] = [_strip_quotes(item) for item in value[1:-1].split(',') if _strip_quotes(item)]
+        else:
+            meta[key] = _strip_quotes(value)
+    return meta
+
+
+def get_tags(meta: Dict[str, object]) -> List[str]:
+    """パース済みフロントマターからタグの一覧（「tags: a, b」の文字列形式も含む）"""
+    tags = meta.get('tags') or []
+    if isinstance(tags, str):
+        tags = [tag.strip() for tag in re.split(r'[,\s]+', tags)]
+    return [tag.lstrip('#') for tag in tags if tag.lstrip('#')]
+
+
+def read_tags(file_path: str) -> List[str]:
+    """ノートのタグ（フロントマターだけを読む）"""
+    return get_tags(parse_frontmatter(read_frontmatter(file_path)))
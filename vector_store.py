@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ベクトルストア - ノートのベクトルをメモリマップしたfloat16行列に保存し、類似ノートを検索
+行番号とノートの対応はSQLiteに持ち、追加・更新・削除は行単位で行う（削除した行は再利用）
+検索は行列をブロックごとに読み、argpartition で上位だけを残すため全体をメモリに載せない
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app_settings import get_cache_dir
+from vault_scan import SCAN_WORKERS, get_tags, parse_frontmatter, scan_markdown_files, split_frontmatter
+
+# 検索時に一度に読む行数
+SEARCH_BLOCK_ROWS = 16384
+
+# 並行して埋め込みを計算してから登録するノート数
+EMBED_BATCH_SIZE = 256
+
+
+class VectorHit(NamedTuple):
+    key: str
+    label: str
+    score: float
+
+
+class VectorStore:
+    """float16のベクトル行列（メモリマップ）とキーの対応表"""
+
+    def __init__(self, directory: str, dimensions: int, embedder_name: str):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.dimensions = dimensions
+        self.embedder_name = embedder_name
+        self.matrix_path = os.path.join(directory, 'vectors.f16')
+        self._row_bytes = dimensions * np.dtype(np.float16).itemsize
+        self._lock = threading.RLock()
+        self._conn = None
+        self._matrix = None
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(os.path.join(self.directory, 'rows.sqlite3'), check_same_thread=False)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS rows (
+                    row INTEGER PRIMARY KEY,
+                    key TEXT UNIQUE NOT NULL,
+                    label TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS free_rows (
+                    row INTEGER PRIMARY KEY
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+            meta = dict(self._conn.execute("SELECT name, value FROM meta").fetchall())
+            layout = {'dimensions': str(self.dimensions), 'embedder': self.embedder_name}
+            if any(meta.get(name) != value for name, value in layout.items()):
+                # 埋め込み方式が変わったベクトルは比較できないため作り直す
+                if meta:
+                    self.logger.info(f"埋め込み方式が変わったためベクトルを作り直します: {self.embedder_name}")
+                with self._conn:
+                    self._conn.execute("DELETE FROM rows")
+                    self._conn.execute("DELETE FROM free_rows")
+                    self._conn.execute("DELETE FROM meta")
+                    self._conn.executemany("INSERT INTO meta (name, value) VALUES (?, ?)", layout.items())
+                open(self.matrix_path, 'wb').close()
+            self._repair_matrix_size()
+        return self._conn
+
+    def _repair_matrix_size(self):
+        """書き込み途中で止まった場合に、行列ファイルの長さを対応表に合わせる"""
+        expected = self._row_count() * self._row_bytes
+        if not os.path.exists(self.matrix_path):
+            open(self.matrix_path, 'wb').close()
+        actual = os.path.getsize(self.matrix_path)
+        if actual != expected:
+            with open(self.matrix_path, 'r+b') as f:
+                f.truncate(expected)
+
+    def _row_count(self) -> int:
+        row = self._conn.execute(
+            "SELECT MAX(m) FROM (SELECT MAX(row) AS m FROM rows UNION ALL SELECT MAX(row) FROM free_rows)"
+        ).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def get_meta(self, name: str) -> Optional[str]:
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name: str, value: str):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def file_stats(self) -> Dict[str, Tuple[int, int]]:
+        """登録済みキーの {キー: (更新時刻ns, サイズ)}"""
+        with self._lock:
+            return {key: (mtime_ns, size) for key, mtime_ns, size in
+                    self._connect().execute("SELECT key, mtime_ns, size FROM rows")}
+
+    def registered_rows(self) -> np.ndarray:
+        """登録済みの行番号（昇順）"""
+        with self._lock:
+            rows = [row for row, in self._connect().execute("SELECT row FROM rows ORDER BY row")]
+        return np.asarray(rows, dtype=np.int64)
+
+    def matrix(self) -> np.ndarray:
+        """ベクトル行列（読み取り専用のメモリマップ、削除済みの行はゼロ）"""
+        with self._lock:
+            self._connect()
+            rows = self._row_count()
+            if self._matrix is None or self._matrix.shape[0] != rows:
+                if rows == 0:
+                    self._matrix = np.zeros((0, self.dimensions), dtype=np.float16)
+                else:
+                    self._matrix = np.memmap(self.matrix_path, dtype=np.float16, mode='r',
+                                             shape=(rows, self.dimensions))
+            return self._matrix
+
+    def _write_row(self, f, row: int, vector: np.ndarray):
+        f.seek(row * self._row_bytes)
+        f.write(np.asarray(vector, dtype=np.float16).tobytes())
+
+    def upsert_many(self, items: Iterable[Tuple[str, str, np.ndarray, int, int]]) -> List[int]:
+        """(キー, 表示名, ベクトル, 更新時刻ns, サイズ) を登録し、書き込んだ行番号を返す"""
+        written = []
+        with self._lock:
+            conn = self._connect()
+            with conn, open(self.matrix_path, 'r+b') as f:
+                for key, label, vector, mtime_ns, size in items:
+                    existing = conn.execute("SELECT row FROM rows WHERE key = ?", (key,)).fetchone()
+                    if existing:
+                        row = existing[0]
+                    else:
+                        free = conn.execute("SELECT row FROM free_rows LIMIT 1").fetchone()
+                        if free:
+                            row = free[0]
+                            conn.execute("DELETE FROM free_rows WHERE row = ?", (row,))
+                        else:
+                            row = self._row_count()
+                    self._write_row(f, row, vector)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO rows (row, key, label, mtime_ns, size) VALUES (?, ?, ?, ?, ?)",
+                        (row, key, label, mtime_ns, size),
+                    )
+                    written.append(row)
+            self._matrix = None
+        return written
+
+    def delete_many(self, keys: Iterable[str]) -> List[int]:
+        """キーを削除し、空いた行番号を返す（行はゼロで埋めて再利用する）"""
+        freed = []
+        zero = np.zeros(self.dimensions, dtype=np.float16)
+        with self._lock:
+            conn = self._connect()
+            with conn, open(self.matrix_path, 'r+b') as f:
+                for key in keys:
+                    existing = conn.execute("SELECT row FROM rows WHERE key = ?", (key,)).fetchone()
+                    if not existing:
+                        continue
+                    self._write_row(f, existing[0], zero)
+                    conn.execute("DELETE FROM rows WHERE row = ?", existing)
+                    conn.execute("INSERT OR IGNORE INTO free_rows (row) VALUES (?)", existing)
+                    freed.append(existing[0])
+            self._matrix = None
+        return freed
+
+    def lookup(self, rows: List[int]) -> Dict[int, Tuple[str, str]]:
+        """行番号から (キー, 表示名)"""
+        if not rows:
+            return {}
+        with self._lock:
+            return {row: (key, label) for row, key, label in self._connect().execute(
+                f"SELECT row, key, label FROM rows WHERE row IN ({','.join('?' * len(rows))})", rows)}
+
+    def search(self, query: np.ndarray, top_k: int = 10) -> List[VectorHit]:
+        """コサイン類似度（ベクトルは正規化済み）の上位を返す"""
+        matrix = self.matrix()
+        if matrix.shape[0] == 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32)
+        # 削除済みの行（ゼロベクトル）が混ざっても足りるよう多めに候補を残す
+        keep = top_k + 8
+        candidate_rows, candidate_scores = [], []
+        for start in range(0, matrix.shape[0], SEARCH_BLOCK_ROWS):
+            scores = matrix[start:start + SEARCH_BLOCK_ROWS].astype(np.float32) @ query
+            if scores.shape[0] > keep:
+                best = np.argpartition(-scores, keep - 1)[:keep]
+            else:
+                best = np.arange(scores.shape[0])
+            candidate_rows.append(best + start)
+            candidate_scores.append(scores[best])
+
+        return self.top_hits(np.concatenate(candidate_rows), np.concatenate(candidate_scores), top_k)
+
+    def top_hits(self, rows: np.ndarray, scores: np.ndarray, top_k: int) -> List[VectorHit]:
+        """候補の行から上位 top_k 件を、登録済みの行だけに絞って返す"""
+        order = np.argsort(-scores)
+        labels = self.lookup([int(row) for row in rows[order[:top_k + 8]]])
+        hits = []
+        for index in order:
+            row = int(rows[index])
+            if row in labels:
+                key, label = labels[row]
+                hits.append(VectorHit(key, label, float(scores[index])))
+                if len(hits) >= top_k:
+                    break
+        return hits
+
+
+class SemanticNoteIndex:
+    """Vaultのノートをベクトル化して保持し、意味的に近いノートを検索"""
+
+    def __init__(self, vault_path: str, embedder, refresh_interval: float = 600,
+                 config: Optional[Dict] = None):
+        self.logger = logging.getLogger(__name__)
+        self.vault_path = vault_path
+        self.embedder = embedder
+        self.refresh_interval = refresh_interval
+
+        vault_hash = hashlib.sha256(os.path.abspath(vault_path).encode('utf-8')).hexdigest()[:12]
+        self.store = VectorStore(os.path.join(get_cache_dir(), f'vectors-{vault_hash}'),
+                                 embedder.dimensions, embedder.name)
+        # ノート数が多い場合の近似最近傍索引（少ないうちは全件検索）
+        from ivf_index import IVFIndex
+        self.ann = IVFIndex.from_config(self.store, config or {})
+
+    @classmethod
+    def from_config(cls, vault_path: str, config: Dict) -> 'SemanticNoteIndex':
+        """config.yaml の semantic_search・note_index セクションから生成"""
+        from embedders import get_embedder
+        settings = config.get('note_index', {}) or {}
+        return cls(vault_path, get_embedder(config),
+                   refresh_interval=settings.get('refresh_interval_seconds', 600), config=config)
+
+    def _prepare(self, path: str) -> Tuple[str, str]:
+        """ノートを読み込み (表示名, 埋め込み用テキスト) を返す（並行実行される）"""
+        title = os.path.splitext(os.path.basename(path))[0]
+        try:
+            with open(os.path.join(self.vault_path, path), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            self.logger.debug(f"ベクトル化をスキップ: {path}: {e}")
+            return title, ''
+
+        header, body = split_frontmatter(text)
+        meta = parse_frontmatter(header)
+        if isinstance(meta.get('title'), str) and meta['title']:
+            title = meta['title']
+        return title, '\n'.join([title, ' '.join(get_tags(meta)), body])
+
+    def _index(self, paths: List[str], stats: Dict[str, Tuple[int, int]]):
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            for start in range(0, len(paths), EMBED_BATCH_SIZE):
+                batch = paths[start:start + EMBED_BATCH_SIZE]
+                prepared = list(executor.map(self._prepare, batch))
+                vectors = self.embedder.embed_many([text for _, text in prepared])
+                rows = self.store.upsert_many(
+                    (path, title, vector, *stats[path])
+                    for path, (title, _), vector in zip(batch, prepared, vectors)
+                )
+                self.ann.add(rows, vectors)
+
+    def refresh(self, force: bool = False):
+        """前回の走査から refresh_interval 秒以上経っていれば、変更されたノートをベクトル化し直す"""
+        if not os.path.isdir(self.vault_path):
+            self.logger.warning(f"Vaultが見つからないため前回のベクトルを使用: {self.vault_path}")
+            return
+
+        last_refresh = float(self.store.get_meta('last_refresh') or 0)
+        if not force and time.time() - last_refresh < self.refresh_interval:
+            return
+
+        current = scan_markdown_files(self.vault_path)
+        indexed = self.store.file_stats()
+        removed = [path for path in indexed if path not in current]
+        changed = [path for path, stat in current.items() if indexed.get(path) != stat]
+
+        self.ann.remove(self.store.delete_many(removed))
+        self._index(changed, current)
+        self.ann.ensure()
+        self.store.set_meta('last_refresh', str(time.time()))
+
+        if removed or changed:
+            self.logger.info(f"ベクトルを更新: 変更・追加 {len(changed)}件, 削除 {len(removed)}件")
+
+    def add_file(self, file_path: str):
+        """保存したノートをすぐにベクトル化して登録"""
+        try:
+            stat = os.stat(file_path)
+            path = os.path.relpath(file_path, self.vault_path)
+            self._index([path], {path: (stat.st_mtime_ns, stat.st_size)})
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f"ベクトルの登録に失敗: {e}")
+
+    def search(self, content: str, top_k: int = 10) -> List[VectorHit]:
+        """メモ内容に意味的に近いノートを返す
+
+        ベクトル化・近似最近傍索引の学習（refresh）は行わず、登録済みのノートだけを調べる
+        """
+        return self.ann.search(self.embedder.embed(content), top_k=top_k)